@@ -3,26 +3,41 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from typing import Optional
 from app.database import get_db
-from app.utils.security import verify_token
+from app.models.user import User
+from app.utils.security import decode_token
 from app.services.auth_service import AuthService
 
 security = HTTPBearer()
 optional_security = HTTPBearer(auto_error=False)
 
+def _credentials_exception():
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+def _user_from_claims(db: Session, claims: dict) -> Optional[User]:
+    if "uid" in claims:
+        return db.get(User, claims["uid"])
+    # Tokens issued before uid was embedded
+    return AuthService.get_user_by_username(db, username=claims["sub"])
+
+def _user_id_from_claims(db: Session, claims: dict) -> Optional[int]:
+    if "uid" in claims:
+        return claims["uid"]
+    user = AuthService.get_user_by_username(db, username=claims["sub"])
+    return user.user_id if user else None
+
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
 ):
     """Required authentication - raises 401 if not authenticated"""
-    token = credentials.credentials
-    username = verify_token(token)
-    if username is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    user = AuthService.get_user_by_username(db, username=username)
+    claims = decode_token(credentials.credentials)
+    if claims is None:
+        raise _credentials_exception()
+    user = _user_from_claims(db, claims)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return user
@@ -35,10 +50,51 @@ def get_current_user_optional(
     if credentials is None:
         return None
 
-    token = credentials.credentials
-    username = verify_token(token)
-    if username is None:
+    claims = decode_token(credentials.credentials)
+    if claims is None:
         return None
+    return _user_from_claims(db, claims)
 
-    user = AuthService.get_user_by_username(db, username=username)
-    return user
+def get_current_user_id(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db)
+) -> int:
+    """Required authentication for routes that only need the caller's id - no User is loaded"""
+    claims = decode_token(credentials.credentials)
+    if claims is None:
+        raise _credentials_exception()
+    user_id = _user_id_from_claims(db, claims)
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user_id
+
+def get_current_user_id_optional(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    db: Session = Depends(get_db)
+) -> Optional[int]:
+    """Optional authentication returning only the caller's id, or None"""
+    if credentials is None:
+        return None
+
+    claims = decode_token(credentials.credentials)
+    if claims is None:
+        return None
+    return _user_id_from_claims(db, claims)
+
+def get_current_token_claims(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> dict:
+    """Required authentication returning the verified token claims (uid, sid, ...)"""
+    claims = decode_token(credentials.credentials)
+    if claims is None or "uid" not in claims:
+        raise _credentials_exception()
+    return claims
+
+def get_current_session_id(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> Optional[int]:
+    """The session the access token was issued for, None for tokens from before sessions"""
+    claims = decode_token(credentials.credentials)
+    if claims is None:
+        raise _credentials_exception()
+    return claims.get("sid")
@@ -1,13 +1,44 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
-from app.database import get_db
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import func, desc, and_, or_, case
+from datetime import datetime
+from typing import List, Optional
+import os
+import time
+from app.database import get_db, SessionLocal
 from app.api.deps import get_current_user
+from app.api.v1.users import USER_RESPONSE_COLUMNS
 from app.models.user import User
 from app.models.post import Post
 from app.models.comment import Comment
+from app.models.moderation import (
+    ModerationItem,
+    MODERATION_PENDING,
+    MODERATION_CLAIMED,
+    MODERATION_RESOLVED,
+    MODERATION_OPEN_STATUSES
+)
+from app.models.moderation_rule import ModerationRule
+from app.models.model_version import ModelVersion, MODEL_ACTIVE, MODEL_CANDIDATE, MODEL_RETIRED
+from app.schemas.moderation import ModerationResolve, ModerationRuleCreate, ModerationRuleUpdate, ModerationRuleResponse
+from app.schemas.user import UserResponse
+from app.schemas.model_version import ModelVersionCreate, ModelVersionUpdate, ModelVersionResponse
+from app.services.ai_service import ai_service
+from app.config import settings
+from app.utils.serialization import rows_to_dicts, fast_json_response
+from app.utils.moderation import claim_moderation_items, resolve_moderation, reevaluate_needs_review
+from app.utils.rules import validate_conditions, get_active_ruleset, invalidate_ruleset_cache
+from app.utils.export import EXPORT_KINDS, EXPORT_FORMATS, iter_export_rows, iter_export_chunks
+from app.utils.metrics import login_latency
+from app.utils.security import password_hasher_stats
+from app.utils.prefork import process_memory
+from app.utils.inference import inference_stats
+from app.utils.profiling import ProfiledRoute, list_captures, capture_path
+from app.utils.query_budget import query_budget
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 def verify_admin(current_user: User = Depends(get_current_user)):
     """Dependency to verify user is an admin"""
@@ -36,65 +67,66 @@ def get_admin_stats(
     # Total comments
     total_comments = db.query(func.count(Comment.comment_id)).scalar()
 
-    # Posts needing review (manually flagged OR highly negative sentiment)
-    posts_needing_review = db.query(func.count(Post.post_id)).filter(
-        Post.is_deleted == False,
-        (
-            (Post.is_flagged == True) |
-            ((Post.sentiment_label == "negative") & (Post.sentiment_confidence > 0.8))
-        )
-    ).scalar()
+    # Open moderation queue items per content type, counted off the queue index
+    needing_review = dict(db.query(ModerationItem.content_type, func.count(ModerationItem.item_id)).filter(
+        ModerationItem.status.in_(MODERATION_OPEN_STATUSES)
+    ).group_by(ModerationItem.content_type).all())
 
     return {
         "total_users": total_users,
         "total_posts": total_posts,
         "total_comments": total_comments,
-        "posts_needing_review": posts_needing_review
+        "posts_needing_review": needing_review.get("post", 0),
+        "comments_needing_review": needing_review.get("comment", 0)
     }
 
-@router.get("/recent-users")
+@router.get("/recent-users", response_model=List[UserResponse])
+@query_budget(2)
 def get_recent_users(
     limit: int = 10,
     db: Session = Depends(get_db),
     current_user: User = Depends(verify_admin)
 ):
     """Get recently registered users"""
-    users = db.query(User).order_by(
+    users = db.query(*USER_RESPONSE_COLUMNS).order_by(
         desc(User.created_at)
     ).limit(limit).all()
 
-    return users
+    return fast_json_response(rows_to_dicts(users))
 
 @router.get("/flagged-posts")
+@query_budget(2)
 def get_flagged_posts(
     skip: int = 0,
     limit: int = 20,
     db: Session = Depends(get_db),
     current_user: User = Depends(verify_admin)
 ):
-    """Get manually flagged posts or AI-detected negative posts"""
-    # FIXED: Specify the join condition explicitly
-    posts = db.query(Post).join(User, Post.user_id == User.user_id).filter(
-        Post.is_deleted == False,
-        (
-            (Post.is_flagged == True) |  # Manually flagged
-            ((Post.sentiment_label == "negative") & (Post.sentiment_confidence > 0.8))  # AI flagged
-        )
-    ).order_by(desc(Post.created_at)).offset(skip).limit(limit).all()
-
-    # Format response with user info
-    return [{
-        "post_id": post.post_id,
-        "title": post.title,
-        "content": post.content,
-        "user_id": post.user_id,
-        "user_name": post.user.user_name,
-        "sentiment_label": post.sentiment_label,
-        "sentiment_confidence": post.sentiment_confidence,
-        "is_flagged": post.is_flagged,
-        "flagged_at": post.flagged_at,
-        "created_at": post.created_at
-    } for post in posts]
+    """Get manually flagged or AI-detected posts awaiting review, highest priority first"""
+    rows = db.query(
+        ModerationItem.item_id,
+        ModerationItem.reason,
+        ModerationItem.priority,
+        ModerationItem.status,
+        Post.post_id,
+        Post.title,
+        Post.content,
+        Post.user_id,
+        User.user_name,
+        Post.sentiment_label,
+        Post.sentiment_confidence,
+        Post.is_flagged,
+        Post.flagged_at,
+        Post.created_at
+    ).select_from(ModerationItem).join(
+        Post, Post.post_id == ModerationItem.content_id
+    ).join(User, Post.user_id == User.user_id).filter(
+        ModerationItem.content_type == "post",
+        ModerationItem.status.in_(MODERATION_OPEN_STATUSES),
+        Post.is_deleted == False
+    ).order_by(desc(ModerationItem.priority), desc(ModerationItem.item_id)).offset(skip).limit(limit).all()
+
+    return fast_json_response(rows_to_dicts(rows))
 
 @router.delete("/posts/{post_id}")
 def admin_delete_post(
@@ -108,6 +140,7 @@ def admin_delete_post(
         raise HTTPException(status_code=404, detail="Post not found")
 
     post.is_deleted = True
+    resolve_moderation(db, "post", post_id, current_user.user_id, "removed")
     db.commit()
 
     return {"message": "Post deleted successfully"}
@@ -139,6 +172,7 @@ def toggle_admin_status(
     }
 
 @router.get("/users")
+@query_budget(3)
 def get_all_users(
     skip: int = 0,
     limit: int = 50,
@@ -147,7 +181,7 @@ def get_all_users(
     current_user: User = Depends(verify_admin)
 ):
     """Get all users with optional search"""
-    query = db.query(User)
+    query = db.query(*USER_RESPONSE_COLUMNS)
 
     if search:
         query = query.filter(
@@ -156,11 +190,439 @@ def get_all_users(
         )
 
     users = query.offset(skip).limit(limit).all()
-    total = query.count()
+    total = query.with_entities(func.count(User.user_id)).scalar()
 
-    return {
-        "users": users,
+    return fast_json_response({
+        "users": rows_to_dicts(users),
         "total": total,
         "skip": skip,
         "limit": limit
+    })
+
+@router.get("/export")
+def export_data(
+    kind: str = "posts",
+    format: str = "ndjson",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    sentiment: Optional[str] = None,
+    current_user: User = Depends(verify_admin)
+):
+    """Stream all posts or comments with their analysis fields as NDJSON or CSV"""
+    if kind not in EXPORT_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of: {', '.join(EXPORT_KINDS)}")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+
+    def stream():
+        # Own session: it must stay open for as long as the response is streaming
+        db = SessionLocal()
+        try:
+            rows = iter_export_rows(db, kind, since=since, until=until, sentiment=sentiment)
+            yield from iter_export_chunks(rows, format, kind)
+        finally:
+            db.close()
+
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+    filename = f"{kind}-{datetime.utcnow():%Y%m%d%H%M%S}.{format}"
+    return StreamingResponse(
+        stream(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.get("/metrics")
+def get_metrics(current_user: User = Depends(verify_admin)):
+    """Login latency distribution, password hashing queue state, and this worker's memory, inference threads, analysis cache and cascade"""
+    return {
+        "login_latency": login_latency.snapshot(),
+        "password_hasher": password_hasher_stats(),
+        "worker": {
+            "pid": os.getpid(),
+            "memory": process_memory(os.getpid()),
+            "inference": inference_stats(),
+            "analysis_cache": ai_service.cache_stats(),
+            "cascade": ai_service.cascade_stats()
+        }
+    }
+
+@router.get("/profiles")
+def list_profiles(current_user: User = Depends(verify_admin)):
+    """Request profile captures (X-Profile or sampled) on this server, newest first"""
+    return list_captures()
+
+@router.get("/profiles/{name}")
+def get_profile(name: str, current_user: User = Depends(verify_admin)):
+    """Download a capture: .prof for pstats/snakeviz, .html from pyinstrument"""
+    path = capture_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile capture not found")
+    media_type = "text/html" if name.endswith(".html") else "application/octet-stream"
+    return FileResponse(path, media_type=media_type, filename=name)
+
+
+def _content_column(name: str):
+    """A column of the queued post or comment, whichever the item refers to"""
+    return func.coalesce(getattr(Post, name), getattr(Comment, name)).label(name)
+
+def moderation_rows(db: Session, *criteria, limit: int):
+    """Queue items with their post or comment, highest priority first"""
+    return db.query(
+        ModerationItem.item_id,
+        ModerationItem.content_type,
+        ModerationItem.content_id,
+        ModerationItem.post_id,
+        ModerationItem.reason,
+        ModerationItem.priority,
+        ModerationItem.status,
+        ModerationItem.created_at,
+        ModerationItem.claimed_by,
+        ModerationItem.claimed_at,
+        _content_column("user_id"),
+        _content_column("content"),
+        _content_column("sentiment_label"),
+        _content_column("sentiment_confidence"),
+        _content_column("is_sarcastic"),
+        _content_column("sarcasm_confidence"),
+        Post.title
+    ).select_from(ModerationItem).outerjoin(
+        Post, and_(ModerationItem.content_type == "post", Post.post_id == ModerationItem.content_id)
+    ).outerjoin(
+        Comment, and_(ModerationItem.content_type == "comment", Comment.comment_id == ModerationItem.content_id)
+    ).filter(*criteria).order_by(
+        desc(ModerationItem.priority),
+        desc(ModerationItem.item_id)
+    ).limit(limit).all()
+
+def parse_moderation_cursor(cursor: str):
+    try:
+        priority, item_id = (int(part) for part in cursor.split(":"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return priority, item_id
+
+@router.get("/moderation")
+@query_budget(2)
+def get_moderation_queue(
+    status_filter: str = Query(MODERATION_PENDING, alias="status"),
+    content_type: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(verify_admin)
+):
+    """Page through the moderation queue by priority; pass next_cursor to get the next page"""
+    if status_filter not in (MODERATION_PENDING, MODERATION_CLAIMED, MODERATION_RESOLVED):
+        raise HTTPException(status_code=400, detail="Invalid status")
+
+    criteria = [ModerationItem.status == status_filter]
+    if content_type:
+        criteria.append(ModerationItem.content_type == content_type)
+    if cursor:
+        priority, item_id = parse_moderation_cursor(cursor)
+        criteria.append(or_(
+            ModerationItem.priority < priority,
+            and_(ModerationItem.priority == priority, ModerationItem.item_id < item_id)
+        ))
+
+    items = rows_to_dicts(moderation_rows(db, *criteria, limit=limit))
+    next_cursor = f"{items[-1]['priority']}:{items[-1]['item_id']}" if len(items) == limit else None
+    return fast_json_response({"items": items, "next_cursor": next_cursor})
+
+@router.post("/moderation/claim")
+def claim_moderation(
+    limit: int = Query(10, ge=1, le=100),
+    content_type: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(verify_admin)
+):
+    """Claim the next highest-priority pending items for review"""
+    item_ids = claim_moderation_items(
+        db,
+        current_user.user_id,
+        limit,
+        settings.MODERATION_CLAIM_TIMEOUT_MINUTES,
+        content_type
+    )
+    if not item_ids:
+        return {"items": []}
+    items = moderation_rows(
+        db,
+        ModerationItem.item_id.in_(item_ids),
+        ModerationItem.claimed_by == current_user.user_id,
+        limit=limit
+    )
+    return fast_json_response({"items": rows_to_dicts(items)})
+
+def get_open_item(db: Session, item_id: int, moderator_id: int) -> ModerationItem:
+    """An open queue item that isn't claimed by another moderator"""
+    item = db.query(ModerationItem).filter(ModerationItem.item_id == item_id).first()
+    if not item:
+        raise HTTPException(status_code=404, detail="Moderation item not found")
+    if item.status == MODERATION_RESOLVED:
+        raise HTTPException(status_code=400, detail="Moderation item is already resolved")
+    if item.status == MODERATION_CLAIMED and item.claimed_by != moderator_id:
+        raise HTTPException(status_code=409, detail="Moderation item is claimed by another moderator")
+    return item
+
+@router.post("/moderation/{item_id}/resolve")
+def resolve_moderation_item(
+    item_id: int,
+    request: ModerationResolve,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(verify_admin)
+):
+    """Approve or remove the content of a queue item"""
+    item = get_open_item(db, item_id, current_user.user_id)
+
+    if item.content_type == "post":
+        post = db.query(Post).filter(Post.post_id == item.content_id).first()
+        if post:
+            if request.resolution == "removed":
+                post.is_deleted = True
+            else:
+                post.is_flagged = False
+                post.flagged_at = None
+                post.flagged_by = None
+    elif request.resolution == "removed":
+        comment = db.query(Comment).filter(Comment.comment_id == item.content_id).first()
+        if comment:
+            db.delete(comment)
+
+    item.status = MODERATION_RESOLVED
+    item.resolution = request.resolution
+    item.resolved_by = current_user.user_id
+    item.resolved_at = datetime.utcnow()
+    db.commit()
+
+    return {"message": f"Content {request.resolution}", "item_id": item_id}
+
+@router.post("/moderation/{item_id}/release")
+def release_moderation_item(
+    item_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(verify_admin)
+):
+    """Give a claimed item back to the queue"""
+    item = get_open_item(db, item_id, current_user.user_id)
+    item.status = MODERATION_PENDING
+    item.claimed_by = None
+    item.claimed_at = None
+    db.commit()
+
+    return {"message": "Moderation item released", "item_id": item_id}
+
+
+def _validated_conditions(conditions) -> List[dict]:
+    try:
+        return validate_conditions([condition.model_dump() for condition in conditions])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _save_rule(db: Session, rule: ModerationRule) -> ModerationRule:
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="A rule with this name already exists")
+    db.refresh(rule)
+    invalidate_ruleset_cache()
+    return rule
+
+@router.get("/moderation/rules", response_model=List[ModerationRuleResponse])
+def get_moderation_rules(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(verify_admin)
+):
+    """List moderation rules; content needs review when any enabled rule matches"""
+    return db.query(ModerationRule).order_by(ModerationRule.rule_id).all()
+
+@router.post("/moderation/rules", response_model=ModerationRuleResponse)
+def create_moderation_rule(
+    rule: ModerationRuleCreate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(verify_admin)
+):
+    """Add a rule; it applies to new analyses right away and to stored ones after /moderation/rules/reevaluate"""
+    db_rule = ModerationRule(name=rule.name, conditions=_validated_conditions(rule.conditions), enabled=rule.enabled)
+    db.add(db_rule)
+    return _save_rule(db, db_rule)
+
+@router.put("/moderation/rules/{rule_id}", response_model=ModerationRuleResponse)
+def update_moderation_rule(
+    rule_id: int,
+    rule_update: ModerationRuleUpdate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(verify_admin)
+):
+    rule = db.query(ModerationRule).filter(ModerationRule.rule_id == rule_id).first()
+    if not rule:
+        raise HTTPException(status_code=404, detail="Rule not found")
+
+    if rule_update.name is not None:
+        rule.name = rule_update.name
+    if rule_update.conditions is not None:
+        rule.conditions = _validated_conditions(rule_update.conditions)
+    if rule_update.enabled is not None:
+        rule.enabled = rule_update.enabled
+    return _save_rule(db, rule)
+
+@router.delete("/moderation/rules/{rule_id}")
+def delete_moderation_rule(
+    rule_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(verify_admin)
+):
+    rule = db.query(ModerationRule).filter(ModerationRule.rule_id == rule_id).first()
+    if not rule:
+        raise HTTPException(status_code=404, detail="Rule not found")
+
+    db.delete(rule)
+    db.commit()
+    invalidate_ruleset_cache()
+    return {"message": "Rule deleted successfully"}
+
+@router.post("/moderation/rules/reevaluate")
+def reevaluate_moderation_rules(
+    dry_run: bool = False,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(verify_admin)
+):
+    """
+    Re-apply the enabled rules to every stored analysis, updating needs_review
+    and the queue. With dry_run, only count what the rules would flag.
+    """
+    invalidate_ruleset_cache()
+    ruleset = get_active_ruleset(db)
+
+    if dry_run:
+        counts = {}
+        for content_type, model in (("post", Post), ("comment", Comment)):
+            query = db.query(
+                func.coalesce(func.sum(case((ruleset.sql_predicate(model), 1), else_=0)), 0).label("would_need_review"),
+                func.coalesce(func.sum(case((model.needs_review == True, 1), else_=0)), 0).label("need_review")
+            ).select_from(model).filter(model.sentiment_label.isnot(None))
+            if model is Post:
+                query = query.filter(Post.is_deleted == False)
+            counts[content_type] = rows_to_dicts([query.one()])[0]
+        return counts
+
+    start = time.perf_counter()
+    results = {content_type: reevaluate_needs_review(db, ruleset, content_type) for content_type in ("post", "comment")}
+    results["seconds"] = round(time.perf_counter() - start, 3)
+    return results
+
+
+def _current_candidate(db: Session) -> ModelVersion:
+    candidate = db.query(ModelVersion).filter(ModelVersion.status == MODEL_CANDIDATE).first()
+    if not candidate:
+        raise HTTPException(status_code=404, detail="No candidate model version")
+    return candidate
+
+@router.get("/models")
+def get_model_versions(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(verify_admin)
+):
+    """Registered model versions, and what the worker serving this request runs and has measured"""
+    versions = db.query(ModelVersion).order_by(desc(ModelVersion.version_id)).all()
+    return {
+        "versions": [ModelVersionResponse.model_validate(version) for version in versions],
+        "worker": {"pid": os.getpid(), **ai_service.status()}
     }
+
+@router.post("/models", response_model=ModelVersionResponse)
+def register_candidate_model(
+    version: ModelVersionCreate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(verify_admin)
+):
+    """
+    Register a candidate; every worker loads it in the background next to the
+    active models and gives it traffic_percent of requests, in shadow or split routing.
+    """
+    if db.query(ModelVersion.version_id).filter(ModelVersion.status == MODEL_CANDIDATE).first():
+        raise HTTPException(status_code=409, detail="A candidate is already registered, promote or discard it first")
+
+    active = db.query(ModelVersion).filter(ModelVersion.status == MODEL_ACTIVE).order_by(desc(ModelVersion.version_id)).first()
+    if not active:
+        raise HTTPException(status_code=409, detail="The active models are not registered yet, retry shortly")
+
+    candidate = ModelVersion(
+        sentiment_model=version.sentiment_model or active.sentiment_model,
+        sentiment_revision=version.sentiment_revision if version.sentiment_model else active.sentiment_revision,
+        sarcasm_model=version.sarcasm_model or active.sarcasm_model,
+        sarcasm_revision=version.sarcasm_revision if version.sarcasm_model else active.sarcasm_revision,
+        status=MODEL_CANDIDATE,
+        routing=version.routing,
+        traffic_percent=version.traffic_percent
+    )
+    db.add(candidate)
+    db.commit()
+    db.refresh(candidate)
+
+    ai_service.forget_failures()
+    ai_service.request_sync()
+    return candidate
+
+@router.put("/models/candidate", response_model=ModelVersionResponse)
+def update_candidate_model(
+    version_update: ModelVersionUpdate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(verify_admin)
+):
+    """Change how much traffic the candidate gets, or switch it between shadow and split routing"""
+    candidate = _current_candidate(db)
+    if version_update.routing is not None:
+        candidate.routing = version_update.routing
+    if version_update.traffic_percent is not None:
+        candidate.traffic_percent = version_update.traffic_percent
+    db.commit()
+    db.refresh(candidate)
+
+    ai_service.request_sync()
+    return candidate
+
+@router.post("/models/candidate/promote", response_model=ModelVersionResponse)
+def promote_candidate_model(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(verify_admin)
+):
+    """
+    Make the candidate the active version. Workers that already loaded it swap
+    immediately, the rest keep serving the old models until they have.
+    """
+    candidate = _current_candidate(db)
+    loaded = ai_service.status()["candidate"]
+    if not loaded or loaded["version_id"] != candidate.version_id or loaded["state"] != "ready":
+        raise HTTPException(
+            status_code=409,
+            detail=f"The candidate is not loaded yet ({loaded['state'] if loaded else 'pending'}), retry once it is"
+        )
+
+    now = datetime.utcnow()
+    db.query(ModelVersion).filter(ModelVersion.status == MODEL_ACTIVE).update({
+        ModelVersion.status: MODEL_RETIRED,
+        ModelVersion.retired_at: now
+    }, synchronize_session=False)
+    candidate.status = MODEL_ACTIVE
+    candidate.promoted_at = now
+    candidate.traffic_percent = 100
+    db.commit()
+    db.refresh(candidate)
+
+    ai_service.request_sync()
+    return candidate
+
+@router.delete("/models/candidate")
+def discard_candidate_model(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(verify_admin)
+):
+    candidate = _current_candidate(db)
+    candidate.status = MODEL_RETIRED
+    candidate.retired_at = datetime.utcnow()
+    db.commit()
+
+    ai_service.request_sync()
+    return {"message": "Candidate discarded"}
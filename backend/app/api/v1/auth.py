@@ -1,58 +1,91 @@
 from datetime import timedelta
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.orm import Session
 from sqlalchemy import func
+from starlette.concurrency import run_in_threadpool
+from typing import List
 from app.database import get_db
-from app.schemas.user import UserCreate, UserLogin, UserResponse, Token
+from app.api.deps import get_current_token_claims
+from app.schemas.user import UserCreate, UserLogin, UserResponse, Token, RefreshRequest, SessionResponse
 from app.services.auth_service import AuthService
-from app.utils.security import create_access_token
+from app.services.session_service import SessionService
+from app.utils.security import create_access_token, get_password_hash_async, PasswordHasherBusy
+from app.utils.metrics import login_latency
 from app.config import settings
 from app.models.user import User
+from app.utils.profiling import ProfiledRoute
 import logging
+import time
 
 logger = logging.getLogger(__name__)
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
+
+def _user_exists(db: Session, user_name: str, user_email: str) -> bool:
+    return db.query(User).filter(
+        (User.user_name == user_name) | (User.user_email == user_email)
+    ).first() is not None
+
+def _create_user(db: Session, user: UserCreate, hashed_password: str) -> User:
+    """Create the user; the first user to register becomes admin"""
+    db_user = AuthService.create_user(db, user.user_name, user.user_email, hashed_password)
+
+    # Try to make first user admin (non-critical operation)
+    try:
+        user_count = db.query(func.count(User.user_id)).scalar()
+        if user_count == 1:  # This is the first user
+            db_user.is_admin = True
+            db.commit()
+            db.refresh(db_user)
+            logger.info(f"First user {db_user.user_name} created with admin privileges")
+    except Exception as e:
+        logger.warning(f"Could not check/set admin status: {e}")
+        # Continue anyway - user is still created
+
+    return db_user
 
 @router.post("/register", response_model=UserResponse)
-def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: Session = Depends(get_db)):
+    # Async so the bcrypt wait happens in the hashing pool, not on a request thread
     try:
         # Check if user already exists
-        existing_user = db.query(User).filter(
-            (User.user_name == user.user_name) | (User.user_email == user.user_email)
-        ).first()
-        if existing_user:
+        if await run_in_threadpool(_user_exists, db, user.user_name, user.user_email):
             raise HTTPException(status_code=400, detail="Username or email already exists")
 
-        # Create the user first
-        db_user = AuthService.create_user(db, user.user_name, user.user_email, user.password)
-
-        # Try to make first user admin (non-critical operation)
-        try:
-            user_count = db.query(func.count(User.user_id)).scalar()
-            if user_count == 1:  # This is the first user
-                db_user.is_admin = True
-                db.commit()
-                db.refresh(db_user)
-                logger.info(f"First user {db_user.user_name} created with admin privileges")
-        except Exception as e:
-            logger.warning(f"Could not check/set admin status: {e}")
-            # Continue anyway - user is still created
+        hashed_password = await get_password_hash_async(user.password)
+        return await run_in_threadpool(_create_user, db, user, hashed_password)
 
-        return db_user
-
-    except HTTPException:
+    except (HTTPException, PasswordHasherBusy):
         raise
     except Exception as e:
         logger.error(f"Registration error: {str(e)}")
-        db.rollback()
+        await run_in_threadpool(db.rollback)
         raise HTTPException(
             status_code=500,
             detail=f"Registration failed: {str(e)}"
         )
 
+def _issue_tokens(user_id: int, user_name: str, session_id: int, refresh_token: str) -> dict:
+    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    # uid lets id-only routes authenticate without loading the user, sid ties the token to its session
+    access_token = create_access_token(
+        data={"sub": user_name, "uid": user_id, "sid": session_id},
+        expires_delta=access_token_expires
+    )
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+        "expires_in": int(access_token_expires.total_seconds())
+    }
+
 @router.post("/login", response_model=Token)
-def login(user: UserLogin, db: Session = Depends(get_db)):
-    db_user = AuthService.authenticate_user(db, user.username, user.password)
+async def login(user: UserLogin, request: Request, db: Session = Depends(get_db)):
+    started = time.perf_counter()
+    try:
+        db_user = await AuthService.authenticate_user_async(db, user.username, user.password)
+    finally:
+        login_latency.observe(time.perf_counter() - started)
+
     if not db_user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -60,8 +93,65 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": db_user.user_name}, expires_delta=access_token_expires
+    db_session, refresh_token = await run_in_threadpool(
+        SessionService.create_session,
+        db,
+        db_user.user_id,
+        request.headers.get("user-agent"),
+        request.client.host if request.client else None
     )
-    return {"access_token": access_token, "token_type": "bearer"}
+    return _issue_tokens(db_user.user_id, db_user.user_name, db_session.session_id, refresh_token)
+
+@router.post("/refresh", response_model=Token)
+def refresh(body: RefreshRequest, db: Session = Depends(get_db)):
+    """Exchange a refresh token for a new access token - no password, no bcrypt"""
+    rotated = SessionService.rotate(db, body.refresh_token)
+    if not rotated:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    db_session, refresh_token = rotated
+    return _issue_tokens(db_session.user_id, db_session.user.user_name, db_session.session_id, refresh_token)
+
+@router.post("/logout")
+def logout(body: RefreshRequest, db: Session = Depends(get_db)):
+    """End the session the refresh token belongs to"""
+    db_session = SessionService.get_active_session(db, body.refresh_token)
+    if db_session:
+        SessionService.revoke(db, db_session.user_id, db_session.session_id)
+    return {"message": "Logged out"}
+
+@router.get("/sessions", response_model=List[SessionResponse])
+def get_sessions(
+    db: Session = Depends(get_db),
+    claims: dict = Depends(get_current_token_claims)
+):
+    """Active sessions of the current user"""
+    sessions = SessionService.list_active(db, claims["uid"])
+    return [
+        {**SessionResponse.model_validate(s).model_dump(), "is_current": s.session_id == claims.get("sid")}
+        for s in sessions
+    ]
+
+@router.delete("/sessions/{session_id}")
+def revoke_session(
+    session_id: int,
+    db: Session = Depends(get_db),
+    claims: dict = Depends(get_current_token_claims)
+):
+    """Revoke one of the current user's sessions; its refresh token stops working"""
+    if not SessionService.revoke(db, claims["uid"], session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"message": "Session revoked"}
+
+@router.delete("/sessions")
+def revoke_other_sessions(
+    db: Session = Depends(get_db),
+    claims: dict = Depends(get_current_token_claims)
+):
+    """Revoke every session of the current user except the one making the request"""
+    revoked = SessionService.revoke_all(db, claims["uid"], except_session_id=claims.get("sid"))
+    return {"message": f"Revoked {revoked} session(s)"}
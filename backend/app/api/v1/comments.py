@@ -1,51 +1,76 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import func, select, exists, literal
 from typing import List, Optional
+from app.config import settings
 from app.database import get_db
-from app.api.deps import get_current_user, get_current_user_optional
-from app.models.comment import Comment
+from app.api.deps import get_current_user_id, get_current_user_id_optional
+from app.models.comment import Comment, comment_path, COMMENT_MAX_DEPTH
 from app.models.post import Post
 from app.models.user import User
 from app.models.like import Like
-from app.schemas.comment import CommentCreate, CommentResponse, CommentUpdate
+from app.schemas.comment import CommentCreate, CommentResponse, CommentUpdate, CommentTreePage
 from app.services.ai_service import ai_service
+from app.utils.analysis import store_analysis, apply_moderation_rules
+from app.utils.moderation import sync_analysis_moderation, resolve_moderation
+from app.utils.upsert import insert_from_select_ignore_duplicates
+from app.utils.profiling import ProfiledRoute
+from app.utils.query_budget import query_budget
+from app.utils.serialization import (
+    rows_to_dicts,
+    project_columns,
+    preview_column,
+    truncate_previews,
+    fast_json_response
+)
 import logging
 logger = logging.getLogger(__name__)
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
+
+# Comments whose responses need their author: the name only, in the same query
+AUTHOR_NAME_ONLY = joinedload(Comment.user).load_only(User.user_name)
 
 def analyze_comment_content(comment_id: int, content: str, db_session):
     """Background task to analyze comment content"""
     try:
-        analysis = ai_service.analyze_text_complete(content)
+        analysis = apply_moderation_rules(db_session, ai_service.analyze_text_complete(content))
 
         comment = db_session.query(Comment).filter(Comment.comment_id == comment_id).first()
         if comment:
-            comment.sentiment_label = analysis["sentiment"]["sentiment_label"]
-            comment.sentiment_confidence = analysis["sentiment"]["confidence"]
-            comment.is_sarcastic = analysis["sarcasm"]["is_sarcastic"]
-            comment.sarcasm_confidence = analysis["sarcasm"]["confidence"]
+            store_analysis(comment, analysis)
+            sync_analysis_moderation(db_session, "comment", comment_id, comment.post_id, analysis)
             db_session.commit()
 
     except Exception as e:
         logger.error(f"Failed to analyze comment {comment_id}: {e}")
 
-def comment_to_response(comment: Comment, current_user_id: Optional[int] = None, db: Session = None) -> dict:
-    """Convert Comment model to response dict with user_name and like info"""
-    # Get like count
-    like_count = 0
-    user_has_liked = False
+def comment_like_stats(db: Session, comment_ids: List[int], current_user_id: Optional[int] = None):
+    """Like counts and the viewer's likes for a batch of comments, in two queries"""
+    if not comment_ids:
+        return {}, set()
 
-    if db:
-        like_count = db.query(func.count(Like.like_id)).filter(Like.comment_id == comment.comment_id).scalar() or 0
+    like_counts = dict(
+        db.query(Like.comment_id, func.count(Like.like_id))
+        .filter(Like.comment_id.in_(comment_ids))
+        .group_by(Like.comment_id)
+        .all()
+    )
 
-        if current_user_id:
-            user_has_liked = db.query(Like).filter(
+    liked = set()
+    if current_user_id:
+        liked = {
+            comment_id for (comment_id,) in db.query(Like.comment_id).filter(
                 Like.user_id == current_user_id,
-                Like.comment_id == comment.comment_id
-            ).first() is not None
+                Like.comment_id.in_(comment_ids)
+            )
+        }
 
+    return like_counts, liked
+
+def comment_to_response(comment: Comment, like_stats: tuple) -> dict:
+    """Convert a Comment loaded with its author's name to a response dict, like info from comment_like_stats()"""
+    like_counts, liked = like_stats
     return {
         "comment_id": comment.comment_id,
         "post_id": comment.post_id,
@@ -59,63 +84,270 @@ def comment_to_response(comment: Comment, current_user_id: Optional[int] = None,
         "sentiment_confidence": comment.sentiment_confidence,
         "is_sarcastic": comment.is_sarcastic,
         "sarcasm_confidence": comment.sarcasm_confidence,
-        "like_count": like_count,
-        "user_has_liked": user_has_liked
+        "like_count": like_counts.get(comment.comment_id, 0),
+        "user_has_liked": comment.comment_id in liked
     }
 
-@router.post("/{post_id}/comments", response_model=CommentResponse)
+def comment_response_columns(current_user_id: Optional[int] = None) -> tuple:
+    """Columns of CommentResponse, with like info as correlated subqueries"""
+    if current_user_id:
+        user_has_liked = exists().where(
+            Like.comment_id == Comment.comment_id,
+            Like.user_id == current_user_id
+        ).correlate(Comment).label("user_has_liked")
+    else:
+        user_has_liked = literal(False).label("user_has_liked")
+
+    return (
+        Comment.comment_id,
+        Comment.post_id,
+        Comment.user_id,
+        User.user_name,
+        Comment.content,
+        Comment.created_at,
+        func.coalesce(Comment.analyzed_at, Comment.created_at).label("updated_at"),
+        Comment.parent_comment_id,
+        Comment.sentiment_label,
+        Comment.sentiment_confidence,
+        Comment.is_sarcastic,
+        Comment.sarcasm_confidence,
+        select(func.count(Like.like_id))
+        .where(Like.comment_id == Comment.comment_id)
+        .correlate(Comment)
+        .scalar_subquery()
+        .label("like_count"),
+        user_has_liked,
+    )
+
+def comment_response(db: Session, comment_id: int, current_user_id: Optional[int] = None) -> dict:
+    """One comment's response dict, projected with its author's name and like info in one query"""
+    row = db.query(*comment_response_columns(current_user_id)).select_from(Comment).join(
+        User, Comment.user_id == User.user_id
+    ).filter(Comment.comment_id == comment_id).one()
+    response = row._asdict()
+    response["user_has_liked"] = bool(response["user_has_liked"])
+    return response
+
+@router.post("/{post_id}/comments", response_model=CommentResponse, response_model_exclude_unset=True)
 def create_comment(
     post_id: int,
     comment: CommentCreate,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user_id: int = Depends(get_current_user_id)
 ):
     # Check if post exists
     post = db.query(Post).filter(Post.post_id == post_id, Post.is_deleted == False).first()
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
+    parent = None
+    if comment.parent_comment_id is not None:
+        parent = db.query(Comment).filter(
+            Comment.comment_id == comment.parent_comment_id,
+            Comment.post_id == post_id
+        ).first()
+        if not parent:
+            raise HTTPException(status_code=404, detail="Parent comment not found")
+        if parent.depth >= COMMENT_MAX_DEPTH:
+            raise HTTPException(status_code=400, detail=f"Replies can be nested at most {COMMENT_MAX_DEPTH} levels deep")
+
     # Create comment
     db_comment = Comment(
         post_id=post_id,
-        user_id=current_user.user_id,
+        user_id=current_user_id,
         content=comment.content,
-        parent_comment_id=comment.parent_comment_id
+        parent_comment_id=comment.parent_comment_id,
+        depth=parent.depth + 1 if parent else 0
     )
     db.add(db_comment)
+    db.flush()
+
+    # The path needs the new comment_id
+    comment_id = db_comment.comment_id
+    db_comment.path = comment_path(parent.path if parent else None, comment_id)
     db.commit()
-    db.refresh(db_comment)
 
     # Analyze content in background
-    background_tasks.add_task(analyze_comment_content, db_comment.comment_id, comment.content, db)
+    background_tasks.add_task(analyze_comment_content, comment_id, comment.content, db)
 
-    return comment_to_response(db_comment, current_user.user_id, db)
+    return comment_response(db, comment_id, current_user_id)
 
 @router.get("/{post_id}/comments", response_model=List[CommentResponse])
+@query_budget(2)
 def get_comments(
     post_id: int,
+    fields: Optional[str] = None,
+    preview_length: Optional[int] = Query(None, ge=1),
     db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user_optional)
+    current_user_id: Optional[int] = Depends(get_current_user_id_optional)
 ):
     """Get all comments for a post - public endpoint with optional authentication"""
-    comments = db.query(Comment).join(User).filter(Comment.post_id == post_id).all()
+    columns = project_columns(fields, comment_response_columns(current_user_id), required=("comment_id",))
+    columns = preview_column(columns, "content", preview_length)
+    rows = db.query(*columns).select_from(Comment).join(
+        User, Comment.user_id == User.user_id
+    ).filter(Comment.post_id == post_id).all()
+
+    comments = truncate_previews(rows_to_dicts(rows), "content", preview_length)
+    for comment in comments:
+        if "user_has_liked" in comment:
+            # EXISTS comes back as 0/1 from MySQL
+            comment["user_has_liked"] = bool(comment["user_has_liked"])
+    return fast_json_response(comments, validate=not fields)
+
+
+def load_comment_tree(
+    db: Session,
+    post_id: int,
+    parent: Optional[Comment],
+    cursor: Optional[int],
+    limit: int,
+    depth: int,
+    replies_limit: int,
+    current_user_id: Optional[int] = None
+) -> dict:
+    """
+    One page of top-level comments (or direct replies to parent), each with
+    up to replies_limit replies per level and depth levels below it.
+    """
+    limit = min(limit, settings.COMMENT_TREE_MAX_PAGE_SIZE)
+    replies_limit = min(replies_limit, settings.COMMENT_TREE_MAX_PAGE_SIZE)
+    depth = min(depth, settings.COMMENT_TREE_MAX_DEPTH)
+    parent_path = parent.path if parent else None
+    level = parent.depth + 1 if parent else 0
+
+    # Page of the requested level, keyset-paginated on the path index
+    query = db.query(Comment).options(AUTHOR_NAME_ONLY).filter(
+        Comment.post_id == post_id,
+        Comment.depth == level
+    )
+    if parent:
+        query = query.filter(Comment.path.startswith(parent_path))
+    if cursor:
+        query = query.filter(Comment.path > comment_path(parent_path, cursor))
+    page = query.order_by(Comment.path).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = page[-1].comment_id
+
+    # Replies of every comment on the page are one contiguous path range
+    descendants = []
+    if page and depth > 0:
+        ranked = select(
+            Comment.comment_id,
+            func.row_number().over(
+                partition_by=Comment.parent_comment_id,
+                order_by=Comment.path
+            ).label("position")
+        ).where(
+            Comment.post_id == post_id,
+            Comment.path > page[0].path,
+            Comment.path < page[-1].path + "~",  # "~" sorts after every path character
+            Comment.depth > level,
+            Comment.depth <= level + depth
+        ).subquery()
+
+        descendants = db.query(Comment).options(AUTHOR_NAME_ONLY).join(
+            ranked, ranked.c.comment_id == Comment.comment_id
+        ).filter(
+            ranked.c.position <= replies_limit + 1
+        ).order_by(Comment.path).all()
+
+    comments = page + descendants
+    like_stats = comment_like_stats(db, [c.comment_id for c in comments], current_user_id)
+
+    nodes = {}
+    items = []
+    for comment in page:
+        node = comment_to_response(comment, like_stats)
+        node.update(replies=[], has_more_replies=False, replies_cursor=None)
+        nodes[comment.comment_id] = node
+        items.append(node)
+
+    # Path order visits every parent before its replies
+    for comment in descendants:
+        parent_node = nodes.get(comment.parent_comment_id)
+        if parent_node is None:
+            continue  # Ancestor was cut by replies_limit
+        if len(parent_node["replies"]) >= replies_limit:
+            parent_node["has_more_replies"] = True
+            parent_node["replies_cursor"] = parent_node["replies"][-1]["comment_id"]
+            continue
+
+        node = comment_to_response(comment, like_stats)
+        node.update(replies=[], has_more_replies=False, replies_cursor=None)
+        nodes[comment.comment_id] = node
+        parent_node["replies"].append(node)
+
+    # Comments on the deepest level only report whether replies exist
+    boundary_ids = [c.comment_id for c in comments if c.depth == level + depth]
+    if boundary_ids:
+        with_replies = db.query(Comment.parent_comment_id).filter(
+            Comment.parent_comment_id.in_(boundary_ids)
+        ).distinct().all()
+        for (comment_id,) in with_replies:
+            if comment_id in nodes:
+                nodes[comment_id]["has_more_replies"] = True
+
+    return {"items": items, "next_cursor": next_cursor}
+
+@router.get("/{post_id}/comments/tree", response_model=CommentTreePage, response_model_exclude_unset=True)
+@query_budget(7)
+def get_comment_tree(
+    post_id: int,
+    cursor: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=settings.COMMENT_TREE_MAX_PAGE_SIZE),
+    depth: int = Query(2, ge=0),
+    replies_limit: int = Query(5, ge=1),
+    db: Session = Depends(get_db),
+    current_user_id: Optional[int] = Depends(get_current_user_id_optional)
+):
+    """Top-level comments of a post, cursor-paginated, with nested replies up to depth levels"""
+    post = db.query(Post).filter(Post.post_id == post_id, Post.is_deleted == False).first()
+    if not post:
+        raise HTTPException(status_code=404, detail="Post not found")
+
+    return load_comment_tree(db, post_id, None, cursor, limit, depth, replies_limit, current_user_id)
+
+@router.get("/{post_id}/comments/{comment_id}/replies", response_model=CommentTreePage, response_model_exclude_unset=True)
+@query_budget(8)
+def get_comment_replies(
+    post_id: int,
+    comment_id: int,
+    cursor: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=settings.COMMENT_TREE_MAX_PAGE_SIZE),
+    depth: int = Query(1, ge=0),
+    replies_limit: int = Query(5, ge=1),
+    db: Session = Depends(get_db),
+    current_user_id: Optional[int] = Depends(get_current_user_id_optional)
+):
+    """Load more replies of one comment, using replies_cursor from the tree as cursor"""
+    parent = db.query(Comment).filter(
+        Comment.comment_id == comment_id,
+        Comment.post_id == post_id
+    ).first()
+    if not parent:
+        raise HTTPException(status_code=404, detail="Comment not found")
+    if parent.path is None:
+        raise HTTPException(status_code=409, detail="Comment thread has not been indexed yet")
 
-    current_user_id = current_user.user_id if current_user else None
-    return [comment_to_response(comment, current_user_id, db) for comment in comments]
+    return load_comment_tree(db, post_id, parent, cursor, limit, depth, replies_limit, current_user_id)
 
 
-@router.put("/{post_id}/comments/{comment_id}", response_model=CommentResponse)
+@router.put("/{post_id}/comments/{comment_id}", response_model=CommentResponse, response_model_exclude_unset=True)
 def update_comment(
     post_id: int,
     comment_id: int,
     comment_update: CommentUpdate,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user_id: int = Depends(get_current_user_id)
 ):
     """Update comment content"""
-    comment = db.query(Comment).join(User).filter(
+    comment = db.query(Comment).filter(
         Comment.comment_id == comment_id,
         Comment.post_id == post_id
     ).first()
@@ -123,7 +355,7 @@ def update_comment(
     if not comment:
         raise HTTPException(status_code=404, detail="Comment not found")
 
-    if comment.user_id != current_user.user_id:
+    if comment.user_id != current_user_id:
         raise HTTPException(status_code=403, detail="Not authorized to edit this comment")
 
     if comment_update.content is not None:
@@ -132,8 +364,7 @@ def update_comment(
         background_tasks.add_task(analyze_comment_content, comment.comment_id, comment.content, db)
 
     db.commit()
-    db.refresh(comment)
-    return comment_to_response(comment, current_user.user_id, db)
+    return comment_response(db, comment_id, current_user_id)
 
 
 @router.delete("/{post_id}/comments/{comment_id}")
@@ -141,7 +372,7 @@ def delete_comment(
     post_id: int,
     comment_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user_id: int = Depends(get_current_user_id)
 ):
     """Delete a comment"""
     comment = db.query(Comment).filter(
@@ -152,46 +383,49 @@ def delete_comment(
     if not comment:
         raise HTTPException(status_code=404, detail="Comment not found")
 
-    if comment.user_id != current_user.user_id:
+    if comment.user_id != current_user_id:
         raise HTTPException(status_code=403, detail="Not authorized to delete this comment")
 
+    resolve_moderation(db, "comment", comment_id, current_user_id, "removed")
     db.delete(comment)
     db.commit()
 
     return {"message": "Comment deleted successfully"}
 
 
+def comment_like_state(db: Session, post_id: int, comment_id: int, user_id: int) -> dict:
+    """Whether the comment exists, its like count and whether the user likes it, in one query"""
+    row = db.query(
+        exists().where(Comment.comment_id == comment_id, Comment.post_id == post_id).label("comment_exists"),
+        select(func.count(Like.like_id)).where(Like.comment_id == comment_id).scalar_subquery().label("like_count"),
+        exists().where(Like.comment_id == comment_id, Like.user_id == user_id).label("liked")
+    ).one()
+
+    if not row.comment_exists:
+        raise HTTPException(status_code=404, detail="Comment not found")
+    return {"total_likes": row.like_count, "user_has_liked": bool(row.liked)}
+
 @router.post("/{post_id}/comments/{comment_id}/like")
 def like_comment(
     post_id: int,
     comment_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user_id: int = Depends(get_current_user_id)
 ):
-    """Like a comment"""
-    # Check if comment exists
-    comment = db.query(Comment).filter(
-        Comment.comment_id == comment_id,
-        Comment.post_id == post_id
-    ).first()
-    if not comment:
-        raise HTTPException(status_code=404, detail="Comment not found")
-
-    # Check if already liked
-    existing_like = db.query(Like).filter(
-        Like.user_id == current_user.user_id,
-        Like.comment_id == comment_id
-    ).first()
-
-    if existing_like:
-        raise HTTPException(status_code=400, detail="Comment already liked")
-
-    # Create like
-    like = Like(user_id=current_user.user_id, comment_id=comment_id)
-    db.add(like)
+    """Like a comment - idempotent, liking again just returns the current state"""
+    # One statement: inserts only if the comment exists and the like doesn't
+    insert_from_select_ignore_duplicates(
+        db,
+        Like.__table__,
+        ["user_id", "comment_id"],
+        select(literal(current_user_id), Comment.comment_id).where(
+            Comment.comment_id == comment_id,
+            Comment.post_id == post_id
+        )
+    )
     db.commit()
 
-    return {"message": "Comment liked successfully"}
+    return {"message": "Comment liked successfully", **comment_like_state(db, post_id, comment_id, current_user_id)}
 
 
 @router.delete("/{post_id}/comments/{comment_id}/like")
@@ -199,21 +433,16 @@ def unlike_comment(
     post_id: int,
     comment_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user_id: int = Depends(get_current_user_id)
 ):
-    """Unlike a comment"""
-    like = db.query(Like).filter(
-        Like.user_id == current_user.user_id,
+    """Unlike a comment - idempotent, unliking a comment that isn't liked is not an error"""
+    db.query(Like).filter(
+        Like.user_id == current_user_id,
         Like.comment_id == comment_id
-    ).first()
-
-    if not like:
-        raise HTTPException(status_code=404, detail="Like not found")
-
-    db.delete(like)
+    ).delete(synchronize_session=False)
     db.commit()
 
-    return {"message": "Comment unliked successfully"}
+    return {"message": "Comment unliked successfully", **comment_like_state(db, post_id, comment_id, current_user_id)}
 
 
 @router.get("/{post_id}/comments/{comment_id}/likes")
@@ -221,27 +450,7 @@ def get_comment_likes(
     post_id: int,
     comment_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user_id: int = Depends(get_current_user_id)
 ):
     """Get like statistics for a comment"""
-    # Check if comment exists
-    comment = db.query(Comment).filter(
-        Comment.comment_id == comment_id,
-        Comment.post_id == post_id
-    ).first()
-    if not comment:
-        raise HTTPException(status_code=404, detail="Comment not found")
-
-    # Get total likes
-    total_likes = db.query(func.count(Like.like_id)).filter(Like.comment_id == comment_id).scalar()
-
-    # Check if current user liked it
-    user_has_liked = db.query(Like).filter(
-        Like.user_id == current_user.user_id,
-        Like.comment_id == comment_id
-    ).first() is not None
-
-    return {
-        "total_likes": total_likes,
-        "user_has_liked": user_has_liked
-    }
+    return comment_like_state(db, post_id, comment_id, current_user_id)
@@ -1,85 +1,190 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, func
+from sqlalchemy import desc, func, select, exists, literal
 from typing import List, Optional
+from app.config import settings
 from app.database import get_db
-from app.api.deps import get_current_user
+from app.api.deps import get_current_user, get_current_user_id, get_current_user_id_optional
 from app.models.post import Post
 from app.models.user import User
-from app.schemas.post import PostCreate, PostResponse, PostAnalysis, PostUpdate
+from app.models.like import Like
+from app.models.comment import Comment
+from app.models.moderation import MODERATION_REASON_FLAGGED
+from app.schemas.post import (
+    PostCreate,
+    PostResponse,
+    PostAnalysis,
+    PostUpdate,
+    AnalyzeRequest,
+    AnalyzeBatchRequest,
+    AnalyzeBatchResponse
+)
 from app.services.ai_service import ai_service
+from app.utils.analysis import store_analysis, stored_analysis, apply_moderation_rules
+from app.utils.rules import get_active_ruleset
+from app.utils.moderation import enqueue_moderation, sync_analysis_moderation, resolve_moderation, FLAGGED_PRIORITY
+from app.utils.like_aggregator import like_aggregator, apply_post_like
+from app.utils.profiling import ProfiledRoute
+from app.utils.query_budget import query_budget
+from app.utils.rate_limit import charge_inference
+from app.utils.serialization import (
+    rows_to_dicts,
+    project_columns,
+    preview_column,
+    truncate_previews,
+    fast_json_response
+)
+import json
 import logging
 
 logger = logging.getLogger(__name__)
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 def analyze_post_content(post_id: int, content: str, db_session):
     """Background task to analyze post content"""
     try:
-        analysis = ai_service.analyze_text_complete(content)
+        analysis = apply_moderation_rules(db_session, ai_service.analyze_text_complete(content))
 
         # Update post with analysis results
         post = db_session.query(Post).filter(Post.post_id == post_id).first()
         if post:
-            post.sentiment_label = analysis["sentiment"]["sentiment_label"]
-            post.sentiment_confidence = analysis["sentiment"]["confidence"]
-            post.is_sarcastic = analysis["sarcasm"]["is_sarcastic"]
-            post.sarcasm_confidence = analysis["sarcasm"]["confidence"]
+            store_analysis(post, analysis)
+            sync_analysis_moderation(db_session, "post", post_id, post_id, analysis)
             db_session.commit()
 
     except Exception as e:
         logger.error(f"Failed to analyze post {post_id}: {e}")
 
-def post_to_response(post: Post) -> dict:
-    """Convert Post model to response dict with user_name"""
-    return {
-        "post_id": post.post_id,
-        "title": post.title,
-        "content": post.content,
-        "user_id": post.user_id,
-        "user_name": post.user.user_name,
-        "created_at": post.created_at,
-        "sentiment_label": post.sentiment_label,
-        "sentiment_confidence": post.sentiment_confidence,
-        "is_sarcastic": post.is_sarcastic,
-        "sarcasm_confidence": post.sarcasm_confidence,
-        "analyzed_at": post.analyzed_at,
-        "is_flagged": post.is_flagged
-    }
+# Optional per-post fields that can be requested with ?include=
+POST_INCLUDE_OPTIONS = {"like_count", "comment_count", "user_has_liked"}
+
+def parse_include(include: Optional[str]) -> set:
+    """Parse a comma-separated include= parameter into a set of field names"""
+    if not include:
+        return set()
+
+    requested = {field.strip() for field in include.split(",") if field.strip()}
+    unknown = requested - POST_INCLUDE_OPTIONS
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown include option(s): {', '.join(sorted(unknown))}"
+        )
+    return requested
+
+def post_stats_columns(include: set, current_user_id: Optional[int] = None) -> list:
+    """Correlated subqueries for the requested counters, selected in the same query as the posts"""
+    columns = []
+
+    if "like_count" in include:
+        columns.append(Post.like_count.label("like_count"))
+
+    if "comment_count" in include:
+        columns.append(
+            select(func.count(Comment.comment_id))
+            .where(Comment.post_id == Post.post_id)
+            .correlate(Post)
+            .scalar_subquery()
+            .label("comment_count")
+        )
+
+    if "user_has_liked" in include:
+        if current_user_id is None:
+            columns.append(literal(False).label("user_has_liked"))
+        else:
+            columns.append(
+                exists()
+                .where(Like.post_id == Post.post_id, Like.user_id == current_user_id)
+                .correlate(Post)
+                .label("user_has_liked")
+            )
+
+    return columns
+
+# Columns of PostResponse, selected directly so list routes skip building ORM objects
+POST_RESPONSE_COLUMNS = (
+    Post.post_id,
+    Post.title,
+    Post.content,
+    Post.user_id,
+    User.user_name,
+    Post.created_at,
+    Post.sentiment_label,
+    Post.sentiment_confidence,
+    Post.is_sarcastic,
+    Post.sarcasm_confidence,
+    Post.analyzed_at,
+)
+
+def query_post_rows(
+    db: Session,
+    stats_columns: list,
+    fields: Optional[str] = None,
+    preview_length: Optional[int] = None
+):
+    """Post rows projected to PostResponse columns (or the fields= subset) plus any requested counters"""
+    columns = project_columns(fields, POST_RESPONSE_COLUMNS, required=("post_id",))
+    columns = preview_column(columns, "content", preview_length)
+    return db.query(*columns, *stats_columns).select_from(Post).join(
+        User, Post.user_id == User.user_id
+    )
 
-@router.post("/", response_model=PostResponse)
+def rows_to_responses(rows, include: set, preview_length: Optional[int] = None) -> list:
+    """Convert projected post rows to response dicts"""
+    responses = truncate_previews(rows_to_dicts(rows), "content", preview_length)
+    if "user_has_liked" in include:
+        # EXISTS comes back as 0/1 from MySQL
+        for response in responses:
+            response["user_has_liked"] = bool(response["user_has_liked"])
+    return responses
+
+def post_response(db: Session, post_id: int) -> dict:
+    """One post's response dict, projected with its author's name in one query"""
+    row = query_post_rows(db, []).filter(Post.post_id == post_id).first()
+    return rows_to_responses([row], set())[0]
+
+@router.post("/", response_model=PostResponse, response_model_exclude_unset=True)
 def create_post(
     post: PostCreate,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user_id: int = Depends(get_current_user_id)
 ):
     # Create post
     db_post = Post(
         title=post.title,
         content=post.content,
-        user_id=current_user.user_id
+        user_id=current_user_id
     )
     db.add(db_post)
+    db.flush()
+    post_id = db_post.post_id
     db.commit()
-    db.refresh(db_post)
 
     # Analyze content in background
-    background_tasks.add_task(analyze_post_content, db_post.post_id, post.content, db)
+    background_tasks.add_task(analyze_post_content, post_id, post.content, db)
 
-    return post_to_response(db_post)
+    return post_response(db, post_id)
 
-@router.get("/", response_model=List[PostResponse])
+@router.get("/", response_model=List[PostResponse], response_model_exclude_unset=True)
+@query_budget(2)
 def get_posts(
     skip: int = 0,
     limit: int = 20,
     sentiment_filter: Optional[str] = None,
     include_sarcastic: bool = True,
-    db: Session = Depends(get_db)
+    include: Optional[str] = None,
+    fields: Optional[str] = None,
+    preview_length: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_db),
+    current_user_id: Optional[int] = Depends(get_current_user_id_optional)
 ):
-    # FIXED: Specify the join condition explicitly
-    query = db.query(Post).join(User, Post.user_id == User.user_id).filter(Post.is_deleted == False)
+    included = parse_include(include)
+    stats_columns = post_stats_columns(included, current_user_id)
+
+    query = query_post_rows(db, stats_columns, fields, preview_length).filter(Post.is_deleted == False)
 
     if sentiment_filter:
         query = query.filter(Post.sentiment_label == sentiment_filter.lower())
@@ -87,36 +192,85 @@ def get_posts(
     if not include_sarcastic:
         query = query.filter(Post.is_sarcastic == False)
 
-    posts = query.order_by(desc(Post.created_at)).offset(skip).limit(limit).all()
-    return [post_to_response(post) for post in posts]
+    rows = query.order_by(desc(Post.created_at)).offset(skip).limit(limit).all()
+    return fast_json_response(rows_to_responses(rows, included, preview_length), validate=not fields)
 
-@router.get("/{post_id}", response_model=PostResponse)
-def get_post(post_id: int, db: Session = Depends(get_db)):
-    # FIXED: Specify the join condition explicitly
-    post = db.query(Post).join(User, Post.user_id == User.user_id).filter(
+@router.get("/{post_id}", response_model=PostResponse, response_model_exclude_unset=True)
+@query_budget(2)
+def get_post(
+    post_id: int,
+    include: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user_id: Optional[int] = Depends(get_current_user_id_optional)
+):
+    included = parse_include(include)
+    stats_columns = post_stats_columns(included, current_user_id)
+
+    row = query_post_rows(db, stats_columns).filter(
         Post.post_id == post_id,
         Post.is_deleted == False
     ).first()
-    if not post:
+    if not row:
         raise HTTPException(status_code=404, detail="Post not found")
-    return post_to_response(post)
+    return rows_to_responses([row], included)[0]
 
 @router.get("/{post_id}/analysis", response_model=PostAnalysis)
-def get_post_analysis(post_id: int, db: Session = Depends(get_db)):
+def get_post_analysis(
+    post_id: int,
+    request: Request,
+    fresh: bool = Query(False, description="Re-run the models instead of returning the stored analysis"),
+    db: Session = Depends(get_db)
+):
+    """
+    The stored analysis, recomputed only when forced or produced by other model
+    revisions - and then charged to the inference rate limit, not as a read
+    """
     post = db.query(Post).filter(Post.post_id == post_id).first()
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    analysis = ai_service.analyze_text_complete(post.content)
-    return analysis
-
-@router.post("/analyze", response_model=PostAnalysis)
-def analyze_text(text: str):
-    if not text:
-        raise HTTPException(status_code=400, detail="Text cannot be empty")
-
-    analysis = ai_service.analyze_text_complete(text)
-    return analysis
+    if fresh or not ai_service.serves_revision(post.analysis_revision):
+        charge_inference(request)
+        analysis = apply_moderation_rules(db, ai_service.analyze_text_complete(post.content))
+        store_analysis(post, analysis)
+        sync_analysis_moderation(db, "post", post.post_id, post.post_id, analysis)
+        db.commit()
+        db.refresh(post)
+    return stored_analysis(post)
+
+def _without_text(analysis: dict) -> dict:
+    # The caller already has the text, don't send it back
+    return {key: value for key, value in analysis.items() if key != "text"}
+
+@router.post("/analyze", response_model=PostAnalysis, response_model_exclude_unset=True)
+def analyze_text(request: AnalyzeRequest, db: Session = Depends(get_db)):
+    """Analyze one text of at most ANALYZE_MAX_TEXT_LENGTH characters"""
+    analysis = apply_moderation_rules(db, ai_service.analyze_text_complete(request.text))
+    return analysis if request.include_text else _without_text(analysis)
+
+@router.post("/analyze/batch", response_model=AnalyzeBatchResponse, response_model_exclude_unset=True)
+def analyze_text_batch(request: AnalyzeBatchRequest, db: Session = Depends(get_db)):
+    """
+    Analyze up to ANALYZE_MAX_BATCH_SIZE texts in batched forward passes.
+    With stream=true, results are sent as NDJSON lines ({"index": i, ...})
+    as each micro-batch of ANALYZE_MICRO_BATCH_SIZE texts finishes.
+    """
+    ruleset = get_active_ruleset(db)
+
+    def results(batch_size: int):
+        for start in range(0, len(request.texts), batch_size):
+            for offset, analysis in enumerate(ai_service.analyze_texts_complete(request.texts[start:start + batch_size])):
+                analysis["needs_review"] = ruleset.matches(analysis)
+                yield start + offset, analysis if request.include_text else _without_text(analysis)
+
+    if not request.stream:
+        return {"results": [analysis for _, analysis in results(len(request.texts))]}
+
+    def stream():
+        for index, analysis in results(settings.ANALYZE_MICRO_BATCH_SIZE):
+            yield json.dumps({"index": index, **analysis}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 @router.get("/analytics/sentiment")
 def get_sentiment_analytics(db: Session = Depends(get_db)):
@@ -146,51 +300,58 @@ def get_sentiment_analytics(db: Session = Depends(get_db)):
 def delete_post(
     post_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user_id: int = Depends(get_current_user_id)
 ):
     post = db.query(Post).filter(Post.post_id == post_id).first()
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    if post.user_id != current_user.user_id:
+    if post.user_id != current_user_id:
         raise HTTPException(status_code=403, detail="Not authorized to delete this post")
 
     post.is_deleted = True
+    resolve_moderation(db, "post", post_id, current_user_id, "removed")
     db.commit()
     return {"message": "Post deleted successfully"}
 
-@router.get("/user/{user_id}", response_model=List[PostResponse])
+@router.get("/user/{user_id}", response_model=List[PostResponse], response_model_exclude_unset=True)
+@query_budget(2)
 def get_user_posts(
     user_id: int,
     skip: int = 0,
     limit: int = 20,
-    db: Session = Depends(get_db)
+    include: Optional[str] = None,
+    fields: Optional[str] = None,
+    preview_length: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_db),
+    current_user_id: Optional[int] = Depends(get_current_user_id_optional)
 ):
-    # FIXED: Specify the join condition explicitly
-    posts = db.query(Post).join(User, Post.user_id == User.user_id).filter(
+    included = parse_include(include)
+    stats_columns = post_stats_columns(included, current_user_id)
+
+    rows = query_post_rows(db, stats_columns, fields, preview_length).filter(
         Post.user_id == user_id,
         Post.is_deleted == False
     ).order_by(desc(Post.created_at)).offset(skip).limit(limit).all()
-    return [post_to_response(post) for post in posts]
+    return fast_json_response(rows_to_responses(rows, included, preview_length), validate=not fields)
 
-@router.put("/{post_id}", response_model=PostResponse)
+@router.put("/{post_id}", response_model=PostResponse, response_model_exclude_unset=True)
 def update_post(
     post_id: int,
     post_update: PostUpdate,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user_id: int = Depends(get_current_user_id)
 ):
     """Update post title and/or content"""
-    # FIXED: Specify the join condition explicitly
-    post = db.query(Post).join(User, Post.user_id == User.user_id).filter(
+    post = db.query(Post).filter(
         Post.post_id == post_id,
         Post.is_deleted == False
     ).first()
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    if post.user_id != current_user.user_id:
+    if post.user_id != current_user_id:
         raise HTTPException(status_code=403, detail="Not authorized to edit this post")
 
     if post_update.title is not None:
@@ -202,98 +363,73 @@ def update_post(
         background_tasks.add_task(analyze_post_content, post.post_id, post.content, db)
 
     db.commit()
-    db.refresh(post)
-    return post_to_response(post)
+    return post_response(db, post_id)
 
 
-@router.post("/{post_id}/like")
-def like_post(
-    post_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
-    """Like a post"""
-    from app.models.like import Like
+def post_like_state(db: Session, post_id: int, user_id: int) -> dict:
+    """Whether the post exists, its like count and whether the user likes it, in one query"""
+    if like_aggregator is not None:
+        state = like_aggregator.state(db, user_id, post_id)
+        if state is None:
+            raise HTTPException(status_code=404, detail="Post not found")
+        return state
 
-    # Check if post exists
-    post = db.query(Post).filter(Post.post_id == post_id, Post.is_deleted == False).first()
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
+    row = db.query(
+        Post.like_count,
+        exists().where(Like.post_id == Post.post_id, Like.user_id == user_id).correlate(Post).label("liked")
+    ).filter(Post.post_id == post_id, Post.is_deleted == False).first()
 
-    # Check if already liked
-    existing_like = db.query(Like).filter(
-        Like.user_id == current_user.user_id,
-        Like.post_id == post_id
-    ).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Post not found")
+    return {"total_likes": row.like_count, "user_has_liked": bool(row.liked)}
 
-    if existing_like:
-        raise HTTPException(status_code=400, detail="Post already liked")
+def set_post_like(db: Session, post_id: int, user_id: int, liked: bool) -> dict:
+    """Apply a like/unlike - buffered when write-behind is enabled - and return the resulting state"""
+    if like_aggregator is not None:
+        state = like_aggregator.submit(db, user_id, post_id, liked)
+        if state is None:
+            raise HTTPException(status_code=404, detail="Post not found")
+        return state
 
-    # Create like
-    like = Like(user_id=current_user.user_id, post_id=post_id)
-    db.add(like)
+    apply_post_like(db, user_id, post_id, liked)
     db.commit()
+    return post_like_state(db, post_id, user_id)
 
-    return {"message": "Post liked successfully"}
+@router.post("/{post_id}/like")
+def like_post(
+    post_id: int,
+    db: Session = Depends(get_db),
+    current_user_id: int = Depends(get_current_user_id)
+):
+    """Like a post - idempotent, liking again just returns the current state"""
+    return {"message": "Post liked successfully", **set_post_like(db, post_id, current_user_id, True)}
 
 
 @router.delete("/{post_id}/like")
 def unlike_post(
     post_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user_id: int = Depends(get_current_user_id)
 ):
-    """Unlike a post"""
-    from app.models.like import Like
-
-    like = db.query(Like).filter(
-        Like.user_id == current_user.user_id,
-        Like.post_id == post_id
-    ).first()
-
-    if not like:
-        raise HTTPException(status_code=404, detail="Like not found")
-
-    db.delete(like)
-    db.commit()
-
-    return {"message": "Post unliked successfully"}
+    """Unlike a post - idempotent, unliking a post that isn't liked is not an error"""
+    return {"message": "Post unliked successfully", **set_post_like(db, post_id, current_user_id, False)}
 
 
 @router.get("/{post_id}/likes")
 def get_post_likes(
     post_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user_id: int = Depends(get_current_user_id)
 ):
     """Get like statistics for a post"""
-    from app.models.like import Like
-
-    # Check if post exists
-    post = db.query(Post).filter(Post.post_id == post_id, Post.is_deleted == False).first()
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
-
-    # Get total likes
-    total_likes = db.query(func.count(Like.like_id)).filter(Like.post_id == post_id).scalar()
-
-    # Check if current user liked it
-    user_has_liked = db.query(Like).filter(
-        Like.user_id == current_user.user_id,
-        Like.post_id == post_id
-    ).first() is not None
-
-    return {
-        "total_likes": total_likes,
-        "user_has_liked": user_has_liked
-    }
+    return post_like_state(db, post_id, current_user_id)
 
 
 @router.post("/{post_id}/flag")
 def flag_post(
     post_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user_id: int = Depends(get_current_user_id)
 ):
     """Flag a post for review"""
     from datetime import datetime
@@ -307,7 +443,8 @@ def flag_post(
 
     post.is_flagged = True
     post.flagged_at = datetime.utcnow()
-    post.flagged_by = current_user.user_id
+    post.flagged_by = current_user_id
+    enqueue_moderation(db, "post", post_id, post_id, MODERATION_REASON_FLAGGED, FLAGGED_PRIORITY)
     db.commit()
 
     return {"message": "Post flagged for review"}
@@ -331,6 +468,7 @@ def unflag_post(
     post.is_flagged = False
     post.flagged_at = None
     post.flagged_by = None
+    resolve_moderation(db, "post", post_id, current_user.user_id, "approved")
     db.commit()
 
     return {"message": "Post unflagged"}
@@ -1,22 +1,40 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, select, exists, literal
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
 from app.database import get_db
-from app.api.deps import get_current_user
+from app.api.deps import get_current_user, get_current_user_id, get_current_session_id
 from app.models.user import User
-from app.schemas.user import UserUpdate, UserResponse
-from app.utils.security import get_password_hash
+from app.schemas.user import UserUpdate, UserResponse, UserSummary
+from app.utils.security import get_password_hash_async
+from app.services.session_service import SessionService
 from app.models.user_relation import UserRelation
-
-router = APIRouter()
-
-@router.put("/me", response_model=UserResponse)
-def update_current_user(
+from app.utils.upsert import insert_from_select_ignore_duplicates
+from app.utils.profiling import ProfiledRoute
+from app.utils.query_budget import query_budget
+from app.utils.serialization import rows_to_dicts, fast_json_response
+
+router = APIRouter(route_class=ProfiledRoute)
+
+# Columns of UserResponse and UserSummary, selected directly so user lists never load password hashes
+USER_RESPONSE_COLUMNS = (
+    User.user_id,
+    User.user_name,
+    User.user_email,
+    User.is_admin,
+    User.created_at,
+    User.profile_pic_url,
+)
+USER_SUMMARY_COLUMNS = (User.user_id, User.user_name, User.profile_pic_url)
+
+def _apply_user_update(
+    db: Session,
+    current_user: User,
     user_update: UserUpdate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
-    """Update current user's profile (email, profile_pic_url, password)"""
+    password_hash: Optional[str],
+    session_id: Optional[int]
+) -> User:
     if user_update.user_email is not None:
         existing_user = db.query(User).filter(
             User.user_email == user_update.user_email,
@@ -29,13 +47,30 @@ def update_current_user(
     if user_update.profile_pic_url is not None:
         current_user.profile_pic_url = user_update.profile_pic_url
 
-    if user_update.password is not None:
-        current_user.password_hash = get_password_hash(user_update.password)
+    if password_hash is not None:
+        current_user.password_hash = password_hash
+        # Refresh tokens issued with the old password stop working, except the caller's own
+        SessionService.revoke_all(db, current_user.user_id, except_session_id=session_id, commit=False)
 
     db.commit()
     db.refresh(current_user)
     return current_user
 
+@router.put("/me", response_model=UserResponse)
+async def update_current_user(
+    user_update: UserUpdate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    session_id: Optional[int] = Depends(get_current_session_id)
+):
+    """Update current user's profile (email, profile_pic_url, password); a new password signs out other sessions"""
+    password_hash = None
+    if user_update.password is not None:
+        # Hashed in the hashing pool, outside the request threadpool
+        password_hash = await get_password_hash_async(user_update.password)
+
+    return await run_in_threadpool(_apply_user_update, db, current_user, user_update, password_hash, session_id)
+
 
 @router.get("/me", response_model=UserResponse)
 def get_current_user_info(current_user: User = Depends(get_current_user)):
@@ -82,69 +117,74 @@ def get_user_stats(user_id: int, db: Session = Depends(get_db)):
 def get_follow_status(
     user_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user_id: int = Depends(get_current_user_id)
 ):
     """Check if current user is following the specified user"""
     is_following = db.query(UserRelation).filter(
-        UserRelation.follower_id == current_user.user_id,
+        UserRelation.follower_id == current_user_id,
         UserRelation.followed_id == user_id
     ).first() is not None
 
     return {"is_following": is_following}
 
 
+def follow_state(db: Session, user_id: int, follower_id: int) -> dict:
+    """Whether the user exists, their follower count and whether follower_id follows them, in one query"""
+    row = db.query(
+        exists().where(User.user_id == user_id).label("user_exists"),
+        select(func.count(UserRelation.relation_id)).where(
+            UserRelation.followed_id == user_id
+        ).scalar_subquery().label("followers_count"),
+        exists().where(
+            UserRelation.followed_id == user_id,
+            UserRelation.follower_id == follower_id
+        ).label("following")
+    ).one()
+
+    if not row.user_exists:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"is_following": bool(row.following), "followers_count": row.followers_count}
+
 @router.post("/{user_id}/follow")
 def follow_user(
     user_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user_id: int = Depends(get_current_user_id)
 ):
-    if user_id == current_user.user_id:
+    """Follow a user - idempotent, following again just returns the current state"""
+    if user_id == current_user_id:
         raise HTTPException(status_code=400, detail="Cannot follow yourself")
 
-    user_to_follow = db.query(User).filter(User.user_id == user_id).first()
-    if not user_to_follow:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    existing_relation = db.query(UserRelation).filter(
-        UserRelation.follower_id == current_user.user_id,
-        UserRelation.followed_id == user_id
-    ).first()
-
-    if existing_relation:
-        raise HTTPException(status_code=400, detail="Already following this user")
-
-    relation = UserRelation(
-        follower_id=current_user.user_id,
-        followed_id=user_id
+    # One statement: inserts only if the user exists and the relation doesn't
+    insert_from_select_ignore_duplicates(
+        db,
+        UserRelation.__table__,
+        ["follower_id", "followed_id"],
+        select(literal(current_user_id), User.user_id).where(User.user_id == user_id)
     )
-    db.add(relation)
     db.commit()
 
-    return {"message": "Successfully followed user"}
+    return {"message": "Successfully followed user", **follow_state(db, user_id, current_user_id)}
 
 
 @router.delete("/{user_id}/follow")
 def unfollow_user(
     user_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user_id: int = Depends(get_current_user_id)
 ):
-    relation = db.query(UserRelation).filter(
-        UserRelation.follower_id == current_user.user_id,
+    """Unfollow a user - idempotent, unfollowing someone not followed is not an error"""
+    db.query(UserRelation).filter(
+        UserRelation.follower_id == current_user_id,
         UserRelation.followed_id == user_id
-    ).first()
-
-    if not relation:
-        raise HTTPException(status_code=404, detail="Not following this user")
-
-    db.delete(relation)
+    ).delete(synchronize_session=False)
     db.commit()
 
-    return {"message": "Successfully unfollowed user"}
+    return {"message": "Successfully unfollowed user", **follow_state(db, user_id, current_user_id)}
 
 
-@router.get("/{user_id}/followers")
+@router.get("/{user_id}/followers", response_model=List[UserSummary])
+@query_budget(1)
 def get_followers(
     user_id: int,
     skip: int = 0,
@@ -152,17 +192,18 @@ def get_followers(
     db: Session = Depends(get_db)
 ):
     """Get list of users following this user"""
-    followers = db.query(User).join(
+    followers = db.query(*USER_SUMMARY_COLUMNS).join(
         UserRelation,
         UserRelation.follower_id == User.user_id
     ).filter(
         UserRelation.followed_id == user_id
     ).offset(skip).limit(limit).all()
 
-    return followers
+    return fast_json_response(rows_to_dicts(followers))
 
 
-@router.get("/{user_id}/following")
+@router.get("/{user_id}/following", response_model=List[UserSummary])
+@query_budget(1)
 def get_following(
     user_id: int,
     skip: int = 0,
@@ -170,11 +211,11 @@ def get_following(
     db: Session = Depends(get_db)
 ):
     """Get list of users this user is following"""
-    following = db.query(User).join(
+    following = db.query(*USER_SUMMARY_COLUMNS).join(
         UserRelation,
         UserRelation.followed_id == User.user_id
     ).filter(
         UserRelation.follower_id == user_id
     ).offset(skip).limit(limit).all()
 
-    return following
+    return fast_json_response(rows_to_dicts(following))
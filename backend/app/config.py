@@ -8,20 +8,105 @@ class Settings(BaseSettings):
     DB_USER: str
     DB_PASSWORD: str
     DB_NAME: str
+    DATABASE_URL: Optional[str] = None  # Any SQLAlchemy URL, e.g. sqlite:///bench.db; overrides the DB_* settings
 
     # Security settings
     SECRET_KEY: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    REFRESH_TOKEN_EXPIRE_DAYS: int = 30
     ALGORITHM: str = "HS256"
+    TOKEN_CACHE_SIZE: int = 10000  # Decoded claims of recently verified tokens, 0 disables
+
+    # Password hashing - bcrypt runs in a dedicated process pool
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2  # 0 hashes on the request threadpool instead
+    PASSWORD_HASH_MAX_PENDING: int = 64  # Further logins get 503 until the queue drains
 
     # AI Model settings
     MODEL_CACHE_DIR: str = "./models"
+    # Served until a version is registered in model_versions, which takes over from then on
+    SENTIMENT_MODEL: str = "cardiffnlp/twitter-roberta-base-sentiment-latest"
+    SARCASM_MODEL: str = "helinivan/english-sarcasm-detector"
+    MODEL_REGISTRY_POLL_SECONDS: int = 10  # How soon workers pick up new, promoted or discarded versions
+    MODEL_SHADOW_MAX_PENDING: int = 16  # Shadow analyses queued per worker before further ones are skipped
+    # Analyses of recent texts, reused for texts with the same model inputs; 0 disables
+    ANALYSIS_CACHE_SIZE: int = 10000
+    # Below 1, also reused for near-duplicates whose estimated Jaccard similarity (of normalized texts) reaches it
+    ANALYSIS_CACHE_SIMILARITY: float = 1.0
+    # First-pass classifier that answers confident texts before the models (train_cascade.py); unset disables
+    CASCADE_MODEL_PATH: Optional[str] = None
+    CASCADE_SENTIMENT_CONFIDENCE: float = 0.9
+    CASCADE_SARCASM_CONFIDENCE: float = 0.95
+    CASCADE_MAX_LENGTH: int = 280  # Characters; longer texts always go to the models
+    CASCADE_AUDIT_PERCENT: float = 2  # Confident answers also run through the models to measure agreement
+
+    # Inference threads - forward passes run on this many threads per process, whatever the request concurrency
+    INFERENCE_THREADS: int = 2
+    INFERENCE_INTRA_OP_THREADS: int = 0  # torch threads per forward pass, 0 splits the cores between all inference threads
+    INFERENCE_INTEROP_THREADS: int = 1
+    INFERENCE_PIN_CORES: bool = False  # Pin each inference thread to its own cores (Linux)
+
+    # Production server (python run.py --production) - models are loaded once and shared by forked workers
+    SERVER_WORKERS: int = 4
+    MODEL_SHARED_MEMORY: bool = True  # Put weights in /dev/shm (size it to fit both models), else rely on copy-on-write
+    WORKER_MEMORY_REPORT_SECONDS: int = 300  # Log per-worker memory this often, 0 disables
+
+    # Ad-hoc analysis limits
+    ANALYZE_MAX_TEXT_LENGTH: int = 5000  # Characters per text
+    ANALYZE_MAX_BATCH_SIZE: int = 32  # Texts per batch request
+    ANALYZE_MICRO_BATCH_SIZE: int = 8  # Texts per forward pass when streaming a batch
+
+    # Comment tree settings
+    COMMENT_TREE_MAX_DEPTH: int = 5
+    COMMENT_TREE_MAX_PAGE_SIZE: int = 100
+
+    # Moderation queue - claims not resolved within this long go back to the queue
+    MODERATION_CLAIM_TIMEOUT_MINUTES: int = 30
+    MODERATION_RULES_CACHE_SECONDS: int = 30  # How long a worker may use rules that were since changed
+
+    # Encode list responses with orjson straight from query rows
+    FAST_JSON_RESPONSES: bool = True
+
+    # Compress responses larger than this many bytes (Brotli when brotli-asgi is installed, else GZip)
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_MIN_SIZE: int = 1024
+
+    # Write-behind likes - buffer like/unlike intents and flush them in batches
+    LIKE_WRITE_BEHIND_ENABLED: bool = False
+    LIKE_FLUSH_INTERVAL_MS: int = 200
+    LIKE_LOG_DIR: Optional[str] = None  # Append intents here so a crash can be replayed, unset keeps them in memory only
+    LIKE_LOG_FSYNC: bool = False  # fsync every intent, survives power loss not just a process crash
+
+    # Rate limiting - token buckets per user (or per IP when anonymous), refilled in tokens/second
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: str = "memory"  # "memory" (per worker) or "redis" (shared)
+    RATE_LIMIT_REDIS_URL: str = "redis://localhost:6379/0"
+    RATE_LIMIT_MAX_KEYS: int = 100000  # Buckets kept by the memory backend
+    RATE_LIMIT_RATE: float = 10
+    RATE_LIMIT_BURST: float = 60
+    RATE_LIMIT_INFERENCE_RATE: float = 1  # Routes that run the AI models
+    RATE_LIMIT_INFERENCE_BURST: float = 20
+    RATE_LIMIT_INFERENCE_GLOBAL_RATE: float = 20  # Shared by all callers, size to model throughput
+    RATE_LIMIT_INFERENCE_GLOBAL_BURST: float = 100
+    RATE_LIMIT_TRUST_FORWARDED: bool = False  # Key anonymous callers on X-Forwarded-For (behind a proxy)
+
+    # Request profiling - Server-Timing header with db / inference / serialization time, X-Profile captures for admins
+    PROFILING_ENABLED: bool = False
+    SLOW_REQUEST_MS: int = 1000  # Log profiled requests slower than this with their slowest statements, 0 disables
+    SLOW_QUERY_MS: int = 200  # Log statements slower than this with their SQL (also without PROFILING_ENABLED), 0 disables
+    PROFILE_SAMPLE_PERCENT: float = 0  # Also capture a cProfile of this share of all requests
+    PROFILE_DIR: str = "./profiles"
+
+    # Query budgets - count each request's statements against its route's @query_budget
+    QUERY_BUDGET_MODE: str = "off"  # "off", "log" (warn when over budget) or "raise" (fail the request, for tests and CI)
 
     # Environment
     ENVIRONMENT: str = "development"
 
     @property
     def database_url(self) -> str:
+        if self.DATABASE_URL:
+            return self.DATABASE_URL
         return f"mysql+pymysql://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
 
     class Config:
@@ -1,8 +1,19 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from app.database import engine, Base
+from app.config import settings
+from app.database import engine, Base, SessionLocal
 from app.api.v1 import auth, users, posts, comments, admin
+from app.utils.security import PasswordHasherBusy, shutdown_password_hasher
+from app.utils.like_aggregator import like_aggregator
+from app.utils.rate_limit import RateLimitMiddleware
+from app.utils.compression import StreamAwareGZipMiddleware, STREAMED_PATHS
+from app.utils.rules import seed_default_rules
+from app.services.ai_service import ai_service
+from app.utils.inference import shutdown_inference_executor
+from app.utils.profiling import ProfilingMiddleware, install_query_hooks
+from app.utils.query_budget import install_query_counter
 import logging
 
 # Configure logging
@@ -12,12 +23,21 @@ logger = logging.getLogger(__name__)
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
+if settings.PROFILING_ENABLED or settings.SLOW_QUERY_MS:
+    install_query_hooks(engine)
+if settings.QUERY_BUDGET_MODE != "off":
+    install_query_counter(engine)
+
 app = FastAPI(
     title="Social Media API with AI Sentiment Analysis",
     description="A comprehensive social media platform with AI-powered sentiment and sarcasm detection",
     version="1.0.0"
 )
 
+# Rate limiting - added first so it runs inside CORS and 429s still carry CORS headers
+if settings.RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -34,6 +54,29 @@ app.add_middleware(
     allowed_hosts=["db.varunadhityagb.live", "localhost", "127.0.0.1", "0.0.0.0", "172.29.22.232", "100.69.58.49"]
 )
 
+# Response compression - prefer Brotli when available, it falls back to GZip itself.
+# Streamed responses are left alone so their lines aren't held back
+if settings.COMPRESSION_ENABLED:
+    try:
+        from brotli_asgi import BrotliMiddleware
+        app.add_middleware(
+            BrotliMiddleware,
+            minimum_size=settings.COMPRESSION_MIN_SIZE,
+            gzip_fallback=True,
+            excluded_handlers=STREAMED_PATHS
+        )
+    except ImportError:
+        logger.info("brotli-asgi not installed, using GZip compression only")
+        app.add_middleware(
+            StreamAwareGZipMiddleware,
+            minimum_size=settings.COMPRESSION_MIN_SIZE,
+            excluded_handlers=STREAMED_PATHS
+        )
+
+# Request profiling - added last so it is outermost and times the whole stack
+if settings.PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
 # Include routers
 app.include_router(auth.router, prefix="/api/v1/auth", tags=["authentication"])
 app.include_router(users.router, prefix="/api/v1/users", tags=["users"])
@@ -41,6 +84,35 @@ app.include_router(posts.router, prefix="/api/v1/posts", tags=["posts"])
 app.include_router(comments.router, prefix="/api/v1/posts", tags=["comments"])
 app.include_router(admin.router, prefix="/api/v1/admin", tags=["admin"])  # Add admin router
 
+@app.exception_handler(PasswordHasherBusy)
+def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Authentication is busy, please retry shortly"},
+        headers={"Retry-After": "1"},
+    )
+
+@app.on_event("startup")
+def startup():
+    db = SessionLocal()
+    try:
+        seed_default_rules(db)
+    finally:
+        db.close()
+
+    if like_aggregator is not None:
+        like_aggregator.recover()
+        like_aggregator.start()
+    ai_service.start()
+
+@app.on_event("shutdown")
+def shutdown():
+    ai_service.stop()
+    shutdown_inference_executor()
+    if like_aggregator is not None:
+        like_aggregator.stop()
+    shutdown_password_hasher()
+
 @app.get("/")
 def root():
     return {"message": "Social Media API with AI Sentiment Analysis is running!"}
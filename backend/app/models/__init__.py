@@ -3,5 +3,9 @@ from .post import Post
 from .comment import Comment
 from .user_relation import UserRelation
 from .like import Like
+from .session import UserSession
+from .moderation import ModerationItem
+from .moderation_rule import ModerationRule
+from .model_version import ModelVersion
 
-__all__ = ["User", "Post", "Comment", "UserRelation", "Like"]
+__all__ = ["User", "Post", "Comment", "UserRelation", "Like", "UserSession", "ModerationItem", "ModerationRule", "ModelVersion"]
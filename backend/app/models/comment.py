@@ -1,7 +1,18 @@
-from sqlalchemy import Column, Integer, String, Text, Float, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, Float, Boolean, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from app.database import Base
 from datetime import datetime
+from typing import Optional
+
+# Width of one zero-padded comment_id segment in Comment.path
+COMMENT_PATH_WIDTH = 10
+COMMENT_PATH_LENGTH = 512
+# Deepest reply whose path still fits, one segment and separator per level
+COMMENT_MAX_DEPTH = COMMENT_PATH_LENGTH // (COMMENT_PATH_WIDTH + 1) - 1
+
+def comment_path(parent_path: Optional[str], comment_id: int) -> str:
+    """Materialized path of a comment: its ancestors' ids followed by its own, e.g. "0000000012/0000000034/" """
+    return f"{parent_path or ''}{comment_id:0{COMMENT_PATH_WIDTH}d}/"
 
 class Comment(Base):
     __tablename__ = "comments"
@@ -14,15 +25,28 @@ class Comment(Base):
     content = Column(Text)
     parent_comment_id = Column(Integer, ForeignKey("comments.comment_id"), nullable=True)
 
+    # Threading - a subtree is the range of paths sharing its root's prefix
+    path = Column(String(COMMENT_PATH_LENGTH), nullable=True)
+    depth = Column(Integer, default=0)
+
     # AI Analysis fields
     sentiment_label = Column(String(20))
     sentiment_confidence = Column(Float)
     is_sarcastic = Column(Boolean, default=False)
     sarcasm_confidence = Column(Float)
     analyzed_at = Column(DateTime, default=datetime.utcnow)
+    needs_review = Column(Boolean, default=False)
+    analysis_revision = Column(String(255), nullable=True)  # Models that produced the stored analysis, NULL until analyzed
 
     # Relationships
     post = relationship("Post", back_populates="comments")
     user = relationship("User", back_populates="comments")
     parent_comment = relationship("Comment", remote_side=[comment_id])
     likes = relationship("Like", back_populates="comment")
+
+    __table_args__ = (
+        # Subtree range scans
+        Index("ix_comments_post_path", "post_id", "path"),
+        # Keyset pagination of one level (top-level comments or direct replies)
+        Index("ix_comments_post_depth_path", "post_id", "depth", "path"),
+    )
@@ -0,0 +1,30 @@
+from sqlalchemy import Column, Integer, String, Float, DateTime
+from app.database import Base
+from datetime import datetime
+
+# Lifecycle of a registered model version
+MODEL_CANDIDATE = "candidate"  # Loaded next to the active models and given some traffic
+MODEL_ACTIVE = "active"
+MODEL_RETIRED = "retired"
+
+# How a candidate gets traffic
+ROUTING_SHADOW = "shadow"  # Runs on a sample of requests next to the active models, its results are only compared
+ROUTING_SPLIT = "split"  # Serves a percentage of requests itself
+
+class ModelVersion(Base):
+    """A pair of sentiment and sarcasm models the service can serve (see app.services.model_registry)"""
+    __tablename__ = "model_versions"
+
+    version_id = Column(Integer, primary_key=True, index=True)
+    sentiment_model = Column(String(255), nullable=False)  # Hugging Face hub name or local path
+    sentiment_revision = Column(String(64), nullable=True)  # Hub branch, tag or commit, NULL for the latest
+    sarcasm_model = Column(String(255), nullable=False)
+    sarcasm_revision = Column(String(64), nullable=True)
+    # What analyses it produces are stamped with (posts/comments.analysis_revision), set once loaded
+    model_revision = Column(String(255), nullable=True)
+    status = Column(String(10), nullable=False, default=MODEL_CANDIDATE, index=True)
+    routing = Column(String(10), nullable=False, default=ROUTING_SHADOW)
+    traffic_percent = Column(Float, nullable=False, default=10)  # Requests mirrored (shadow) or served (split)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    promoted_at = Column(DateTime, nullable=True)
+    retired_at = Column(DateTime, nullable=True)
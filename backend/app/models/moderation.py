@@ -0,0 +1,40 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, UniqueConstraint
+from app.database import Base
+from datetime import datetime
+
+# Queue item states
+MODERATION_PENDING = "pending"
+MODERATION_CLAIMED = "claimed"
+MODERATION_RESOLVED = "resolved"
+MODERATION_OPEN_STATUSES = (MODERATION_PENDING, MODERATION_CLAIMED)
+
+# Why content was queued
+MODERATION_REASON_FLAGGED = "flagged"  # Reported by a user
+MODERATION_REASON_AI = "ai"  # The analysis needs review
+
+MODERATION_RESOLUTIONS = ("approved", "removed")
+
+class ModerationItem(Base):
+    """One post or comment awaiting (or done with) review, written when it gets flagged or analyzed"""
+    __tablename__ = "moderation_queue"
+
+    item_id = Column(Integer, primary_key=True, index=True)
+    content_type = Column(String(10), nullable=False)  # "post" or "comment"
+    content_id = Column(Integer, nullable=False)
+    post_id = Column(Integer, ForeignKey("posts.post_id"), nullable=False)  # The post itself, or the comment's post
+    reason = Column(String(20), nullable=False)
+    priority = Column(Integer, nullable=False, default=0)  # Higher is reviewed first
+    status = Column(String(10), nullable=False, default=MODERATION_PENDING)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    claimed_by = Column(Integer, ForeignKey("users.user_id"), nullable=True)
+    claimed_at = Column(DateTime, nullable=True)
+    resolved_by = Column(Integer, ForeignKey("users.user_id"), nullable=True)
+    resolved_at = Column(DateTime, nullable=True)
+    resolution = Column(String(10), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("content_type", "content_id", name="unique_moderation_content"),
+        # Queue reads: highest priority first within a status, optionally for one content type
+        Index("ix_moderation_queue_status_priority", "status", "priority", "item_id"),
+        Index("ix_moderation_queue_type_status_priority", "content_type", "status", "priority", "item_id"),
+    )
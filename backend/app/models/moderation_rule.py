@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, JSON
+from app.database import Base
+from datetime import datetime
+
+class ModerationRule(Base):
+    """A moderation policy rule: content needs review when all its conditions hold (see app.utils.rules)"""
+    __tablename__ = "moderation_rules"
+
+    rule_id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), unique=True, nullable=False)
+    # [{"field": "sentiment_confidence", "op": ">", "value": 0.8}, ...]
+    conditions = Column(JSON, nullable=False)
+    enabled = Column(Boolean, default=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
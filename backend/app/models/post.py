@@ -13,6 +13,7 @@ class Post(Base):
     title = Column(String(255))
     content = Column(Text)
     is_deleted = Column(Boolean, default=False)
+    like_count = Column(Integer, default=0, server_default="0", nullable=False)  # Kept in sync with likes
 
     # AI Analysis fields
     sentiment_label = Column(String(20))
@@ -20,6 +21,8 @@ class Post(Base):
     is_sarcastic = Column(Boolean, default=False)
     sarcasm_confidence = Column(Float)
     analyzed_at = Column(DateTime, default=datetime.utcnow)
+    needs_review = Column(Boolean, default=False)
+    analysis_revision = Column(String(255), nullable=True)  # Models that produced the stored analysis, NULL until analyzed
 
     # Manual flagging
     is_flagged = Column(Boolean, default=False)
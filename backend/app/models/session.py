@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
+from sqlalchemy.orm import relationship
+from app.database import Base
+from datetime import datetime
+
+class UserSession(Base):
+    __tablename__ = "user_sessions"
+
+    session_id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    # SHA-256 of the opaque refresh token; the token itself is never stored
+    refresh_token_hash = Column(String(64), unique=True, index=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime, nullable=True)
+    user_agent = Column(String(255), nullable=True)
+    ip_address = Column(String(45), nullable=True)
+
+    user = relationship("User", back_populates="sessions")
+
+    __table_args__ = (
+        # Listing and revoking a user's active sessions
+        Index("ix_user_sessions_user_revoked", "user_id", "revoked_at"),
+    )
@@ -28,3 +28,4 @@ class User(Base):
         back_populates="followed"
     )
     likes = relationship("Like", back_populates="user")
+    sessions = relationship("UserSession", back_populates="user")
@@ -1,9 +1,13 @@
-from .user import UserCreate, UserLogin, UserResponse, Token
-from .post import PostCreate, PostResponse, PostAnalysis
+from .user import UserCreate, UserLogin, UserResponse, Token, RefreshRequest, SessionResponse
+from .post import PostCreate, PostResponse, PostAnalysis, AnalyzeRequest, AnalyzeBatchRequest, AnalyzeBatchResponse
 from .comment import CommentCreate, CommentResponse
+from .moderation import ModerationResolve, RuleCondition, ModerationRuleCreate, ModerationRuleUpdate, ModerationRuleResponse
+from .model_version import ModelVersionCreate, ModelVersionUpdate, ModelVersionResponse
 
 __all__ = [
-    "UserCreate", "UserLogin", "UserResponse", "Token",
-    "PostCreate", "PostResponse", "PostAnalysis",
-    "CommentCreate", "CommentResponse"
+    "UserCreate", "UserLogin", "UserResponse", "Token", "RefreshRequest", "SessionResponse",
+    "PostCreate", "PostResponse", "PostAnalysis", "AnalyzeRequest", "AnalyzeBatchRequest", "AnalyzeBatchResponse",
+    "CommentCreate", "CommentResponse",
+    "ModerationResolve", "RuleCondition", "ModerationRuleCreate", "ModerationRuleUpdate", "ModerationRuleResponse",
+    "ModelVersionCreate", "ModelVersionUpdate", "ModelVersionResponse"
 ]
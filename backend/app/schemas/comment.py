@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 class CommentCreate(BaseModel):
     content: str
@@ -21,6 +21,7 @@ class CommentResponse(BaseModel):
     sarcasm_confidence: Optional[float] = None
     like_count: int = 0  # Added like_count
     user_has_liked: bool = False  # Added user_has_liked
+    content_truncated: Optional[bool] = None  # Only set with ?preview_length=
 
     class Config:
         from_attributes = True
@@ -28,3 +29,17 @@ class CommentResponse(BaseModel):
 
 class CommentUpdate(BaseModel):
     content: Optional[str] = None
+
+
+class CommentTreeNode(CommentResponse):
+    replies: List["CommentTreeNode"] = []
+    has_more_replies: bool = False
+    replies_cursor: Optional[int] = None  # Pass as cursor to the replies endpoint to load more
+
+
+class CommentTreePage(BaseModel):
+    items: List[CommentTreeNode]
+    next_cursor: Optional[int] = None
+
+
+CommentTreeNode.model_rebuild()
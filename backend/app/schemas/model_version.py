@@ -0,0 +1,37 @@
+from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import Literal, Optional
+
+
+class ModelVersionCreate(BaseModel):
+    # Either model may be left out to keep the active one
+    sentiment_model: Optional[str] = Field(None, min_length=1, max_length=255)
+    sentiment_revision: Optional[str] = Field(None, max_length=64)
+    sarcasm_model: Optional[str] = Field(None, min_length=1, max_length=255)
+    sarcasm_revision: Optional[str] = Field(None, max_length=64)
+    routing: Literal["shadow", "split"] = "shadow"
+    traffic_percent: float = Field(10, ge=0, le=100)
+
+
+class ModelVersionUpdate(BaseModel):
+    routing: Optional[Literal["shadow", "split"]] = None
+    traffic_percent: Optional[float] = Field(None, ge=0, le=100)
+
+
+class ModelVersionResponse(BaseModel):
+    version_id: int
+    sentiment_model: str
+    sentiment_revision: Optional[str] = None
+    sarcasm_model: str
+    sarcasm_revision: Optional[str] = None
+    model_revision: Optional[str] = None
+    status: str
+    routing: str
+    traffic_percent: float
+    created_at: datetime
+    promoted_at: Optional[datetime] = None
+    retired_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+        protected_namespaces = ()  # Allow the model_* fields
@@ -0,0 +1,39 @@
+from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import List, Literal, Optional, Union
+
+
+class ModerationResolve(BaseModel):
+    # removed soft-deletes a post or deletes a comment, approved clears a post's flag
+    resolution: Literal["approved", "removed"]
+
+
+class RuleCondition(BaseModel):
+    field: Literal["sentiment_label", "sentiment_confidence", "is_sarcastic", "sarcasm_confidence"]
+    op: Literal["==", "!=", ">", ">=", "<", "<="]
+    value: Union[bool, float, str]
+
+
+class ModerationRuleCreate(BaseModel):
+    name: str = Field(min_length=1, max_length=100)
+    # Content needs review when all conditions hold
+    conditions: List[RuleCondition] = Field(min_length=1)
+    enabled: bool = True
+
+
+class ModerationRuleUpdate(BaseModel):
+    name: Optional[str] = Field(None, min_length=1, max_length=100)
+    conditions: Optional[List[RuleCondition]] = Field(None, min_length=1)
+    enabled: Optional[bool] = None
+
+
+class ModerationRuleResponse(BaseModel):
+    rule_id: int
+    name: str
+    conditions: List[dict]
+    enabled: bool
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
@@ -1,6 +1,7 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional
+from typing import Annotated, List, Optional
+from app.config import settings
 
 
 class PostCreate(BaseModel):
@@ -20,16 +21,47 @@ class PostResponse(BaseModel):
     is_sarcastic: Optional[bool] = None
     sarcasm_confidence: Optional[float] = None
     analyzed_at: Optional[datetime] = None
+    # Only present when requested with ?include=
+    like_count: Optional[int] = None
+    comment_count: Optional[int] = None
+    user_has_liked: Optional[bool] = None
+    # Only present when requested with ?preview_length=
+    content_truncated: Optional[bool] = None
 
     class Config:
         from_attributes = True
 
 
 class PostAnalysis(BaseModel):
-    text: str
+    text: Optional[str] = None
     sentiment: dict
     sarcasm: dict
     needs_review: bool
+    # The models that produced it
+    model_revision: Optional[str] = None
+    analyzed_at: Optional[datetime] = None
+
+    class Config:
+        protected_namespaces = ()  # Allow the model_revision field
+
+
+AnalyzeText = Annotated[str, Field(max_length=settings.ANALYZE_MAX_TEXT_LENGTH)]
+
+
+class AnalyzeRequest(BaseModel):
+    text: AnalyzeText = Field(min_length=1)
+    include_text: bool = True
+
+
+class AnalyzeBatchRequest(BaseModel):
+    texts: List[AnalyzeText] = Field(min_length=1, max_length=settings.ANALYZE_MAX_BATCH_SIZE)
+    include_text: bool = True
+    # Emit one NDJSON line per text as each micro-batch finishes
+    stream: bool = False
+
+
+class AnalyzeBatchResponse(BaseModel):
+    results: List[PostAnalysis]
 
 
 class PostUpdate(BaseModel):
@@ -26,9 +26,35 @@ class UserResponse(BaseModel):
         from_attributes = True
 
 
+class UserSummary(BaseModel):
+    """Public view of a user in lists of other users"""
+    user_id: int
+    user_name: str
+    profile_pic_url: Optional[str] = None
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None  # Access token lifetime in seconds
+
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+
+class SessionResponse(BaseModel):
+    session_id: int
+    created_at: datetime
+    last_used_at: datetime
+    expires_at: datetime
+    user_agent: Optional[str] = None
+    ip_address: Optional[str] = None
+    is_current: bool = False
+
+    class Config:
+        from_attributes = True
 
 
 class UserUpdate(BaseModel):
@@ -1,4 +1,5 @@
 from .ai_service import AIAnalysisService, ai_service
 from .auth_service import AuthService
+from .session_service import SessionService
 
-__all__ = ["AIAnalysisService", "ai_service", "AuthService"]
+__all__ = ["AIAnalysisService", "ai_service", "AuthService", "SessionService"]
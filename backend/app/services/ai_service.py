@@ -3,38 +3,96 @@ import torch
 import numpy as np
 from scipy.special import softmax
 import string
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 import logging
-from functools import lru_cache
+from app.config import settings
+from app.utils.rules import DEFAULT_RULESET
+from app.utils.fingerprint import Fingerprint, NearDuplicateCache, NEAR_DUPLICATE_SUFFIX
+from app.utils.cascade import load_cascade
+from app.services.model_registry import ModelRegistry, ModelSpec
 
 logger = logging.getLogger(__name__)
 
+# Longest input the models see, in tokens; longer texts are truncated
+SARCASM_MAX_TOKENS = 256
+SENTIMENT_MAX_TOKENS = 512
+
+# Bump when the analysis logic changes without a model change, e.g. moderation thresholds
+ANALYSIS_VERSION = 1
+
+def model_revision(*models) -> str:
+    """Identify the loaded models (name and hub commit) so stored analyses can be checked for staleness"""
+    parts = [f"v{ANALYSIS_VERSION}"]
+    for path, config in models:
+        commit = getattr(config, "_commit_hash", None)
+        parts.append(f"{path}@{commit[:12]}" if commit else path)
+    return ";".join(parts)
+
 class AIAnalysisService:
-    def __init__(self):
+    """One loaded pair of sarcasm and sentiment models; the ModelRegistry decides which pair serves a request"""
+
+    def __init__(self, spec: Optional[ModelSpec] = None):
+        self.spec = spec or ModelSpec.default()
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self._load_models()
+        # Per model set, so results of one set of models are never served for another
+        self.analysis_cache = NearDuplicateCache(
+            settings.ANALYSIS_CACHE_SIZE,
+            settings.ANALYSIS_CACHE_SIMILARITY,
+            exact_key=self._model_inputs
+        ) if settings.ANALYSIS_CACHE_SIZE > 0 else None
+        # Trained on these models' outputs, or None; its answers are stamped with their own revision
+        self.cascade = load_cascade(self.model_revision)
+        self.cascade_revision = f"{self.model_revision};cascade@{self.cascade.model.fingerprint}" if self.cascade else None
 
     def _load_models(self):
         try:
             # Sarcasm Detection Model
-            self.sarcasm_model_path = "helinivan/english-sarcasm-detector"
-            self.sarcasm_tokenizer = AutoTokenizer.from_pretrained(self.sarcasm_model_path)
-            self.sarcasm_model = AutoModelForSequenceClassification.from_pretrained(self.sarcasm_model_path)
+            self.sarcasm_model_path = self.spec.sarcasm_model
+            revision = self.spec.sarcasm_revision
+            self.sarcasm_tokenizer = AutoTokenizer.from_pretrained(self.sarcasm_model_path, revision=revision)
+            self.sarcasm_model = AutoModelForSequenceClassification.from_pretrained(self.sarcasm_model_path, revision=revision)
             self.sarcasm_model.to(self.device)
 
             # Sentiment Analysis Model
-            self.sentiment_model_path = "cardiffnlp/twitter-roberta-base-sentiment-latest"
-            self.sentiment_tokenizer = AutoTokenizer.from_pretrained(self.sentiment_model_path)
-            self.sentiment_model = AutoModelForSequenceClassification.from_pretrained(self.sentiment_model_path)
-            self.sentiment_config = AutoConfig.from_pretrained(self.sentiment_model_path)
+            self.sentiment_model_path = self.spec.sentiment_model
+            revision = self.spec.sentiment_revision
+            self.sentiment_tokenizer = AutoTokenizer.from_pretrained(self.sentiment_model_path, revision=revision)
+            self.sentiment_model = AutoModelForSequenceClassification.from_pretrained(self.sentiment_model_path, revision=revision)
+            self.sentiment_config = AutoConfig.from_pretrained(self.sentiment_model_path, revision=revision)
             self.sentiment_model.to(self.device)
 
-            logger.info("AI models loaded successfully")
+            self.model_revision = model_revision(
+                (self.sentiment_model_path, self.sentiment_config),
+                (self.sarcasm_model_path, self.sarcasm_model.config)
+            )
+            logger.info(f"AI models loaded successfully ({self.model_revision})")
 
         except Exception as e:
             logger.error(f"Error loading models: {e}")
             raise
 
+    def share_memory(self) -> bool:
+        """
+        Freeze the weights and move them into shared memory before workers are
+        forked, so every worker maps the same pages instead of copying them.
+        Returns False if they stay in private memory (GPU models, or /dev/shm too small).
+        """
+        models = (self.sarcasm_model, self.sentiment_model)
+        for model in models:
+            model.eval()
+            model.requires_grad_(False)
+
+        if self.device.type != "cpu":
+            return False
+        try:
+            for model in models:
+                model.share_memory()
+        except RuntimeError as e:
+            logger.warning(f"Could not move model weights to shared memory, relying on copy-on-write: {e}")
+            return False
+        return True
+
     def preprocess_for_sarcasm(self, text: str) -> str:
         return text.lower().translate(str.maketrans("", "", string.punctuation)).strip()
 
@@ -46,7 +104,32 @@ class AIAnalysisService:
             new_text.append(t)
         return " ".join(new_text)
 
-    @lru_cache(maxsize=500)
+    def _model_inputs(self, text: str) -> Tuple[str, str]:
+        # Texts with the same inputs get exactly the same analysis
+        return self.preprocess_for_sentiment(text), self.preprocess_for_sarcasm(text)
+
+    def _cached_analysis(self, text: str) -> Tuple[Optional[Dict], Optional[Fingerprint]]:
+        if self.analysis_cache is None:
+            return None, None
+        cached, fingerprint = self.analysis_cache.lookup(text)
+        if cached is None:
+            return None, fingerprint
+        # A copy, callers adjust needs_review in place
+        analysis = {
+            **cached,
+            "text": text,
+            "sentiment": dict(cached["sentiment"]),
+            "sarcasm": dict(cached["sarcasm"])
+        }
+        if fingerprint.near_duplicate:
+            # Another text's analysis, not what the models would say about this one
+            analysis["model_revision"] = f"{cached['model_revision']}{NEAR_DUPLICATE_SUFFIX}"
+        return analysis, fingerprint
+
+    def _cache_analysis(self, fingerprint: Optional[Fingerprint], analysis: Dict):
+        if fingerprint is not None:
+            self.analysis_cache.store(fingerprint, {key: value for key, value in analysis.items() if key != "text"})
+
     def detect_sarcasm(self, text: str) -> Dict:
         try:
             processed_text = self.preprocess_for_sarcasm(text)
@@ -54,7 +137,7 @@ class AIAnalysisService:
                 [processed_text],
                 padding=True,
                 truncation=True,
-                max_length=256,
+                max_length=SARCASM_MAX_TOKENS,
                 return_tensors="pt"
             ).to(self.device)
 
@@ -74,11 +157,15 @@ class AIAnalysisService:
             logger.error(f"Sarcasm detection failed: {e}")
             return {"is_sarcastic": False, "confidence": 0.5}
 
-    @lru_cache(maxsize=500)
     def analyze_sentiment(self, text: str) -> Dict:
         try:
             processed_text = self.preprocess_for_sentiment(text)
-            encoded_input = self.sentiment_tokenizer(processed_text, return_tensors='pt').to(self.device)
+            encoded_input = self.sentiment_tokenizer(
+                processed_text,
+                truncation=True,
+                max_length=SENTIMENT_MAX_TOKENS,
+                return_tensors='pt'
+            ).to(self.device)
 
             with torch.no_grad():
                 output = self.sentiment_model(**encoded_input)
@@ -112,23 +199,145 @@ class AIAnalysisService:
         if not text or len(text.strip()) == 0:
             return self._get_empty_analysis()
 
-        sentiment_result = self.analyze_sentiment(text)
-        sarcasm_result = self.detect_sarcasm(text)
+        cached, fingerprint = self._cached_analysis(text)
+        if cached is not None:
+            return cached
+
+        answer = self.cascade.answer([text])[0] if self.cascade else None
+        if answer is not None and not answer.audit:
+            analysis = self._analysis(text, answer.sentiment, answer.sarcasm, self.cascade_revision)
+        else:
+            analysis = self._analysis(text, self.analyze_sentiment(text), self.detect_sarcasm(text), self.model_revision)
+            if answer is not None:
+                self.cascade.record_audit(self._analysis(text, answer.sentiment, answer.sarcasm, self.cascade_revision), analysis)
+        self._cache_analysis(fingerprint, analysis)
+        return analysis
+
+    # Batched inference, in stages so benchmarks/bench_ai_service.py can time each one
+
+    def encode_for_sarcasm(self, texts: List[str], max_length: int = SARCASM_MAX_TOKENS):
+        return self.sarcasm_tokenizer(
+            [self.preprocess_for_sarcasm(text) for text in texts],
+            padding=True,
+            truncation=True,
+            max_length=max_length,
+            return_tensors="pt"
+        ).to(self.device)
+
+    def sarcasm_results(self, logits: torch.Tensor) -> List[Dict]:
+        results = []
+        for probs in logits.softmax(dim=-1).tolist():
+            confidence = max(probs)
+            results.append({
+                "is_sarcastic": bool(probs.index(confidence)),
+                "confidence": round(confidence, 4)
+            })
+        return results
+
+    def encode_for_sentiment(self, texts: List[str], max_length: int = SENTIMENT_MAX_TOKENS):
+        return self.sentiment_tokenizer(
+            [self.preprocess_for_sentiment(text) for text in texts],
+            padding=True,
+            truncation=True,
+            max_length=max_length,
+            return_tensors='pt'
+        ).to(self.device)
+
+    def sentiment_results(self, logits: torch.Tensor) -> List[Dict]:
+        results = []
+        for scores in softmax(logits.detach().cpu().numpy(), axis=-1):
+            top = int(np.argmax(scores))
+            label = self.sentiment_config.id2label[top].lower()
+            results.append({
+                "sentiment_label": label,
+                "confidence": round(float(scores[top]), 4),
+                "is_positive": label == "positive",
+                "is_negative": label == "negative",
+                "is_neutral": label == "neutral"
+            })
+        return results
+
+    def detect_sarcasm_batch(self, texts: List[str]) -> List[Dict]:
+        """detect_sarcasm for several texts in one padded forward pass"""
+        try:
+            tokenized = self.encode_for_sarcasm(texts)
+            with torch.no_grad():
+                output = self.sarcasm_model(**tokenized)
+            return self.sarcasm_results(output.logits)
+
+        except Exception as e:
+            logger.error(f"Batched sarcasm detection failed: {e}")
+            return [{"is_sarcastic": False, "confidence": 0.5} for _ in texts]
+
+    def analyze_sentiment_batch(self, texts: List[str]) -> List[Dict]:
+        """analyze_sentiment for several texts in one padded forward pass"""
+        try:
+            encoded_input = self.encode_for_sentiment(texts)
+            with torch.no_grad():
+                output = self.sentiment_model(**encoded_input)
+            return self.sentiment_results(output[0])
+
+        except Exception as e:
+            logger.error(f"Batched sentiment analysis failed: {e}")
+            return [{
+                "sentiment_label": "neutral",
+                "confidence": 0.33,
+                "is_positive": False,
+                "is_negative": False,
+                "is_neutral": True
+            } for _ in texts]
+
+    def analyze_texts_complete(self, texts: List[str]) -> List[Dict]:
+        """analyze_text_complete for a batch of texts, running each model once over all those not cached"""
+        results, fingerprints = [], []
+        for text in texts:
+            if text and text.strip():
+                cached, fingerprint = self._cached_analysis(text)
+            else:
+                cached, fingerprint = self._get_empty_analysis(), None
+            results.append(cached)
+            fingerprints.append(fingerprint)
+        indexes = [i for i, result in enumerate(results) if result is None]
+
+        audits = {}
+        if indexes and self.cascade:
+            for i, answer in zip(indexes, self.cascade.answer([texts[i] for i in indexes])):
+                if answer is None:
+                    continue
+                cascaded = self._analysis(texts[i], answer.sentiment, answer.sarcasm, self.cascade_revision)
+                if answer.audit:
+                    audits[i] = cascaded
+                else:
+                    results[i] = cascaded
+                    self._cache_analysis(fingerprints[i], cascaded)
+            indexes = [i for i in indexes if results[i] is None]
+
+        if indexes:
+            batch = [texts[i] for i in indexes]
+            sentiments = self.analyze_sentiment_batch(batch)
+            sarcasms = self.detect_sarcasm_batch(batch)
+            for i, text, sentiment, sarcasm in zip(indexes, batch, sentiments, sarcasms):
+                results[i] = self._analysis(text, sentiment, sarcasm, self.model_revision)
+                self._cache_analysis(fingerprints[i], results[i])
+                if i in audits:
+                    self.cascade.record_audit(audits[i], results[i])
+        return results
+
+    def cascade_stats(self) -> Optional[Dict]:
+        return self.cascade.stats() if self.cascade else None
 
+    def _analysis(self, text: str, sentiment: Dict, sarcasm: Dict, revision: str) -> Dict:
         return {
             "text": text,
-            "sentiment": sentiment_result,
-            "sarcasm": sarcasm_result,
-            "needs_review": self._needs_moderation(sentiment_result, sarcasm_result)
+            "sentiment": sentiment,
+            "sarcasm": sarcasm,
+            "needs_review": self._needs_moderation(sentiment, sarcasm),
+            "model_revision": revision
         }
 
     def _needs_moderation(self, sentiment: Dict, sarcasm: Dict) -> bool:
-        # Flag for review if highly negative or highly negative + sarcastic
-        if sentiment["is_negative"] and sentiment["confidence"] > 0.8:
-            return True
-        if sentiment["is_negative"] and sarcasm["is_sarcastic"] and sarcasm["confidence"] > 0.6:
-            return True
-        return False
+        # Built-in policy; callers with a database session apply the configured rules instead
+        return DEFAULT_RULESET.matches({"sentiment": sentiment, "sarcasm": sarcasm})
 
     def _get_empty_analysis(self) -> Dict:
         return {
@@ -141,7 +350,8 @@ class AIAnalysisService:
                 "is_neutral": True
             },
             "sarcasm": {"is_sarcastic": False, "confidence": 1.0},
-            "needs_review": False
+            "needs_review": False,
+            "model_revision": self.model_revision
         }
 
-ai_service = AIAnalysisService()
+ai_service = ModelRegistry(AIAnalysisService)
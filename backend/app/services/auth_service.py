@@ -1,13 +1,14 @@
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from app.models.user import User
-from app.utils.security import get_password_hash, verify_password
+from app.utils.security import verify_password, verify_password_async
 from typing import Optional
 
 
 class AuthService:
     @staticmethod
-    def create_user(db: Session, user_name: str, user_email: str, password: str) -> User:
-        hashed_password = get_password_hash(password)
+    def create_user(db: Session, user_name: str, user_email: str, hashed_password: str) -> User:
+        """Create a user from an already hashed password (see get_password_hash_async)"""
         db_user = User(
             user_name=user_name,
             user_email=user_email,
@@ -25,6 +26,22 @@ class AuthService:
             return None
         return user
 
+    @staticmethod
+    async def authenticate_user_async(db: Session, username: str, password: str) -> Optional[User]:
+        """Authenticate with bcrypt in the hashing pool, upgrading the stored hash if its work factor changed"""
+        user = await run_in_threadpool(AuthService.get_user_by_username, db, username)
+        if not user:
+            return None
+
+        valid, new_hash = await verify_password_async(password, user.password_hash)
+        if not valid:
+            return None
+
+        if new_hash:
+            user.password_hash = new_hash
+            await run_in_threadpool(db.commit)
+        return user
+
     @staticmethod
     def get_user_by_username(db: Session, username: str) -> Optional[User]:
         return db.query(User).filter(User.user_name == username).first()
@@ -0,0 +1,411 @@
+"""
+Model registry.
+
+The models to serve are registered in the model_versions table: one active
+version, and at most one candidate that is loaded next to it and either
+mirrors a sample of requests in shadow mode (its results are only compared
+with the active models') or serves a percentage of them itself. Every worker
+polls the table and loads new versions in a background thread while the
+current models keep serving; the swap itself is a single reference
+assignment, so there is no downtime and requests in flight finish on the
+models they started with.
+
+Latency and agreement statistics are kept per worker process.
+
+Under the pre-fork server, workers leave loading to the master (see
+load_in_master): a worker loading a version itself would hold a private copy
+of its weights. The master loads it, shares it and replaces the workers.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+import logging
+import random
+import threading
+import time
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.utils.fingerprint import NEAR_DUPLICATE_SUFFIX
+from app.models.model_version import (
+    ModelVersion,
+    MODEL_ACTIVE,
+    MODEL_CANDIDATE,
+    ROUTING_SHADOW,
+    ROUTING_SPLIT
+)
+from app.utils.metrics import LatencyHistogram
+from app.utils.inference import run_inference
+
+logger = logging.getLogger(__name__)
+
+# Seconds per text, finer than the request buckets at the low end
+INFERENCE_LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0
+)
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """Which sentiment and sarcasm models to load, and at which hub revisions"""
+    sentiment_model: str
+    sarcasm_model: str
+    sentiment_revision: Optional[str] = None
+    sarcasm_revision: Optional[str] = None
+
+    @classmethod
+    def default(cls) -> "ModelSpec":
+        return cls(settings.SENTIMENT_MODEL, settings.SARCASM_MODEL)
+
+    @classmethod
+    def of(cls, version: ModelVersion) -> "ModelSpec":
+        return cls(version.sentiment_model, version.sarcasm_model, version.sentiment_revision, version.sarcasm_revision)
+
+
+class ModelComparison:
+    """Latency of the active and candidate models, and how often the candidate agrees in shadow mode"""
+
+    def __init__(self):
+        self.active_latency = LatencyHistogram("active", INFERENCE_LATENCY_BUCKETS)
+        self.candidate_latency = LatencyHistogram("candidate", INFERENCE_LATENCY_BUCKETS)
+        self._counts = dict.fromkeys(("compared", "sentiment", "sarcasm", "needs_review", "dropped"), 0)
+        self._lock = threading.Lock()
+
+    def record(self, active_results: List[Dict], candidate_results: List[Dict]):
+        with self._lock:
+            for active, candidate in zip(active_results, candidate_results):
+                self._counts["compared"] += 1
+                self._counts["sentiment"] += active["sentiment"]["sentiment_label"] == candidate["sentiment"]["sentiment_label"]
+                self._counts["sarcasm"] += active["sarcasm"]["is_sarcastic"] == candidate["sarcasm"]["is_sarcastic"]
+                self._counts["needs_review"] += active["needs_review"] == candidate["needs_review"]
+
+    def record_dropped(self):
+        with self._lock:
+            self._counts["dropped"] += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counts = dict(self._counts)
+        compared = counts["compared"]
+        return {
+            "compared": compared,
+            "shadow_dropped": counts["dropped"],
+            "agreement": {
+                key: round(counts[key] / compared, 4) if compared else None
+                for key in ("sentiment", "sarcasm", "needs_review")
+            },
+            "latency_per_text": {
+                "active": self.active_latency.snapshot(),
+                "candidate": self.candidate_latency.snapshot()
+            }
+        }
+
+
+@dataclass(frozen=True)
+class Serving:
+    """Everything a request routes on, replaced as a whole so each request sees one consistent state"""
+    active: object
+    active_spec: ModelSpec
+    active_version_id: Optional[int] = None
+    candidate: Optional[object] = None
+    candidate_spec: Optional[ModelSpec] = None
+    candidate_version_id: Optional[int] = None
+    routing: str = ROUTING_SHADOW
+    traffic_percent: float = 0
+
+
+class ModelRegistry:
+    """
+    Serves analyses from the active models (and the candidate's share of
+    traffic), with the same analyze_* interface as one loaded model set.
+    """
+
+    def __init__(self, loader: Callable[[ModelSpec], object]):
+        self._loader = loader
+        version = self._stored_active_version()
+        spec = ModelSpec.of(version) if version else ModelSpec.default()
+        self._serving = Serving(self._loader(spec), spec, version.version_id if version else None)
+        self._comparison = ModelComparison()
+        self._candidate_state: Optional[str] = None  # loading / ready / failed: <error>
+        self._candidate_state_version: Optional[int] = None
+        self._failed: Dict[ModelSpec, str] = {}  # Not retried until registered again
+        self._loads_models = True
+        self._shadow_executor: Optional[ThreadPoolExecutor] = None
+        self._shadow_pending = 0
+        self._shadow_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _stored_active_version() -> Optional[ModelVersion]:
+        db = SessionLocal()
+        try:
+            return db.query(ModelVersion).filter(ModelVersion.status == MODEL_ACTIVE).order_by(ModelVersion.version_id.desc()).first()
+        except Exception as e:
+            # First start, before the table exists
+            logger.info(f"No registered model version ({e.__class__.__name__}), loading the configured models")
+            return None
+        finally:
+            db.close()
+
+    @property
+    def active(self):
+        """The model set serving requests, apart from a candidate's split share"""
+        return self._serving.active
+
+    @property
+    def model_revision(self) -> str:
+        return self._serving.active.model_revision
+
+    def serves_revision(self, revision: Optional[str]) -> bool:
+        """Whether analyses stamped with this revision are current, i.e. not worth recomputing"""
+        serving = self._serving
+        if revision is None:
+            return False
+        if revision in self._revisions(serving.active):
+            return True
+        return serving.routing == ROUTING_SPLIT and serving.candidate is not None and revision in self._revisions(serving.candidate)
+
+    @staticmethod
+    def _revisions(models) -> tuple:
+        # Analyses come from the models themselves, or from their first-pass cascade,
+        # and either may have been reused for a near-duplicate text
+        revisions = (models.model_revision, getattr(models, "cascade_revision", None))
+        return revisions + tuple(f"{revision}{NEAR_DUPLICATE_SUFFIX}" for revision in revisions if revision)
+
+    def share_memory(self) -> bool:
+        """Move the active and candidate models' weights to shared memory before forking"""
+        serving = self._serving
+        shared = serving.active.share_memory()
+        if serving.candidate is not None:
+            shared = serving.candidate.share_memory() and shared
+        return shared
+
+    def loaded_models(self) -> tuple:
+        """The model sets held now, to tell whether a sync loaded new ones"""
+        serving = self._serving
+        return tuple(models for models in (serving.active, serving.candidate) if models is not None)
+
+    def load_in_master(self):
+        """
+        In a pre-forked worker: don't load new versions, keep serving the
+        current ones until the master has loaded them and replaced this worker.
+        Promoting an already loaded candidate still switches over right away.
+        """
+        self._loads_models = False
+
+    def cache_stats(self) -> Optional[Dict]:
+        """How many analyses the active models' near-duplicate cache answered, None when disabled"""
+        cache = getattr(self._serving.active, "analysis_cache", None)
+        return cache.stats() if cache is not None else None
+
+    def cascade_stats(self) -> Optional[Dict]:
+        """How many texts the active models' cascade answered and how well it agrees with them, None without one"""
+        cascade = getattr(self._serving.active, "cascade", None)
+        return cascade.stats() if cascade is not None else None
+
+    # Inference
+
+    def _timed(self, models, histogram: LatencyHistogram, texts: List[str], call):
+        start = time.perf_counter()
+        results = call(models)
+        histogram.observe((time.perf_counter() - start) / max(len(texts), 1))
+        return results
+
+    def _infer(self, models, histogram: LatencyHistogram, texts: List[str], call):
+        # Timed on the inference thread, so queueing for one does not count as model latency
+        return run_inference(self._timed, models, histogram, texts, call)
+
+    def _route(self, texts: List[str], call):
+        serving, comparison = self._serving, self._comparison
+        sampled = serving.candidate is not None and random.random() * 100 < serving.traffic_percent
+        if sampled and serving.routing == ROUTING_SPLIT:
+            return self._infer(serving.candidate, comparison.candidate_latency, texts, call)
+
+        results = self._infer(serving.active, comparison.active_latency, texts, call)
+        if sampled:
+            self._shadow(serving.candidate, comparison, texts, call, results)
+        return results
+
+    def _shadow(self, candidate, comparison: ModelComparison, texts: List[str], call, active_results):
+        """Run the candidate on the same texts off the request thread, or skip it when it is falling behind"""
+        with self._shadow_lock:
+            if self._shadow_pending >= settings.MODEL_SHADOW_MAX_PENDING:
+                comparison.record_dropped()
+                return
+            self._shadow_pending += 1
+            if self._shadow_executor is None:
+                self._shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-shadow")
+
+        def run():
+            try:
+                results = self._infer(candidate, comparison.candidate_latency, texts, call)
+                if isinstance(results, dict):
+                    comparison.record([active_results], [results])
+                else:
+                    comparison.record(active_results, results)
+            except Exception as e:
+                logger.error(f"Shadow analysis failed: {e}")
+            finally:
+                with self._shadow_lock:
+                    self._shadow_pending -= 1
+
+        self._shadow_executor.submit(run)
+
+    def analyze_text_complete(self, text: str) -> Dict:
+        return self._route([text], lambda models: models.analyze_text_complete(text))
+
+    def analyze_texts_complete(self, texts: List[str]) -> List[Dict]:
+        return self._route(texts, lambda models: models.analyze_texts_complete(texts))
+
+    # Versions
+
+    def _load(self, spec: ModelSpec):
+        if spec in self._failed or not self._loads_models:
+            return None
+        try:
+            return self._loader(spec)
+        except Exception as e:
+            self._failed[spec] = str(e)
+            logger.error(f"Could not load models {spec}: {e}")
+            return None
+
+    def _swap(self, serving: Serving, reset_comparison: bool):
+        self._serving = serving
+        if reset_comparison:
+            self._comparison = ModelComparison()
+
+    def sync(self, db: Session):
+        """Bring this worker in line with model_versions, loading new models while the current ones keep serving"""
+        active = db.query(ModelVersion).filter(ModelVersion.status == MODEL_ACTIVE).order_by(ModelVersion.version_id.desc()).first()
+        candidate = db.query(ModelVersion).filter(ModelVersion.status == MODEL_CANDIDATE).order_by(ModelVersion.version_id.desc()).first()
+        serving = self._serving
+
+        if active is None:
+            # Register what is being served, so analyses can be traced back to a version
+            db.add(ModelVersion(
+                sentiment_model=serving.active_spec.sentiment_model,
+                sentiment_revision=serving.active_spec.sentiment_revision,
+                sarcasm_model=serving.active_spec.sarcasm_model,
+                sarcasm_revision=serving.active_spec.sarcasm_revision,
+                model_revision=serving.active.model_revision,
+                status=MODEL_ACTIVE,
+                traffic_percent=100,
+                promoted_at=datetime.utcnow()
+            ))
+            db.commit()
+            return
+
+        spec = ModelSpec.of(active)
+        if spec != serving.active_spec:
+            if spec == serving.candidate_spec:
+                models = serving.candidate
+            else:
+                models = self._load(spec)
+                if models is None:
+                    return
+            logger.info(f"Switching to model version {active.version_id} ({models.model_revision})")
+            self._swap(Serving(models, spec, active.version_id), reset_comparison=True)
+            self._candidate_state = None
+            serving = self._serving
+        elif serving.active_version_id != active.version_id:
+            self._serving = serving = replace(serving, active_version_id=active.version_id)
+        if active.model_revision is None:
+            active.model_revision = serving.active.model_revision
+            db.commit()
+
+        if candidate is None:
+            if serving.candidate is not None:
+                logger.info(f"Dropping candidate model version {serving.candidate_version_id}")
+                self._swap(replace(serving, candidate=None, candidate_spec=None, candidate_version_id=None), reset_comparison=True)
+            self._candidate_state = None
+            return
+
+        spec = ModelSpec.of(candidate)
+        if spec != serving.candidate_spec:
+            self._candidate_state, self._candidate_state_version = "loading", candidate.version_id
+            models = self._load(spec)
+            if models is None:
+                if spec in self._failed:
+                    self._candidate_state = f"failed: {self._failed[spec]}"
+                return
+            logger.info(f"Loaded candidate model version {candidate.version_id} ({models.model_revision})")
+            self._swap(replace(
+                self._serving,
+                candidate=models,
+                candidate_spec=spec,
+                candidate_version_id=candidate.version_id,
+                routing=candidate.routing,
+                traffic_percent=candidate.traffic_percent
+            ), reset_comparison=True)
+            self._candidate_state = "ready"
+            self._candidate_state_version = candidate.version_id
+            if candidate.model_revision is None:
+                candidate.model_revision = models.model_revision
+                db.commit()
+        elif (serving.routing, serving.traffic_percent, serving.candidate_version_id) != (candidate.routing, candidate.traffic_percent, candidate.version_id):
+            self._candidate_state_version = candidate.version_id
+            self._serving = replace(
+                serving,
+                candidate_version_id=candidate.version_id,
+                routing=candidate.routing,
+                traffic_percent=candidate.traffic_percent
+            )
+
+    def forget_failures(self):
+        """Retry loading models that failed before, e.g. after fixing a typo'd name"""
+        self._failed.clear()
+
+    def status(self) -> Dict:
+        """What this worker serves, and how the candidate compares so far"""
+        serving = self._serving
+        return {
+            "active": {"version_id": serving.active_version_id, "model_revision": serving.active.model_revision},
+            "candidate": {
+                "version_id": self._candidate_state_version,
+                "model_revision": serving.candidate.model_revision if serving.candidate is not None else None,
+                "state": self._candidate_state,
+                "routing": serving.routing,
+                "traffic_percent": serving.traffic_percent
+            } if self._candidate_state else None,
+            "comparison": self._comparison.snapshot()
+        }
+
+    # Background sync
+
+    def request_sync(self):
+        """Sync now instead of at the next poll"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            db = SessionLocal()
+            try:
+                self.sync(db)
+            except Exception as e:
+                logger.error(f"Model registry sync failed: {e}")
+                db.rollback()
+            finally:
+                db.close()
+            self._wake.wait(settings.MODEL_REGISTRY_POLL_SECONDS)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="model-registry", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._shadow_executor is not None:
+            self._shadow_executor.shutdown(wait=False)
+            self._shadow_executor = None
@@ -0,0 +1,101 @@
+from sqlalchemy.orm import Session
+from app.models.session import UserSession
+from app.config import settings
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+import hashlib
+import secrets
+
+
+def _hash_refresh_token(refresh_token: str) -> str:
+    return hashlib.sha256(refresh_token.encode("utf-8")).hexdigest()
+
+
+class SessionService:
+    @staticmethod
+    def create_session(
+        db: Session,
+        user_id: int,
+        user_agent: Optional[str] = None,
+        ip_address: Optional[str] = None
+    ) -> Tuple[UserSession, str]:
+        """Start a session and return it with its refresh token (only available now)"""
+        refresh_token = secrets.token_urlsafe(48)
+        now = datetime.utcnow()
+        db_session = UserSession(
+            user_id=user_id,
+            refresh_token_hash=_hash_refresh_token(refresh_token),
+            created_at=now,
+            last_used_at=now,
+            expires_at=now + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS),
+            user_agent=user_agent[:255] if user_agent else None,
+            ip_address=ip_address
+        )
+        db.add(db_session)
+        db.commit()
+        db.refresh(db_session)
+        return db_session, refresh_token
+
+    @staticmethod
+    def get_active_session(db: Session, refresh_token: str) -> Optional[UserSession]:
+        db_session = db.query(UserSession).filter(
+            UserSession.refresh_token_hash == _hash_refresh_token(refresh_token)
+        ).first()
+        if not db_session or db_session.revoked_at is not None:
+            return None
+        if db_session.expires_at <= datetime.utcnow():
+            return None
+        return db_session
+
+    @staticmethod
+    def rotate(db: Session, refresh_token: str) -> Optional[Tuple[UserSession, str]]:
+        """Swap a valid refresh token for a new one; the old token stops working"""
+        db_session = SessionService.get_active_session(db, refresh_token)
+        if not db_session:
+            return None
+
+        # Conditional on the old hash, so two concurrent refreshes can't both succeed
+        new_refresh_token = secrets.token_urlsafe(48)
+        rotated = db.query(UserSession).filter(
+            UserSession.session_id == db_session.session_id,
+            UserSession.refresh_token_hash == _hash_refresh_token(refresh_token)
+        ).update({
+            UserSession.refresh_token_hash: _hash_refresh_token(new_refresh_token),
+            UserSession.last_used_at: datetime.utcnow()
+        }, synchronize_session=False)
+        db.commit()
+        if not rotated:
+            return None
+        return db_session, new_refresh_token
+
+    @staticmethod
+    def list_active(db: Session, user_id: int) -> List[UserSession]:
+        return db.query(UserSession).filter(
+            UserSession.user_id == user_id,
+            UserSession.revoked_at.is_(None),
+            UserSession.expires_at > datetime.utcnow()
+        ).order_by(UserSession.last_used_at.desc()).all()
+
+    @staticmethod
+    def revoke(db: Session, user_id: int, session_id: int) -> bool:
+        revoked = db.query(UserSession).filter(
+            UserSession.session_id == session_id,
+            UserSession.user_id == user_id,
+            UserSession.revoked_at.is_(None)
+        ).update({UserSession.revoked_at: datetime.utcnow()}, synchronize_session=False)
+        db.commit()
+        return revoked > 0
+
+    @staticmethod
+    def revoke_all(db: Session, user_id: int, except_session_id: Optional[int] = None, commit: bool = True) -> int:
+        """Revoke the user's sessions but one; commit=False leaves it to the caller's transaction"""
+        query = db.query(UserSession).filter(
+            UserSession.user_id == user_id,
+            UserSession.revoked_at.is_(None)
+        )
+        if except_session_id is not None:
+            query = query.filter(UserSession.session_id != except_session_id)
+        revoked = query.update({UserSession.revoked_at: datetime.utcnow()}, synchronize_session=False)
+        if commit:
+            db.commit()
+        return revoked
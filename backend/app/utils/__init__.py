@@ -2,12 +2,32 @@ from .security import (
     verify_password,
     get_password_hash,
     create_access_token,
-    verify_token
+    verify_token,
+    decode_token,
+    verify_password_async,
+    get_password_hash_async,
+    PasswordHasherBusy
+)
+from .serialization import (
+    rows_to_dicts,
+    project_columns,
+    preview_column,
+    truncate_previews,
+    fast_json_response
 )
 
 __all__ = [
     "verify_password",
     "get_password_hash",
     "create_access_token",
-    "verify_token"
+    "verify_token",
+    "decode_token",
+    "verify_password_async",
+    "get_password_hash_async",
+    "PasswordHasherBusy",
+    "rows_to_dicts",
+    "project_columns",
+    "preview_column",
+    "truncate_previews",
+    "fast_json_response"
 ]
@@ -0,0 +1,39 @@
+from datetime import datetime
+from sqlalchemy.orm import Session
+from app.utils.rules import get_active_ruleset
+
+
+def apply_moderation_rules(db: Session, analysis: dict) -> dict:
+    """Decide needs_review with the configured moderation rules rather than the built-in defaults"""
+    analysis["needs_review"] = get_active_ruleset(db).matches(analysis)
+    return analysis
+
+
+def store_analysis(row, analysis: dict):
+    """Persist an analyze_text_complete() result on a post or comment, stamped with the models that produced it"""
+    row.sentiment_label = analysis["sentiment"]["sentiment_label"]
+    row.sentiment_confidence = analysis["sentiment"]["confidence"]
+    row.is_sarcastic = analysis["sarcasm"]["is_sarcastic"]
+    row.sarcasm_confidence = analysis["sarcasm"]["confidence"]
+    row.needs_review = analysis["needs_review"]
+    row.analysis_revision = analysis["model_revision"]
+    row.analyzed_at = datetime.utcnow()
+
+
+def stored_analysis(row) -> dict:
+    """Rebuild the analyze_text_complete() shape from a post or comment's stored analysis"""
+    label = row.sentiment_label
+    return {
+        "text": row.content,
+        "sentiment": {
+            "sentiment_label": label,
+            "confidence": row.sentiment_confidence,
+            "is_positive": label == "positive",
+            "is_negative": label == "negative",
+            "is_neutral": label == "neutral"
+        },
+        "sarcasm": {"is_sarcastic": bool(row.is_sarcastic), "confidence": row.sarcasm_confidence},
+        "needs_review": bool(row.needs_review),
+        "model_revision": row.analysis_revision,
+        "analyzed_at": row.analyzed_at
+    }
@@ -0,0 +1,340 @@
+"""
+First-pass classifier cascade.
+
+Two small linear models over hashed word n-grams - one for sentiment, one for
+sarcasm - trained on the transformer models' own stored analyses
+(train_cascade.py). A text they are confident about on both counts gets their
+answer; everything else falls through to the transformer models. A small
+share of confident answers is audited: the transformer models run anyway and
+the agreement between the two is recorded, so the accuracy cost of the gates
+stays measured in production and not only at training time.
+
+NumPy only, a prediction costs microseconds next to the transformers' tens of
+milliseconds.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from functools import cached_property
+from typing import Dict, List, Optional, Sequence, Tuple
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+FEATURE_DIMS = 2 ** 18
+SENTIMENT_LABELS = ("negative", "neutral", "positive")
+SARCASM_LABELS = ("not_sarcastic", "sarcastic")
+
+_URL = re.compile(r"\bhttps?://\S+|\bwww\.\S+")
+_MENTION = re.compile(r"(?<!\w)@\w+")
+# Words, and punctuation or emoji as tokens of their own: "!!!" and ":(" carry sentiment
+_TOKEN = re.compile(r"\w+(?:'\w+)?|[^\w\s]+")
+_REPEATS = re.compile(r"(.)\1{2,}")
+
+
+def tokenize(text: str) -> List[str]:
+    text = _URL.sub(" http ", text)
+    text = _MENTION.sub(" @user ", text)
+    text = _REPEATS.sub(r"\1\1\1", text.lower())
+    return _TOKEN.findall(text)
+
+
+def _hash(feature: str, dims: int) -> int:
+    # crc32 rather than hash(), which is salted per process: the model is trained in another one
+    return zlib.crc32(feature.encode("utf-8")) % dims
+
+
+@dataclass
+class SparseRows:
+    """Hashed features of a batch of texts: row i is indices/values[offsets[i]:offsets[i + 1]]"""
+    indices: np.ndarray
+    values: np.ndarray
+    offsets: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+
+def featurize(texts: Sequence[str], dims: int = FEATURE_DIMS) -> SparseRows:
+    """Binary unigram and bigram features, scaled to unit length per text"""
+    indices, values, offsets = [], [], [0]
+    for text in texts:
+        tokens = ["<s>"] + tokenize(text) + ["</s>"]
+        features = set(tokens[1:-1])
+        features.update(f"{first} {second}" for first, second in zip(tokens, tokens[1:]))
+        hashed = sorted({_hash(feature, dims) for feature in features})
+        indices.extend(hashed)
+        values.extend([1 / np.sqrt(len(hashed))] * len(hashed))
+        offsets.append(len(indices))
+    return SparseRows(
+        np.asarray(indices, dtype=np.int64),
+        np.asarray(values, dtype=np.float32),
+        np.asarray(offsets, dtype=np.int64)
+    )
+
+
+class HashedLinearClassifier:
+    """Multinomial logistic regression over hashed features"""
+
+    def __init__(self, labels: Sequence[str], dims: int = FEATURE_DIMS,
+                 weights: Optional[np.ndarray] = None, bias: Optional[np.ndarray] = None):
+        self.labels = tuple(labels)
+        self.dims = dims
+        self.weights = weights if weights is not None else np.zeros((dims, len(self.labels)), dtype=np.float32)
+        self.bias = bias if bias is not None else np.zeros(len(self.labels), dtype=np.float32)
+
+    def _logits(self, rows: SparseRows) -> np.ndarray:
+        contributions = self.weights[rows.indices] * rows.values[:, None]
+        # Every text has at least its bigram with <s>, so no row is empty
+        return np.add.reduceat(contributions, rows.offsets[:-1], axis=0) + self.bias
+
+    def predict_proba(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, len(self.labels)), dtype=np.float32)
+        logits = self._logits(featurize(texts, self.dims))
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        return probs / probs.sum(axis=1, keepdims=True)
+
+    def fit(self, texts: Sequence[str], targets: Sequence[str], epochs: int = 6, learning_rate: float = 0.5,
+            l2: float = 1e-6, batch_size: int = 64, seed: int = 1) -> "HashedLinearClassifier":
+        """Minibatch SGD on the cross-entropy, with per-feature (AdaGrad) step sizes"""
+        label_index = {label: i for i, label in enumerate(self.labels)}
+        y = np.array([label_index[target] for target in targets], dtype=np.int64)
+        rows = featurize(texts, self.dims)
+        squared = np.full(self.weights.shape, 1e-8, dtype=np.float32)
+        squared_bias = np.full(self.bias.shape, 1e-8, dtype=np.float32)
+        rng = np.random.default_rng(seed)
+
+        for _ in range(epochs):
+            order = rng.permutation(len(y))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                lengths = rows.offsets[batch + 1] - rows.offsets[batch]
+                positions = np.concatenate([np.arange(rows.offsets[i], rows.offsets[i + 1]) for i in batch])
+                sub = SparseRows(rows.indices[positions], rows.values[positions], np.concatenate(([0], np.cumsum(lengths))))
+
+                logits = self._logits(sub)
+                logits -= logits.max(axis=1, keepdims=True)
+                errors = np.exp(logits)
+                errors /= errors.sum(axis=1, keepdims=True)
+                errors[np.arange(len(batch)), y[batch]] -= 1  # d loss / d logits
+                errors /= len(batch)
+
+                gradient = np.repeat(errors, lengths, axis=0) * sub.values[:, None]
+                features, inverse = np.unique(sub.indices, return_inverse=True)
+                feature_gradient = np.zeros((len(features), len(self.labels)), dtype=np.float32)
+                np.add.at(feature_gradient, inverse, gradient)
+                feature_gradient += l2 * self.weights[features]
+
+                squared[features] += feature_gradient ** 2
+                self.weights[features] -= learning_rate * feature_gradient / np.sqrt(squared[features])
+                bias_gradient = errors.sum(axis=0)
+                squared_bias += bias_gradient ** 2
+                self.bias -= learning_rate * bias_gradient / np.sqrt(squared_bias)
+        return self
+
+
+class CascadeModel:
+    """The sentiment and sarcasm classifiers, and which transformer models they were trained to imitate"""
+
+    def __init__(self, sentiment: HashedLinearClassifier, sarcasm: HashedLinearClassifier, meta: Dict):
+        self.sentiment = sentiment
+        self.sarcasm = sarcasm
+        self.meta = meta  # model_revision, trained_at, samples, evaluation
+
+    @property
+    def model_revision(self) -> str:
+        return self.meta["model_revision"]
+
+    @cached_property
+    def fingerprint(self) -> str:
+        digest = hashlib.sha1()
+        for array in (self.sentiment.weights, self.sentiment.bias, self.sarcasm.weights, self.sarcasm.bias):
+            digest.update(array.tobytes())
+        return digest.hexdigest()[:12]
+
+    @classmethod
+    def train(cls, texts: Sequence[str], sentiment_labels: Sequence[str], sarcastic: Sequence[bool],
+              model_revision: str, dims: int = FEATURE_DIMS, epochs: int = 6) -> "CascadeModel":
+        sentiment = HashedLinearClassifier(SENTIMENT_LABELS, dims).fit(texts, sentiment_labels, epochs=epochs)
+        sarcasm = HashedLinearClassifier(SARCASM_LABELS, dims).fit(
+            texts, [SARCASM_LABELS[int(bool(value))] for value in sarcastic], epochs=epochs
+        )
+        return cls(sentiment, sarcasm, {
+            "model_revision": model_revision,
+            "trained_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "samples": len(texts)
+        })
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f,
+                sentiment_weights=self.sentiment.weights,
+                sentiment_bias=self.sentiment.bias,
+                sarcasm_weights=self.sarcasm.weights,
+                sarcasm_bias=self.sarcasm.bias,
+                meta=np.array(json.dumps(self.meta))
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "CascadeModel":
+        with np.load(path) as data:
+            sentiment_weights = data["sentiment_weights"]
+            sarcasm_weights = data["sarcasm_weights"]
+            return cls(
+                HashedLinearClassifier(SENTIMENT_LABELS, sentiment_weights.shape[0], sentiment_weights, data["sentiment_bias"]),
+                HashedLinearClassifier(SARCASM_LABELS, sarcasm_weights.shape[0], sarcasm_weights, data["sarcasm_bias"]),
+                json.loads(str(data["meta"]))
+            )
+
+    def predict(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """(sentiment, sarcasm) class probabilities, one row per text"""
+        return self.sentiment.predict_proba(texts), self.sarcasm.predict_proba(texts)
+
+
+def evaluate(model: CascadeModel, texts: Sequence[str], sentiment_labels: Sequence[str],
+             sarcastic: Sequence[bool], gates: Sequence[Tuple[float, float]]) -> List[Dict]:
+    """For each (sentiment, sarcasm) confidence gate: the share of texts answered and the agreement on those"""
+    sentiment_probs, sarcasm_probs = model.predict(texts)
+    sentiment_agrees = np.array(SENTIMENT_LABELS)[sentiment_probs.argmax(axis=1)] == np.asarray(sentiment_labels)
+    sarcasm_agrees = sarcasm_probs.argmax(axis=1).astype(bool) == np.asarray(sarcastic, dtype=bool)
+    results = []
+    for sentiment_gate, sarcasm_gate in gates:
+        answered = (sentiment_probs.max(axis=1) >= sentiment_gate) & (sarcasm_probs.max(axis=1) >= sarcasm_gate)
+        count = int(answered.sum())
+        results.append({
+            "sentiment_confidence": sentiment_gate,
+            "sarcasm_confidence": sarcasm_gate,
+            "answered": round(count / len(texts), 4) if len(texts) else None,
+            "sentiment_agreement": round(float(sentiment_agrees[answered].mean()), 4) if count else None,
+            "sarcasm_agreement": round(float(sarcasm_agrees[answered].mean()), 4) if count else None,
+        })
+    return results
+
+
+@dataclass
+class CascadeAnswer:
+    sentiment: Dict
+    sarcasm: Dict
+    audit: bool  # Also run the transformer models and compare
+
+
+class Cascade:
+    """Answers the texts the first-pass model is confident about, and keeps score of how that goes"""
+
+    def __init__(self, model: CascadeModel, sentiment_confidence: float, sarcasm_confidence: float,
+                 max_length: int, audit_percent: float):
+        self.model = model
+        self.sentiment_confidence = sentiment_confidence
+        self.sarcasm_confidence = sarcasm_confidence
+        self.max_length = max_length
+        self.audit_percent = audit_percent
+        self._counts = dict.fromkeys((
+            "texts", "answered", "too_long", "unsure_sentiment", "unsure_sarcasm",
+            "audited", "sentiment_agreed", "sarcasm_agreed", "needs_review_agreed"
+        ), 0)
+        self._lock = threading.Lock()
+
+    def answer(self, texts: Sequence[str]) -> List[Optional[CascadeAnswer]]:
+        """An answer per text the gates let through, None for those the transformer models must analyze"""
+        answers: List[Optional[CascadeAnswer]] = [None] * len(texts)
+        counts = dict.fromkeys(("too_long", "unsure_sentiment", "unsure_sarcasm", "answered", "audited"), 0)
+        candidates = [i for i, text in enumerate(texts) if len(text) <= self.max_length]
+        counts["too_long"] = len(texts) - len(candidates)
+
+        if candidates:
+            sentiment_probs, sarcasm_probs = self.model.predict([texts[i] for i in candidates])
+            for i, sentiment, sarcasm in zip(candidates, sentiment_probs, sarcasm_probs):
+                sentiment_top, sarcasm_top = int(sentiment.argmax()), int(sarcasm.argmax())
+                if sentiment[sentiment_top] < self.sentiment_confidence:
+                    counts["unsure_sentiment"] += 1
+                    continue
+                if sarcasm[sarcasm_top] < self.sarcasm_confidence:
+                    counts["unsure_sarcasm"] += 1
+                    continue
+                label = SENTIMENT_LABELS[sentiment_top]
+                audit = random.random() * 100 < self.audit_percent
+                counts["audited" if audit else "answered"] += 1
+                answers[i] = CascadeAnswer(
+                    {
+                        "sentiment_label": label,
+                        "confidence": round(float(sentiment[sentiment_top]), 4),
+                        "is_positive": label == "positive",
+                        "is_negative": label == "negative",
+                        "is_neutral": label == "neutral"
+                    },
+                    {"is_sarcastic": bool(sarcasm_top), "confidence": round(float(sarcasm[sarcasm_top]), 4)},
+                    audit
+                )
+
+        with self._lock:
+            self._counts["texts"] += len(texts)
+            for key, value in counts.items():
+                self._counts[key] += value
+        return answers
+
+    def record_audit(self, cascaded: Dict, analysis: Dict):
+        """Compare an audited answer (as a full analysis) with the transformer models' analysis of the text"""
+        with self._lock:
+            self._counts["sentiment_agreed"] += cascaded["sentiment"]["sentiment_label"] == analysis["sentiment"]["sentiment_label"]
+            self._counts["sarcasm_agreed"] += cascaded["sarcasm"]["is_sarcastic"] == analysis["sarcasm"]["is_sarcastic"]
+            self._counts["needs_review_agreed"] += cascaded["needs_review"] == analysis["needs_review"]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = dict(self._counts)
+        texts, audited = counts["texts"], counts["audited"]
+        return {
+            "model": {**self.model.meta, "fingerprint": self.model.fingerprint},
+            "gates": {
+                "sentiment_confidence": self.sentiment_confidence,
+                "sarcasm_confidence": self.sarcasm_confidence,
+                "max_length": self.max_length,
+                "audit_percent": self.audit_percent
+            },
+            "texts": texts,
+            "answered": counts["answered"],
+            # Share of texts that never reached the transformer models
+            "answered_ratio": round(counts["answered"] / texts, 4) if texts else None,
+            "fell_through": {key: counts[key] for key in ("too_long", "unsure_sentiment", "unsure_sarcasm")},
+            "audited": audited,
+            "agreement": {
+                key: round(counts[f"{key}_agreed"] / audited, 4) if audited else None
+                for key in ("sentiment", "sarcasm", "needs_review")
+            }
+        }
+
+
+def load_cascade(model_revision: str) -> Optional[Cascade]:
+    """The configured cascade, if it was trained on these transformer models"""
+    path = settings.CASCADE_MODEL_PATH
+    if not path:
+        return None
+    try:
+        model = CascadeModel.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"Could not load cascade model {path}: {e}")
+        return None
+    if model.model_revision != model_revision:
+        # It imitates other models, its answers would not be theirs
+        logger.warning(f"Cascade model {path} was trained on {model.model_revision}, not using it for {model_revision}")
+        return None
+    logger.info(f"Cascade model loaded ({model.fingerprint}, {model.meta.get('samples')} samples)")
+    return Cascade(
+        model,
+        settings.CASCADE_SENTIMENT_CONFIDENCE,
+        settings.CASCADE_SARCASM_CONFIDENCE,
+        settings.CASCADE_MAX_LENGTH,
+        settings.CASCADE_AUDIT_PERCENT
+    )
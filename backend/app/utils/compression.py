@@ -0,0 +1,32 @@
+"""
+Response compression, except for streamed responses.
+
+Compressors hold a streamed body back until enough of it has arrived to emit
+a block, so NDJSON lines written as each micro-batch finishes would reach the
+client in bursts, or all at the end. Routes that stream are listed in
+STREAMED_PATHS and sent uncompressed.
+"""
+from typing import List, Optional
+import re
+
+from starlette.middleware.gzip import GZipMiddleware
+
+# Path patterns, in brotli-asgi's excluded_handlers format
+STREAMED_PATHS = [
+    r"^/api/v1/posts/analyze/batch$",  # NDJSON with stream=true
+    r"^/api/v1/admin/export$",
+]
+
+
+class StreamAwareGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that leaves the paths matching excluded_handlers uncompressed, like BrotliMiddleware"""
+
+    def __init__(self, app, minimum_size: int = 500, compresslevel: int = 9, excluded_handlers: Optional[List[str]] = None):
+        super().__init__(app, minimum_size=minimum_size, compresslevel=compresslevel)
+        self.excluded_handlers = [re.compile(path) for path in excluded_handlers or []]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and any(pattern.search(scope["path"]) for pattern in self.excluded_handlers):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
@@ -0,0 +1,124 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterator, Optional
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.models.post import Post
+from app.models.comment import Comment
+from app.models.user import User
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the standard encoder
+    orjson = None
+
+EXPORT_KINDS = ("posts", "comments")
+EXPORT_FORMATS = ("ndjson", "csv")
+
+POST_EXPORT_COLUMNS = (
+    Post.post_id,
+    Post.user_id,
+    User.user_name,
+    Post.title,
+    Post.content,
+    Post.created_at,
+    Post.sentiment_label,
+    Post.sentiment_confidence,
+    Post.is_sarcastic,
+    Post.sarcasm_confidence,
+    Post.analyzed_at,
+    Post.is_flagged,
+)
+
+COMMENT_EXPORT_COLUMNS = (
+    Comment.comment_id,
+    Comment.post_id,
+    Comment.parent_comment_id,
+    Comment.user_id,
+    User.user_name,
+    Comment.content,
+    Comment.created_at,
+    Comment.sentiment_label,
+    Comment.sentiment_confidence,
+    Comment.is_sarcastic,
+    Comment.sarcasm_confidence,
+    Comment.analyzed_at,
+)
+
+
+def export_statement(
+    kind: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    sentiment: Optional[str] = None
+):
+    """SELECT for one export kind with the date range and sentiment filters applied"""
+    if kind == "posts":
+        model, columns, key = Post, POST_EXPORT_COLUMNS, Post.post_id
+        stmt = select(*columns).select_from(Post).join(User, Post.user_id == User.user_id).where(
+            Post.is_deleted == False
+        )
+    elif kind == "comments":
+        model, columns, key = Comment, COMMENT_EXPORT_COLUMNS, Comment.comment_id
+        stmt = select(*columns).select_from(Comment).join(User, Comment.user_id == User.user_id)
+    else:
+        raise ValueError(f"Unknown export kind: {kind}")
+
+    if since:
+        stmt = stmt.where(model.created_at >= since)
+    if until:
+        stmt = stmt.where(model.created_at < until)
+    if sentiment:
+        stmt = stmt.where(model.sentiment_label == sentiment.lower())
+
+    return stmt.order_by(key)
+
+
+def iter_export_rows(db: Session, kind: str, batch_size: int = 1000, **filters) -> Iterator[dict]:
+    """
+    Stream rows through a server-side cursor, holding at most batch_size rows
+    in memory regardless of table size.
+    """
+    stmt = export_statement(kind, **filters).execution_options(yield_per=batch_size)
+    for partition in db.execute(stmt).partitions():
+        for row in partition:
+            yield row._asdict()
+
+
+def _encode_ndjson(row: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(row) + b"\n"
+    return (json.dumps(row, default=lambda value: value.isoformat()) + "\n").encode("utf-8")
+
+
+def iter_export_chunks(rows: Iterator[dict], fmt: str, kind: str, chunk_rows: int = 500) -> Iterator[bytes]:
+    """Encode rows as NDJSON or CSV, yielding one chunk of bytes per chunk_rows rows"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    columns = POST_EXPORT_COLUMNS if kind == "posts" else COMMENT_EXPORT_COLUMNS
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=[column.key for column in columns])
+    chunk = []
+
+    if fmt == "csv":
+        writer.writeheader()
+        chunk.append(buffer.getvalue().encode("utf-8"))
+
+    for row in rows:
+        if fmt == "ndjson":
+            chunk.append(_encode_ndjson(row))
+        else:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow(row)
+            chunk.append(buffer.getvalue().encode("utf-8"))
+
+        if len(chunk) >= chunk_rows:
+            yield b"".join(chunk)
+            chunk = []
+
+    if chunk:
+        yield b"".join(chunk)
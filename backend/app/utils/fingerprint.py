@@ -0,0 +1,223 @@
+"""
+Near-duplicate text fingerprints and the analysis cache built on them.
+
+Social text repeats a lot, but rarely byte for byte: "lol" / "LOL!!", the
+same reply to different @users, spam with one character changed. A lookup
+tries, in order:
+
+1. the exact key - the texts the models would actually see, so a hit is
+   exactly what they would have returned;
+2. for short texts, the normalized text (lowercase, no punctuation, mentions,
+   links and repeated characters collapsed);
+3. for longer texts, MinHash signatures over character shingles of the
+   normalized text, found through LSH bands and accepted when the estimated
+   Jaccard similarity reaches the threshold.
+
+Only the first is exact, and a near-duplicate can mean the opposite ("not
+bad at all" / "bad at all"), so the others are opt-in through a threshold
+below 1. Analyses they return are stamped with NEAR_DUPLICATE_SUFFIX.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+import re
+import string
+import threading
+
+import numpy as np
+
+SHINGLE_SIZE = 4
+NUM_PERMUTATIONS = 128  # Similarity estimates within ~0.03
+LSH_BANDS = 16  # Of NUM_PERMUTATIONS // LSH_BANDS rows; finds pairs down to ~0.7 similarity, the threshold decides
+
+# Appended to the model_revision of analyses reused for a near-duplicate, so they can be found and recomputed
+NEAR_DUPLICATE_SUFFIX = ";near-duplicate"
+
+_MENTION = re.compile(r"(?<!\w)@\w+")
+_URL = re.compile(r"\bhttps?://\S+|\bwww\.\S+")
+_REPEATS = re.compile(r"(.)\1{2,}")
+_PUNCTUATION = str.maketrans("", "", string.punctuation)
+
+
+def normalize_for_matching(text: str) -> str:
+    """
+    The models' preprocessing (mentions and links replaced, punctuation
+    removed, lowercased), plus runs of a character ("sooooo", emoji) cut to two
+    and whitespace collapsed.
+    """
+    text = _URL.sub("http", text)
+    text = _MENTION.sub("@user", text)
+    text = text.lower().translate(_PUNCTUATION)
+    text = _REPEATS.sub(r"\1\1", text)
+    return " ".join(text.split())
+
+
+class MinHasher:
+    """MinHash signatures of character shingles, vectorized with NumPy"""
+
+    def __init__(self, num_permutations: int = NUM_PERMUTATIONS, shingle_size: int = SHINGLE_SIZE, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.shingle_size = shingle_size
+        self.num_permutations = num_permutations
+        # Odd multipliers make each x -> a * x + b a permutation of the 64-bit integers
+        self._a = rng.integers(1, 2 ** 63, num_permutations, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, num_permutations, dtype=np.uint64)
+
+    def shingles(self, text: str) -> np.ndarray:
+        """64-bit hashes of the distinct shingles of text"""
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        count = len(codes) - self.shingle_size + 1
+        hashes = np.zeros(count, dtype=np.uint64)
+        for offset in range(self.shingle_size):
+            # Polynomial rolling hash; uint64 arithmetic wraps around
+            hashes = hashes * np.uint64(1000003) + codes[offset:offset + count]
+        return np.unique(hashes)
+
+    def signature(self, text: str) -> np.ndarray:
+        shingles = self.shingles(text)
+        with np.errstate(over="ignore"):
+            permuted = self._a[:, None] * shingles[None, :] + self._b[:, None]
+        return permuted.min(axis=1)
+
+
+def similarity(signature: np.ndarray, other: np.ndarray) -> float:
+    """Estimated Jaccard similarity of the shingle sets behind two signatures"""
+    return float(np.count_nonzero(signature == other)) / len(signature)
+
+
+@dataclass
+class Fingerprint:
+    """How a text was looked up, so a miss can be stored without hashing it again"""
+    exact_key: Hashable
+    normalized: str
+    signature: Optional[np.ndarray] = None
+    near_duplicate: bool = False  # Answered by another text's entry
+
+
+@dataclass
+class _Entry:
+    value: dict
+    normalized: str
+    signature: Optional[np.ndarray]
+    bands: Tuple[int, ...] = ()
+
+
+class NearDuplicateCache:
+    """LRU cache of analyses that also answers for near-duplicates of the cached texts"""
+
+    def __init__(
+        self,
+        maxsize: int,
+        threshold: float,
+        exact_key: Callable[[str], Hashable] = lambda text: text,
+        hasher: Optional[MinHasher] = None
+    ):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self._exact_key = exact_key
+        self._hasher = hasher or MinHasher()
+        self._rows = self._hasher.num_permutations // LSH_BANDS
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._short: Dict[str, Hashable] = {}  # Normalized short text -> exact key
+        self._buckets: List[Dict[int, set]] = [{} for _ in range(LSH_BANDS)]
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(("lookups", "exact_hits", "near_hits", "misses", "evictions"), 0)
+
+    @property
+    def near_duplicates(self) -> bool:
+        return self.threshold < 1
+
+    def _is_short(self, normalized: str) -> bool:
+        # Too few shingles for a meaningful similarity, match the normalized text itself
+        return len(normalized) < 4 * self._hasher.shingle_size
+
+    def _band_keys(self, signature: np.ndarray) -> Tuple[int, ...]:
+        return tuple(
+            hash(signature[band * self._rows:(band + 1) * self._rows].tobytes())
+            for band in range(LSH_BANDS)
+        )
+
+    def _near_match(self, fingerprint: Fingerprint) -> Optional[_Entry]:
+        if self._is_short(fingerprint.normalized):
+            key = self._short.get(fingerprint.normalized)
+            return self._entries.get(key) if key is not None else None
+
+        best, best_similarity = None, self.threshold
+        candidates = set()
+        for band, key in enumerate(self._band_keys(fingerprint.signature)):
+            candidates.update(self._buckets[band].get(key, ()))
+        for key in candidates:
+            entry = self._entries[key]
+            score = similarity(fingerprint.signature, entry.signature)
+            if score >= best_similarity:
+                best, best_similarity = entry, score
+        return best
+
+    def lookup(self, text: str) -> Tuple[Optional[dict], Fingerprint]:
+        """The cached value for text or a near-duplicate of it, and the text's fingerprint for store()"""
+        fingerprint = Fingerprint(self._exact_key(text), "")
+        with self._lock:
+            self._counts["lookups"] += 1
+            entry = self._entries.get(fingerprint.exact_key)
+            if entry is not None:
+                self._entries.move_to_end(fingerprint.exact_key)
+                self._counts["exact_hits"] += 1
+                return entry.value, fingerprint
+
+        if self.near_duplicates:
+            fingerprint.normalized = normalize_for_matching(text)
+            if not self._is_short(fingerprint.normalized):
+                fingerprint.signature = self._hasher.signature(fingerprint.normalized)
+            with self._lock:
+                entry = self._near_match(fingerprint)
+                if entry is not None:
+                    self._counts["near_hits"] += 1
+                    fingerprint.near_duplicate = True
+                    return entry.value, fingerprint
+
+        with self._lock:
+            self._counts["misses"] += 1
+        return None, fingerprint
+
+    def store(self, fingerprint: Fingerprint, value: dict):
+        if self.maxsize <= 0:
+            return
+        entry = _Entry(value, fingerprint.normalized, fingerprint.signature)
+        with self._lock:
+            if fingerprint.exact_key in self._entries:
+                self._entries.move_to_end(fingerprint.exact_key)
+                return
+            self._entries[fingerprint.exact_key] = entry
+            if self.near_duplicates:
+                if entry.signature is None:
+                    self._short.setdefault(entry.normalized, fingerprint.exact_key)
+                else:
+                    entry.bands = self._band_keys(entry.signature)
+                    for band, key in enumerate(entry.bands):
+                        self._buckets[band].setdefault(key, set()).add(fingerprint.exact_key)
+
+            while len(self._entries) > self.maxsize:
+                key, evicted = self._entries.popitem(last=False)
+                self._counts["evictions"] += 1
+                if self._short.get(evicted.normalized) == key:
+                    del self._short[evicted.normalized]
+                for band, band_key in enumerate(evicted.bands):
+                    bucket = self._buckets[band].get(band_key)
+                    if bucket is not None:
+                        bucket.discard(key)
+                        if not bucket:
+                            del self._buckets[band][band_key]
+
+    def stats(self) -> Dict:
+        """Lookups and how many of them the cache answered instead of the models"""
+        with self._lock:
+            counts = dict(self._counts)
+            size = len(self._entries)
+        hits = counts["exact_hits"] + counts["near_hits"]
+        return {
+            **counts,
+            "size": size,
+            "maxsize": self.maxsize,
+            "threshold": self.threshold,
+            "hit_ratio": round(hits / counts["lookups"], 4) if counts["lookups"] else None
+        }
@@ -0,0 +1,190 @@
+"""
+Inference execution.
+
+Forward passes run on a fixed pool of inference threads, each using a set
+number of intra-op threads (optionally pinned to its own cores), instead of
+on whichever request threads happen to call the models. Without it every
+concurrent forward pass tries to use every core and throughput collapses
+under load; with it the pool's threads x intra-op threads match the cores
+available to this process.
+
+See benchmarks/bench_inference_threads.py to find the best split for a machine.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+import itertools
+import logging
+import os
+import threading
+
+import torch
+
+from app.config import settings
+from app.utils.profiling import timed
+
+logger = logging.getLogger(__name__)
+
+# Server processes sharing this machine's cores and this one's index among them, set by the pre-fork launcher
+_process_count = 1
+_process_index = 0
+_interop_configured = False
+
+
+def set_process_slot(index: int, processes: int):
+    global _process_index, _process_count
+    _process_index, _process_count = index, max(1, processes)
+
+
+def available_cores() -> List[int]:
+    """The CPUs this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def default_intra_op_threads(threads: int, processes: int = 1) -> int:
+    """Split the available cores evenly between every inference thread of every process"""
+    return max(1, len(available_cores()) // (threads * processes))
+
+
+def core_sets(threads: int, intra_op_threads: int, first_thread: int = 0) -> List[List[int]]:
+    """
+    Disjoint groups of intra_op_threads cores, one per inference thread, starting
+    after the groups of first_thread threads (of other processes); wraps around
+    if there are too few cores.
+    """
+    cores = available_cores()
+    return [
+        [cores[(index * intra_op_threads + offset) % len(cores)] for offset in range(intra_op_threads)]
+        for index in range(first_thread, first_thread + threads)
+    ]
+
+
+def configure_interop_threads(threads: int):
+    """Set the inter-op pool size; torch only allows this once, before any inter-op work"""
+    global _interop_configured
+    if _interop_configured:
+        return
+    try:
+        torch.set_num_interop_threads(threads)
+    except RuntimeError as e:
+        logger.warning(f"Could not set inter-op threads: {e}")
+    _interop_configured = True
+
+
+class InferenceExecutor:
+    """A fixed pool of inference threads; run() executes a model call on one of them"""
+
+    def __init__(
+        self,
+        threads: int,
+        intra_op_threads: int,
+        pin_cores: bool = False,
+        interop_threads: int = 1,
+        process_index: int = 0
+    ):
+        self.threads = threads
+        self.intra_op_threads = intra_op_threads
+        self.core_sets = None
+        if pin_cores and hasattr(os, "sched_setaffinity"):
+            self.core_sets = core_sets(threads, intra_op_threads, first_thread=process_index * threads)
+        self.pid = os.getpid()
+        configure_interop_threads(interop_threads)
+
+        self._thread_index = itertools.count()
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(
+            max_workers=threads,
+            thread_name_prefix="inference",
+            initializer=self._init_thread
+        )
+        self._pending = 0
+        self._completed = 0
+        self._stats_lock = threading.Lock()
+
+    def _init_thread(self):
+        self._local.inference_thread = True
+        index = next(self._thread_index)
+        if self.core_sets:
+            # Pins this thread, and the intra-op threads it starts inherit the mask
+            os.sched_setaffinity(0, self.core_sets[index % len(self.core_sets)])
+        # Per calling thread with OpenMP builds, so set it on each inference thread
+        torch.set_num_threads(self.intra_op_threads)
+
+    def _call(self, fn: Callable, args):
+        try:
+            return fn(*args)
+        finally:
+            with self._stats_lock:
+                self._pending -= 1
+                self._completed += 1
+
+    def submit(self, fn: Callable, *args) -> Future:
+        with self._stats_lock:
+            self._pending += 1
+        return self._executor.submit(self._call, fn, args)
+
+    def run(self, fn: Callable, *args):
+        """Run fn(*args) on an inference thread and wait for its result"""
+        if getattr(self._local, "inference_thread", False):
+            return fn(*args)  # Already on one, queueing behind ourselves would deadlock
+        return self.submit(fn, *args).result()
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            pending, completed = self._pending, self._completed
+        return {
+            "threads": self.threads,
+            "intra_op_threads": self.intra_op_threads,
+            "core_sets": self.core_sets,
+            "pending": pending,
+            "completed": completed
+        }
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+_executor: Optional[InferenceExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_inference_executor() -> InferenceExecutor:
+    """The process-wide executor, created on first use (so after forking) from settings"""
+    global _executor
+    with _executor_lock:
+        # Threads do not survive a fork, a child needs its own pool
+        if _executor is None or _executor.pid != os.getpid():
+            threads = max(1, settings.INFERENCE_THREADS)
+            intra_op_threads = settings.INFERENCE_INTRA_OP_THREADS or default_intra_op_threads(threads, _process_count)
+            _executor = InferenceExecutor(
+                threads,
+                intra_op_threads,
+                pin_cores=settings.INFERENCE_PIN_CORES,
+                interop_threads=settings.INFERENCE_INTEROP_THREADS,
+                process_index=_process_index
+            )
+            logger.info(
+                f"Inference executor: {threads} threads x {intra_op_threads} intra-op threads"
+                + (f", pinned to {_executor.core_sets}" if _executor.core_sets else "")
+            )
+        return _executor
+
+
+def run_inference(fn: Callable, *args):
+    with timed("inference"):
+        return get_inference_executor().run(fn, *args)
+
+
+def inference_stats() -> Optional[Dict]:
+    """Stats of this process's executor, None before the first inference"""
+    executor = _executor
+    return executor.stats() if executor is not None and executor.pid == os.getpid() else None
+
+
+def shutdown_inference_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None and _executor.pid == os.getpid():
+            _executor.shutdown(wait=False)
+        _executor = None
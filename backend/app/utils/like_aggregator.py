@@ -0,0 +1,372 @@
+from sqlalchemy import exists, func, select, literal, tuple_
+from sqlalchemy.orm import Session, sessionmaker
+from app.models.post import Post
+from app.models.like import Like
+from app.config import settings
+from app.database import SessionLocal
+from app.utils.upsert import insert_from_select_ignore_duplicates, insert_ignore_duplicates
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows - segments are not protected against concurrent recovery
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Rows per INSERT / DELETE statement when flushing a batch
+FLUSH_CHUNK_SIZE = 1000
+
+
+def refresh_post_like_counts(db: Session, post_ids: Iterable[int]):
+    """Recount posts.like_count from likes for the given posts - for batched flushes and backfills"""
+    post_ids = list(post_ids)
+    if not post_ids:
+        return
+    db.query(Post).filter(Post.post_id.in_(post_ids)).update(
+        {
+            Post.like_count: select(func.count(Like.like_id))
+            .where(Like.post_id == Post.post_id)
+            .correlate(Post)
+            .scalar_subquery()
+        },
+        synchronize_session=False
+    )
+
+
+def apply_post_like(db: Session, user_id: int, post_id: int, liked: bool):
+    """
+    Like or unlike a post right away and move its counter by the rows the
+    statement changed (the caller commits). Repeated or concurrent taps are
+    absorbed by the unique constraint, without locking the post first.
+    """
+    if liked:
+        # Inserts only if the post exists and the like doesn't
+        changed = insert_from_select_ignore_duplicates(
+            db,
+            Like.__table__,
+            ["user_id", "post_id"],
+            select(literal(user_id), Post.post_id).where(
+                Post.post_id == post_id,
+                Post.is_deleted == False
+            )
+        )
+    else:
+        changed = -db.query(Like).filter(
+            Like.user_id == user_id,
+            Like.post_id == post_id
+        ).delete(synchronize_session=False)
+
+    if changed is None:
+        # The driver can't tell an insert from a skipped duplicate
+        refresh_post_like_counts(db, [post_id])
+    elif changed:
+        db.query(Post).filter(Post.post_id == post_id).update(
+            {Post.like_count: Post.like_count + changed},
+            synchronize_session=False
+        )
+
+
+def _chunks(items: list, size: int = FLUSH_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def write_post_likes(db: Session, intents: Dict[Tuple[int, int], bool]):
+    """Apply the final liked state of each (post_id, user_id) and recount the touched posts"""
+    now = datetime.utcnow()
+    likes = [
+        {"user_id": user_id, "post_id": post_id, "created_at": now}
+        for (post_id, user_id), liked in intents.items() if liked
+    ]
+    unlikes = [(user_id, post_id) for (post_id, user_id), liked in intents.items() if not liked]
+
+    for chunk in _chunks(likes):
+        insert_ignore_duplicates(db, Like.__table__, chunk)
+    for chunk in _chunks(unlikes):
+        db.query(Like).filter(tuple_(Like.user_id, Like.post_id).in_(chunk)).delete(synchronize_session=False)
+    refresh_post_like_counts(db, {post_id for post_id, _ in intents})
+
+
+class LikeAggregator:
+    """
+    Write-behind buffer for post likes.
+
+    Intents are merged per (post, user) in memory and answered with the
+    projected state straight away; a background thread writes each merged
+    batch in one transaction every flush interval. With a log directory,
+    every intent is also appended to a per-process segment file first, and
+    segments left behind by a dead process are replayed by recover().
+    """
+
+    def __init__(
+        self,
+        session_factory: sessionmaker,
+        flush_interval_ms: int = 200,
+        log_dir: Optional[str] = None,
+        fsync: bool = False
+    ):
+        self._session_factory = session_factory
+        self._interval = flush_interval_ms / 1000
+        self._log_dir = log_dir
+        self._fsync = fsync
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # (post_id, user_id) -> [liked before the intent, liked now]
+        self._pending: Dict[Tuple[int, int], List[bool]] = {}
+        self._inflight: Dict[Tuple[int, int], List[bool]] = {}
+        # post_id -> likes added by pending and in-flight intents, on top of posts.like_count
+        self._deltas: Dict[int, int] = {}
+        # Set from before a batch commits until its deltas are folded, then the generation is
+        # bumped - a read that may have seen the batch and the deltas both is retried
+        self._committing = False
+        self._generation = 0
+        self._flushed = threading.Condition(self._lock)
+
+        self._segment = None
+        self._segment_seq = 0
+        self._unflushed_segments: List[str] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # Log segments
+
+    def _open_segment(self):
+        if not self._log_dir:
+            return
+        os.makedirs(self._log_dir, exist_ok=True)
+        self._segment_seq += 1
+        path = os.path.join(self._log_dir, f"likes-{os.getpid()}-{self._segment_seq}.log")
+        self._segment = open(path, "a", encoding="utf-8")
+        if fcntl:
+            # Held for as long as this process owns the segment, recover() skips locked ones
+            fcntl.flock(self._segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _rotate_segment(self) -> Optional[str]:
+        """Close the current segment and start a new one, returning the closed path"""
+        if self._segment is None:
+            return None
+        path = self._segment.name
+        self._segment.close()
+        self._open_segment()
+        return path
+
+    def _append(self, post_id: int, user_id: int, liked: bool):
+        if self._segment is None:
+            return
+        self._segment.write(json.dumps([time.time(), post_id, user_id, liked]) + "\n")
+        self._segment.flush()
+        if self._fsync:
+            os.fsync(self._segment.fileno())
+
+    def recover(self) -> int:
+        """Replay segments orphaned by a crashed process, returns the number of intents applied"""
+        if not self._log_dir or not os.path.isdir(self._log_dir):
+            return 0
+
+        records, claimed = [], []
+        try:
+            for path in sorted(glob.glob(os.path.join(self._log_dir, "likes-*.log"))):
+                handle = open(path, "r", encoding="utf-8")
+                if fcntl:
+                    try:
+                        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        handle.close()  # Still owned by a live process
+                        continue
+                claimed.append(handle)
+                for line in handle:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        pass  # Torn final write
+
+            # Only the last intent per (post, user) matters
+            intents = {}
+            for _, post_id, user_id, liked in sorted(records, key=lambda record: record[0]):
+                intents[(post_id, user_id)] = liked
+
+            if intents:
+                db = self._session_factory()
+                try:
+                    write_post_likes(db, intents)
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                    raise
+                finally:
+                    db.close()
+
+            for handle in claimed:
+                os.remove(handle.name)
+            if intents:
+                logger.info(f"Recovered {len(intents)} like intents from {len(claimed)} log segment(s)")
+            return len(intents)
+        finally:
+            for handle in claimed:
+                handle.close()
+
+    # Intents
+
+    def _read_state(self, db: Session, user_id: int, post_id: int):
+        """The committed like count and liked flag, consistent with the in-memory buffers"""
+        while True:
+            generation = self._generation
+            row = db.query(
+                Post.like_count,
+                exists().where(Like.post_id == Post.post_id, Like.user_id == user_id).correlate(Post).label("liked")
+            ).filter(Post.post_id == post_id, Post.is_deleted == False).first()
+            db.rollback()  # Don't keep a snapshot open, the next read must see later flushes
+            self._lock.acquire()
+            if generation == self._generation and not self._committing:
+                return row  # Returns holding the lock
+            while self._committing:
+                self._flushed.wait()
+            self._lock.release()
+
+    def _project(self, row, key: Tuple[int, int]) -> dict:
+        entry = self._pending.get(key) or self._inflight.get(key)
+        return {
+            "total_likes": row.like_count + self._deltas.get(key[0], 0),
+            "user_has_liked": entry[1] if entry else bool(row.liked)
+        }
+
+    def submit(self, db: Session, user_id: int, post_id: int, liked: bool) -> Optional[dict]:
+        """Buffer a like/unlike and return the projected state, or None if the post doesn't exist"""
+        row = self._read_state(db, user_id, post_id)
+        try:
+            if row is None:
+                return None
+
+            key = (post_id, user_id)
+            entry = self._pending.get(key)
+            if entry is None:
+                inflight = self._inflight.get(key)
+                before = inflight[1] if inflight else bool(row.liked)
+                entry = self._pending[key] = [before, before]
+
+            self._deltas[post_id] = self._deltas.get(post_id, 0) + int(liked) - int(entry[1])
+            entry[1] = liked
+            self._append(post_id, user_id, liked)
+            return self._project(row, key)
+        finally:
+            self._lock.release()
+
+    def state(self, db: Session, user_id: int, post_id: int) -> Optional[dict]:
+        """The projected like state including buffered intents, or None if the post doesn't exist"""
+        row = self._read_state(db, user_id, post_id)
+        try:
+            return None if row is None else self._project(row, (post_id, user_id))
+        finally:
+            self._lock.release()
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending) + len(self._inflight)
+
+    # Flushing
+
+    def _finish_commit(self):
+        """Called under _lock once the in-flight deltas are folded or put back"""
+        self._committing = False
+        self._generation += 1
+        self._flushed.notify_all()
+
+    def flush(self) -> int:
+        """Write the buffered intents in one transaction, returns the number written"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._inflight, self._pending = self._pending, {}
+                segment = self._rotate_segment()
+                if segment:
+                    self._unflushed_segments.append(segment)
+                batch = {key: entry[1] for key, entry in self._inflight.items()}
+                self._committing = True
+
+            db = self._session_factory()
+            try:
+                write_post_likes(db, batch)
+                db.commit()
+            except Exception:
+                db.rollback()
+                with self._lock:
+                    # Put the batch back under any newer intents; their deltas already add up
+                    for key, entry in self._inflight.items():
+                        newer = self._pending.get(key)
+                        if newer is None:
+                            self._pending[key] = entry
+                        else:
+                            newer[0] = entry[0]
+                    self._inflight = {}
+                    self._finish_commit()
+                raise
+            finally:
+                db.close()
+
+            with self._lock:
+                for (post_id, _), (before, liked) in self._inflight.items():
+                    delta = self._deltas.get(post_id, 0) - (int(liked) - int(before))
+                    if delta:
+                        self._deltas[post_id] = delta
+                    else:
+                        self._deltas.pop(post_id, None)
+                self._inflight = {}
+                self._finish_commit()
+                segments, self._unflushed_segments = self._unflushed_segments, []
+
+            for path in segments:
+                os.remove(path)
+            return len(batch)
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush likes, retrying next interval: {e}")
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            self._open_segment()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="like-aggregator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flush thread and write whatever is still buffered"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Failed to flush likes on shutdown, the log will be replayed on restart: {e}")
+        with self._lock:
+            if self._segment is not None:
+                path = self._segment.name
+                self._segment.close()
+                self._segment = None
+                if not self._pending:
+                    os.remove(path)
+
+
+like_aggregator = LikeAggregator(
+    SessionLocal,
+    flush_interval_ms=settings.LIKE_FLUSH_INTERVAL_MS,
+    log_dir=settings.LIKE_LOG_DIR,
+    fsync=settings.LIKE_LOG_FSYNC
+) if settings.LIKE_WRITE_BEHIND_ENABLED else None
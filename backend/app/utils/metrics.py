@@ -0,0 +1,59 @@
+import bisect
+import threading
+from typing import Dict, List, Sequence
+
+# Upper bounds in seconds, roughly log-spaced from 5 ms to 10 s
+DEFAULT_LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0
+)
+
+
+class LatencyHistogram:
+    """Thread-safe fixed-bucket latency histogram with approximate percentiles"""
+
+    def __init__(self, name: str, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # Last bucket is +Inf
+        self._count = 0
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += seconds
+
+    def _percentile(self, counts: List[int], total: int, fraction: float) -> float:
+        """Upper bound of the bucket holding the given fraction of observations"""
+        target = fraction * total
+        running = 0
+        for index, count in enumerate(counts):
+            running += count
+            if running >= target:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            total_sum = self._sum
+
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        snapshot = {
+            "count": total,
+            "sum_seconds": round(total_sum, 6),
+            "buckets": dict(zip(bounds, counts)),
+        }
+        if total:
+            snapshot["mean_seconds"] = round(total_sum / total, 6)
+            for label, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+                snapshot[f"{label}_seconds"] = self._percentile(counts, total, fraction)
+        return snapshot
+
+
+# Shared metrics
+login_latency = LatencyHistogram("login")
@@ -0,0 +1,225 @@
+from datetime import datetime, timedelta
+from typing import List, Optional
+import numpy as np
+from sqlalchemy import desc
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.models.post import Post
+from app.models.comment import Comment
+from app.utils.rules import RuleSet
+from app.utils.upsert import insert_ignore_duplicates
+from app.models.moderation import (
+    ModerationItem,
+    MODERATION_PENDING,
+    MODERATION_CLAIMED,
+    MODERATION_RESOLVED,
+    MODERATION_OPEN_STATUSES,
+    MODERATION_REASON_AI
+)
+
+# User reports are reviewed before anything the models found
+FLAGGED_PRIORITY = 200
+
+
+def analysis_priority(analysis: dict) -> int:
+    """Queue priority of content the models flagged: their confidence, as a percentage"""
+    return round(max(analysis["sentiment"]["confidence"], analysis["sarcasm"]["confidence"]) * 100)
+
+
+def enqueue_moderation(db: Session, content_type: str, content_id: int, post_id: int, reason: str, priority: int):
+    """Queue content for review, reopening or raising its existing item (the caller commits)"""
+    item = db.query(ModerationItem).filter(
+        ModerationItem.content_type == content_type,
+        ModerationItem.content_id == content_id
+    ).first()
+
+    if item is None:
+        try:
+            with db.begin_nested():
+                db.add(ModerationItem(
+                    content_type=content_type,
+                    content_id=content_id,
+                    post_id=post_id,
+                    reason=reason,
+                    priority=priority
+                ))
+            return
+        except IntegrityError:
+            # Queued concurrently, update that item instead
+            item = db.query(ModerationItem).filter(
+                ModerationItem.content_type == content_type,
+                ModerationItem.content_id == content_id
+            ).one()
+
+    if item.status == MODERATION_RESOLVED:
+        item.status = MODERATION_PENDING
+        item.reason = reason
+        item.priority = priority
+        item.created_at = datetime.utcnow()
+        item.claimed_by = item.claimed_at = None
+        item.resolved_by = item.resolved_at = item.resolution = None
+    elif priority > item.priority:
+        item.reason = reason
+        item.priority = priority
+
+
+def sync_analysis_moderation(db: Session, content_type: str, content_id: int, post_id: int, analysis: dict):
+    """Queue content whose fresh analysis needs review, or drop it if it only was queued by an older analysis"""
+    if analysis["needs_review"]:
+        enqueue_moderation(db, content_type, content_id, post_id, MODERATION_REASON_AI, analysis_priority(analysis))
+    else:
+        db.query(ModerationItem).filter(
+            ModerationItem.content_type == content_type,
+            ModerationItem.content_id == content_id,
+            ModerationItem.status == MODERATION_PENDING,
+            ModerationItem.reason == MODERATION_REASON_AI
+        ).delete(synchronize_session=False)
+
+
+def resolve_moderation(db: Session, content_type: str, content_id: int, resolved_by: int, resolution: str):
+    """Close the open item of a post or comment, e.g. when it is deleted or unflagged (the caller commits)"""
+    db.query(ModerationItem).filter(
+        ModerationItem.content_type == content_type,
+        ModerationItem.content_id == content_id,
+        ModerationItem.status.in_(MODERATION_OPEN_STATUSES)
+    ).update({
+        ModerationItem.status: MODERATION_RESOLVED,
+        ModerationItem.resolved_by: resolved_by,
+        ModerationItem.resolved_at: datetime.utcnow(),
+        ModerationItem.resolution: resolution
+    }, synchronize_session=False)
+
+
+def release_stale_claims(db: Session, timeout_minutes: int):
+    """Put items claimed longer ago than the timeout back in the pending queue"""
+    db.query(ModerationItem).filter(
+        ModerationItem.status == MODERATION_CLAIMED,
+        ModerationItem.claimed_at < datetime.utcnow() - timedelta(minutes=timeout_minutes)
+    ).update({
+        ModerationItem.status: MODERATION_PENDING,
+        ModerationItem.claimed_by: None,
+        ModerationItem.claimed_at: None
+    }, synchronize_session=False)
+
+
+def claim_moderation_items(
+    db: Session,
+    moderator_id: int,
+    limit: int,
+    timeout_minutes: int,
+    content_type: Optional[str] = None
+) -> List[int]:
+    """Claim the highest-priority pending items for a moderator and return their ids"""
+    release_stale_claims(db, timeout_minutes)
+
+    query = db.query(ModerationItem.item_id).filter(ModerationItem.status == MODERATION_PENDING)
+    if content_type:
+        query = query.filter(ModerationItem.content_type == content_type)
+    # Concurrent moderators skip each other's rows instead of waiting on them (ignored by SQLite)
+    item_ids = [item_id for (item_id,) in query.order_by(
+        desc(ModerationItem.priority),
+        desc(ModerationItem.item_id)
+    ).limit(limit).with_for_update(skip_locked=True).all()]
+
+    if item_ids:
+        db.query(ModerationItem).filter(
+            ModerationItem.item_id.in_(item_ids),
+            ModerationItem.status == MODERATION_PENDING
+        ).update({
+            ModerationItem.status: MODERATION_CLAIMED,
+            ModerationItem.claimed_by: moderator_id,
+            ModerationItem.claimed_at: datetime.utcnow()
+        }, synchronize_session=False)
+    db.commit()
+    return item_ids
+
+
+# Rows read per round trip when re-evaluating, and ids per UPDATE / DELETE
+REEVALUATE_CHUNK_SIZE = 50000
+WRITE_CHUNK_SIZE = 1000
+
+
+def _write_chunks(ids):
+    ids = ids.tolist()
+    for start in range(0, len(ids), WRITE_CHUNK_SIZE):
+        yield ids[start:start + WRITE_CHUNK_SIZE]
+
+
+def reevaluate_needs_review(db: Session, ruleset: RuleSet, content_type: str) -> dict:
+    """
+    Re-apply moderation rules to every analyzed post or comment. Rows are read
+    in id order a chunk at a time into NumPy columns and evaluated in one
+    vectorized pass; only rows whose needs_review changes are written, and the
+    queue gains or loses their pending AI items to match.
+    """
+    model, id_column = (Post, Post.post_id) if content_type == "post" else (Comment, Comment.comment_id)
+    scanned = flagged = cleared = 0
+    last_id = 0
+
+    while True:
+        query = db.query(
+            id_column,
+            model.post_id,
+            model.sentiment_label,
+            model.sentiment_confidence,
+            model.is_sarcastic,
+            model.sarcasm_confidence,
+            model.needs_review
+        ).filter(id_column > last_id, model.sentiment_label.isnot(None))
+        if model is Post:
+            query = query.filter(Post.is_deleted == False)
+        rows = query.order_by(id_column).limit(REEVALUATE_CHUNK_SIZE).all()
+        if not rows:
+            break
+
+        ids, post_ids, labels, sentiment_confidences, sarcastic, sarcasm_confidences, stored = zip(*rows)
+        ids = np.array(ids)
+        sentiment_confidences = np.array(sentiment_confidences, dtype=float)
+        sarcasm_confidences = np.array(sarcasm_confidences, dtype=float)
+        needs_review = ruleset.evaluate({
+            "sentiment_label": np.array(labels, dtype=object),
+            "sentiment_confidence": sentiment_confidences,
+            "is_sarcastic": np.array(sarcastic, dtype=bool),
+            "sarcasm_confidence": sarcasm_confidences,
+        })
+        unknown = np.array([value is None for value in stored])
+        was_flagged = np.array(stored, dtype=bool)
+
+        newly_flagged = needs_review & ~was_flagged
+        newly_cleared = ~needs_review & was_flagged
+        for chunk in _write_chunks(ids[newly_flagged]):
+            db.query(model).filter(id_column.in_(chunk)).update({model.needs_review: True}, synchronize_session=False)
+        # Rows analyzed before needs_review was stored get it written either way
+        for chunk in _write_chunks(ids[newly_cleared | (unknown & ~needs_review)]):
+            db.query(model).filter(id_column.in_(chunk)).update({model.needs_review: False}, synchronize_session=False)
+
+        # Resolved items stay resolved: a moderator already looked at that content
+        priorities = np.rint(np.fmax(np.nan_to_num(sentiment_confidences), np.nan_to_num(sarcasm_confidences)) * 100)
+        post_ids = np.array(post_ids)
+        now = datetime.utcnow()
+        queued = [{
+            "content_type": content_type,
+            "content_id": int(content_id),
+            "post_id": int(post_id),
+            "reason": MODERATION_REASON_AI,
+            "priority": int(priority),
+            "status": MODERATION_PENDING,
+            "created_at": now
+        } for content_id, post_id, priority in zip(ids[newly_flagged], post_ids[newly_flagged], priorities[newly_flagged])]
+        for start in range(0, len(queued), WRITE_CHUNK_SIZE):
+            insert_ignore_duplicates(db, ModerationItem.__table__, queued[start:start + WRITE_CHUNK_SIZE])
+        for chunk in _write_chunks(ids[newly_cleared]):
+            db.query(ModerationItem).filter(
+                ModerationItem.content_type == content_type,
+                ModerationItem.content_id.in_(chunk),
+                ModerationItem.status == MODERATION_PENDING,
+                ModerationItem.reason == MODERATION_REASON_AI
+            ).delete(synchronize_session=False)
+
+        db.commit()
+        scanned += len(rows)
+        flagged += int(newly_flagged.sum())
+        cleared += int(newly_cleared.sum())
+        last_id = int(ids[-1])
+
+    return {"scanned": scanned, "flagged": flagged, "cleared": cleared}
@@ -0,0 +1,247 @@
+"""
+Pre-fork production server.
+
+The master process imports the app once - loading both AI models - moves the
+model weights into shared memory and forks the uvicorn workers from itself,
+so every worker maps the same weight pages instead of loading its own copy.
+The master then supervises: it restarts workers that die, forwards
+shutdown signals and periodically logs each worker's memory use. It also
+polls model_versions: workers don't load new versions themselves (each would
+hold a private copy), the master loads them, shares them and replaces the
+workers one at a time so the new ones inherit them.
+
+Linux/macOS only (needs os.fork); /proc-based memory figures are Linux only.
+"""
+from typing import Dict, List, Optional
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+
+from app.config import settings
+from app.utils.inference import set_process_slot
+
+logger = logging.getLogger(__name__)
+
+# How long workers get to finish in-flight requests on shutdown before being killed
+GRACEFUL_SHUTDOWN_SECONDS = 30
+
+
+def process_memory(pid: int) -> Optional[Dict[str, int]]:
+    """
+    Memory of a process in bytes from /proc/<pid>/smaps_rollup: rss, pss (shared
+    pages split between their users), uss (pages only this process has, what
+    it really costs) and shared. None where /proc is unavailable.
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        return None
+
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+    }
+
+
+def log_memory_report(worker_pids: List[int]):
+    """Log master and per-worker memory; the uss of a worker is what adding one more costs"""
+    def mb(value: int) -> str:
+        return f"{value / (1024 * 1024):.0f} MB"
+
+    total_pss = 0
+    for role, pid in [("master", os.getpid())] + [("worker", pid) for pid in worker_pids]:
+        memory = process_memory(pid)
+        if memory is None:
+            continue
+        total_pss += memory["pss"]
+        logger.info(
+            f"{role} {pid}: uss {mb(memory['uss'])}, pss {mb(memory['pss'])}, "
+            f"rss {mb(memory['rss'])}, shared {mb(memory['shared'])}"
+        )
+    if total_pss:
+        logger.info(f"Total memory (pss) across {len(worker_pids)} workers and master: {mb(total_pss)}")
+
+
+def _prepare_for_fork():
+    """Make the master's state safe and cheap to inherit"""
+    from app.database import engine
+    from app.services.ai_service import ai_service
+
+    if settings.MODEL_SHARED_MEMORY:
+        if ai_service.share_memory():
+            logger.info("Model weights moved to shared memory")
+    # Connections opened at import (create_all) must not be shared with the workers
+    engine.dispose()
+    # Keep the workers' garbage collector from writing to (and so copying) every inherited object
+    gc.collect()
+    gc.freeze()
+
+
+def _sync_models() -> bool:
+    """Load new model versions in the master; True when workers must be replaced to share them"""
+    from app.database import SessionLocal
+    from app.services.ai_service import ai_service
+
+    before = ai_service.loaded_models()
+    db = SessionLocal()
+    try:
+        ai_service.sync(db)
+    except Exception as e:
+        logger.error(f"Model registry sync failed: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+    loaded = [models for models in ai_service.loaded_models() if not any(models is old for old in before)]
+    if not loaded:
+        return False
+    # Let the collector free the replaced models, then freeze what the new workers inherit
+    gc.unfreeze()
+    _prepare_for_fork()
+    return True
+
+
+def _run_worker(app, sock: socket.socket, log_level: str, index: int, workers: int):
+    import uvicorn
+    from app.database import engine
+    from app.services.ai_service import ai_service
+
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGCHLD, signal.SIGUSR1):
+        signal.signal(signum, signal.SIG_DFL)
+    engine.dispose(close=False)
+    ai_service.load_in_master()
+    # Workers split the cores between them rather than each sizing its inference threads for all of them
+    set_process_slot(index, workers)
+
+    config = uvicorn.Config(app, log_level=log_level, lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def _spawn_worker(app, sock: socket.socket, log_level: str, index: int, workers: int) -> int:
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            _run_worker(app, sock, log_level, index, workers)
+            status = 0
+        except BaseException:
+            logger.exception("Worker crashed")
+        finally:
+            os._exit(status)
+    logger.info(f"Started worker {pid}")
+    return pid
+
+
+def serve(app_path: str, host: str, port: int, workers: int, log_level: str = "info"):
+    """Load the app once and serve it from `workers` forked uvicorn processes until SIGINT/SIGTERM"""
+    if not hasattr(os, "fork"):
+        raise RuntimeError("The pre-fork server needs os.fork, run uvicorn directly on this platform")
+
+    from uvicorn.importer import import_from_string
+
+    app = import_from_string(app_path)  # Loads the models, once
+    _prepare_for_fork()
+
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    logger.info(f"Listening on {host}:{port} with {workers} workers (master {os.getpid()})")
+
+    stopping = False
+    report_requested = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    def request_report(signum, frame):
+        nonlocal report_requested
+        report_requested = True
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGUSR1, request_report)  # kill -USR1 <master> logs memory now
+
+    # pid -> slot, a restarted worker takes over the slot (and cores) of the one it replaces
+    pids = {_spawn_worker(app, sock, log_level, index, workers): index for index in range(workers)}
+    interval = settings.WORKER_MEMORY_REPORT_SECONDS
+    # First report once the workers have started up and touched their memory
+    next_report = time.monotonic() + min(interval, 30) if interval else None
+    next_model_sync = time.monotonic() + settings.MODEL_REGISTRY_POLL_SECONDS
+    outdated: List[int] = []  # Workers still serving from models forked before the last load
+    replacing: Optional[int] = None  # The one of them currently shutting down
+
+    while not stopping:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid in pids:
+            index = pids.pop(pid)
+            if pid == replacing:
+                replacing = None
+                logger.info(f"Worker {pid} stopped, starting its replacement with the new models")
+            else:
+                logger.warning(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting it")
+            if pid in outdated:
+                outdated.remove(pid)
+            pids[_spawn_worker(app, sock, log_level, index, workers)] = index
+            continue
+
+        if time.monotonic() >= next_model_sync:
+            if _sync_models():
+                logger.info("Loaded new models, replacing the workers one at a time")
+                outdated = sorted(pids)
+            next_model_sync = time.monotonic() + settings.MODEL_REGISTRY_POLL_SECONDS
+        # One at a time, the others keep serving meanwhile
+        if outdated and replacing is None:
+            replacing = outdated.pop(0)
+            try:
+                os.kill(replacing, signal.SIGTERM)
+            except ProcessLookupError:
+                replacing = None
+
+        if report_requested or (next_report and time.monotonic() >= next_report):
+            report_requested = False
+            log_memory_report(sorted(pids))
+            if interval:
+                next_report = time.monotonic() + interval
+        time.sleep(0.5)
+
+    logger.info("Shutting down workers")
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    deadline = time.monotonic() + GRACEFUL_SHUTDOWN_SECONDS
+    while pids and time.monotonic() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            pids.pop(pid, None)
+        else:
+            time.sleep(0.1)
+    for pid in list(pids):
+        logger.warning(f"Worker {pid} did not stop in time, killing it")
+        try:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+    sock.close()
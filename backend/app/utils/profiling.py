@@ -0,0 +1,361 @@
+"""
+Per-request profiling.
+
+ProfilingMiddleware times what each request spends on database statements
+(through SQLAlchemy cursor events), model inference and response
+serialization, and returns the breakdown in a Server-Timing header, which
+browser dev tools show next to the request. Requests slower than
+SLOW_REQUEST_MS are logged with their breakdown and slowest statements;
+statements slower than SLOW_QUERY_MS are logged with their SQL on their own,
+whether or not request profiling is enabled.
+
+Admins can have a request's endpoint profiled by sending "X-Profile: cprofile"
+(or "pyinstrument", when installed); PROFILE_SAMPLE_PERCENT profiles a share
+of all requests. Captures are written to PROFILE_DIR and listed under
+/api/v1/admin/profiles.
+"""
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import cProfile
+import functools
+import itertools
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+from app.config import settings
+from app.utils.query_budget import count_queries, check_query_budget
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+except ImportError:  # pyinstrument is optional, captures fall back to cProfile
+    PyinstrumentProfiler = None
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_MODES = ("cprofile", "pyinstrument")
+MAX_CAPTURES = 200  # Oldest captures in PROFILE_DIR are deleted beyond this
+SLOWEST_STATEMENTS = 5  # Kept per request for the slow request log
+
+_current: ContextVar[Optional["RequestProfile"]] = ContextVar("request_profile", default=None)
+_capture_ids = itertools.count(1)
+
+
+@dataclass
+class RequestProfile:
+    """Where one request's time went, in seconds per category"""
+    method: str
+    path: str
+    started: float
+    capture: Optional[str] = None
+    capture_requested: bool = False
+    capture_name: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    counts: Dict[str, int] = field(default_factory=dict)
+    statements: List[Tuple[float, str]] = field(default_factory=list)  # Slowest first
+    endpoint_finished: Optional[float] = None
+    responded: Optional[float] = None
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, category: str, seconds: float, count: int = 1):
+        with self._lock:
+            self.timings[category] = self.timings.get(category, 0.0) + seconds
+            self.counts[category] = self.counts.get(category, 0) + count
+
+    def add_statement(self, statement: str, seconds: float):
+        with self._lock:
+            self.timings["db"] = self.timings.get("db", 0.0) + seconds
+            self.counts["db"] = self.counts.get("db", 0) + 1
+            if len(self.statements) < SLOWEST_STATEMENTS or seconds > self.statements[-1][0]:
+                self.statements.append((seconds, statement))
+                self.statements.sort(key=lambda item: item[0], reverse=True)
+                del self.statements[SLOWEST_STATEMENTS:]
+
+    def total(self) -> float:
+        return (self.responded or time.perf_counter()) - self.started
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, durations in milliseconds"""
+        parts = []
+        descriptions = {"db": "queries", "inference": "forward passes"}
+        for category in ("db", "inference", "serialize"):
+            if category in self.timings:
+                part = f"{category};dur={self.timings[category] * 1000:.1f}"
+                if category in descriptions:
+                    part += f';desc="{self.counts[category]} {descriptions[category]}"'
+                parts.append(part)
+        parts.append(f"total;dur={self.total() * 1000:.1f}")
+        return ", ".join(parts)
+
+    def summary(self) -> str:
+        ms = {category: seconds * 1000 for category, seconds in self.timings.items()}
+        return (
+            f"{self.method} {self.path} took {self.total() * 1000:.0f} ms: "
+            f"db {ms.get('db', 0):.0f} ms in {self.counts.get('db', 0)} queries, "
+            f"inference {ms.get('inference', 0):.0f} ms, serialize {ms.get('serialize', 0):.0f} ms"
+        )
+
+
+def current_profile() -> Optional[RequestProfile]:
+    return _current.get()
+
+
+@contextmanager
+def timed(category: str):
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(category, time.perf_counter() - start)
+
+
+def install_query_hooks(engine):
+    """Time every statement the engine runs, for request profiles and the slow query log"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("query_started")
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        profile = _current.get()
+        if profile is not None:
+            profile.add_statement(statement, elapsed)
+        if settings.SLOW_QUERY_MS and elapsed * 1000 >= settings.SLOW_QUERY_MS:
+            logger.warning(f"Slow query ({elapsed * 1000:.0f} ms): {statement} {str(parameters)[:200]}")
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+        if started:
+            started.pop()
+
+
+def _capture_path(profile: RequestProfile, mode: str) -> Tuple[str, str]:
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", profile.path).strip("_") or "root"
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_capture_ids)}-{profile.method}-{slug[:60]}"
+    name += ".html" if mode == "pyinstrument" else ".prof"
+    return name, os.path.join(settings.PROFILE_DIR, name)
+
+
+def _prune_captures():
+    captures = list_captures()
+    for capture in captures[MAX_CAPTURES:]:
+        try:
+            os.remove(os.path.join(settings.PROFILE_DIR, capture["name"]))
+        except OSError:
+            pass
+
+
+@contextmanager
+def _captured(profile: RequestProfile, async_endpoint: bool):
+    """Profile the endpoint running on this thread (or, for async endpoints, the event loop)"""
+    mode = profile.capture
+    if mode == "pyinstrument" and PyinstrumentProfiler is None:
+        mode = "cprofile"
+    if mode == "pyinstrument":
+        profiler = PyinstrumentProfiler(async_mode="enabled" if async_endpoint else "disabled")
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        name, path = _capture_path(profile, mode)
+        try:
+            os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+            if mode == "pyinstrument":
+                profiler.stop()
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(profiler.output_html())
+            else:
+                profiler.disable()
+                profiler.dump_stats(path)
+            profile.capture_name = name
+            logger.info(f"Profiled {profile.method} {profile.path} to {path}")
+            _prune_captures()
+        except OSError as e:
+            logger.warning(f"Could not write profile capture {path}: {e}")
+
+
+def _profiled_endpoint(endpoint):
+    """Wrap an endpoint to mark when it returned and run any requested capture around it"""
+    if getattr(endpoint, "_profiled", False):
+        return endpoint  # include_router() copies routes along with their already wrapped endpoints
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def profiled(*args, **kwargs):
+            profile = _current.get()
+            if profile is None:
+                return await endpoint(*args, **kwargs)
+            try:
+                if profile.capture:
+                    with _captured(profile, async_endpoint=True):
+                        return await endpoint(*args, **kwargs)
+                return await endpoint(*args, **kwargs)
+            finally:
+                profile.endpoint_finished = time.perf_counter()
+    else:
+        @functools.wraps(endpoint)
+        def profiled(*args, **kwargs):
+            profile = _current.get()
+            if profile is None:
+                return endpoint(*args, **kwargs)
+            try:
+                if profile.capture:
+                    with _captured(profile, async_endpoint=False):
+                        return endpoint(*args, **kwargs)
+                return endpoint(*args, **kwargs)
+            finally:
+                profile.endpoint_finished = time.perf_counter()
+    profiled._profiled = True
+    return profiled
+
+
+class ProfiledRoute(APIRoute):
+    """
+    APIRoute that, with PROFILING_ENABLED, captures profiles on the thread the
+    endpoint runs on and times response_model validation and encoding as
+    serialization, and with QUERY_BUDGET_MODE counts the request's statements
+    against the endpoint's @query_budget. Routers opt in with
+    APIRouter(route_class=ProfiledRoute).
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if settings.PROFILING_ENABLED:
+            endpoint = _profiled_endpoint(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        counting = settings.QUERY_BUDGET_MODE != "off"
+        if not settings.PROFILING_ENABLED and not counting:
+            return handler
+        budget = getattr(self.endpoint, "query_budget", None)
+        route = f"{','.join(sorted(self.methods))} {self.path}"
+
+        async def profiled_handler(request):
+            with count_queries() if counting else nullcontext() as counter:
+                response = await handler(request)
+            profile = _current.get()
+            if profile is not None and profile.endpoint_finished is not None:
+                profile.add("serialize", time.perf_counter() - profile.endpoint_finished)
+            if counting:
+                response.headers["X-Query-Count"] = str(counter.count)
+                if budget is not None:
+                    response.headers["X-Query-Budget"] = str(budget)
+                check_query_budget(counter, budget, route)
+            return response
+
+        return profiled_handler
+
+
+def _is_admin(authorization: Optional[str]) -> bool:
+    from app.database import SessionLocal
+    from app.models.user import User
+    from app.utils.security import decode_token
+
+    if not authorization or authorization[:7].lower() != "bearer ":
+        return False
+    claims = decode_token(authorization[7:])
+    if claims is None:
+        return False
+    db = SessionLocal()
+    try:
+        if "uid" in claims:
+            user = db.get(User, claims["uid"])
+        else:
+            user = db.query(User).filter(User.user_name == claims["sub"]).first()
+        return bool(user and user.is_admin)
+    finally:
+        db.close()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware recording a RequestProfile per request, see the module docstring"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def _capture_mode(self, scope) -> Tuple[Optional[str], bool]:
+        """The capture to take for this request and whether the caller asked for it"""
+        headers = Headers(scope=scope)
+        requested = headers.get("x-profile")
+        if requested:
+            mode = requested.strip().lower()
+            mode = mode if mode in CAPTURE_MODES else "cprofile"
+            if await run_in_threadpool(_is_admin, headers.get("authorization")):
+                return mode, True
+            logger.info(f"Ignoring X-Profile on {scope['path']} from a non-admin caller")
+        if settings.PROFILE_SAMPLE_PERCENT and random.random() * 100 < settings.PROFILE_SAMPLE_PERCENT:
+            return "cprofile", False
+        return None, False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        # Before the profile is set, so the admin lookup is not counted against the request
+        capture, requested = await self._capture_mode(scope)
+        profile = RequestProfile(scope["method"], scope["path"], started, capture, requested)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                profile.responded = time.perf_counter()
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", profile.server_timing())
+                if profile.capture_requested and profile.capture_name:
+                    headers.append("X-Profile-Capture", profile.capture_name)
+            await send(message)
+
+        token = _current.set(profile)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            if settings.SLOW_REQUEST_MS and profile.total() * 1000 >= settings.SLOW_REQUEST_MS:
+                lines = [f"Slow request: {profile.summary()}"]
+                lines += [f"  {seconds * 1000:.0f} ms: {statement}" for seconds, statement in profile.statements]
+                logger.warning("\n".join(lines))
+
+
+def list_captures() -> List[Dict]:
+    """Captures in PROFILE_DIR, newest first"""
+    if not os.path.isdir(settings.PROFILE_DIR):
+        return []
+    captures = []
+    for entry in os.scandir(settings.PROFILE_DIR):
+        if entry.is_file() and entry.name.endswith((".prof", ".html")):
+            stat = entry.stat()
+            captures.append({"name": entry.name, "size": stat.st_size, "modified": stat.st_mtime})
+    captures.sort(key=lambda capture: capture["modified"], reverse=True)
+    return captures
+
+
+def capture_path(name: str) -> Optional[str]:
+    """Path of a listed capture, None for anything else"""
+    if name not in {capture["name"] for capture in list_captures()}:
+        return None
+    return os.path.join(settings.PROFILE_DIR, name)
@@ -0,0 +1,100 @@
+"""
+Query budgets.
+
+Routes declare the most SQL statements one request may run (dependencies
+included) with @query_budget, right under their @router decorator. A list
+route's budget is a constant: one query per row (an N+1) overruns it as
+soon as a page holds more rows than that.
+
+With QUERY_BUDGET_MODE "log" or "raise", statements are counted through
+SQLAlchemy cursor events, responses carry X-Query-Count (and X-Query-Budget),
+and requests over budget are logged with their most repeated statement, or
+fail with QueryBudgetExceeded. benchmarks/check_query_budgets.py requests
+every budgeted list route at two page sizes and fails when the count grows
+with the page.
+
+count_queries() counts the statements of any block of code, e.g. in a script.
+"""
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+import logging
+
+from sqlalchemy import event
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+QUERY_BUDGET_MODES = ("off", "log", "raise")
+MAX_RECORDED_STATEMENTS = 200
+
+_counter: ContextVar[Optional["QueryCounter"]] = ContextVar("query_counter", default=None)
+
+
+class QueryBudgetExceeded(RuntimeError):
+    """A request ran more statements than its route's budget"""
+
+
+class QueryCounter:
+    """Statements run inside count_queries(), also counted by the enclosing counters"""
+
+    def __init__(self, parent: Optional["QueryCounter"] = None):
+        self.parent = parent
+        self.count = 0
+        self.statements: List[str] = []
+
+    def add(self, statement: str):
+        counter = self
+        while counter is not None:
+            counter.count += 1
+            if len(counter.statements) < MAX_RECORDED_STATEMENTS:
+                counter.statements.append(statement)
+            counter = counter.parent
+
+    def most_repeated(self):
+        """The statement run most often and how often, (None, 0) when nothing ran"""
+        if not self.statements:
+            return None, 0
+        return Counter(self.statements).most_common(1)[0]
+
+
+def install_query_counter(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        counter = _counter.get()
+        if counter is not None:
+            counter.add(statement)
+
+
+@contextmanager
+def count_queries():
+    """Count the statements run in this block, on this thread and the threadpool calls it makes"""
+    counter = QueryCounter(_counter.get())
+    token = _counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _counter.reset(token)
+
+
+def query_budget(max_queries: int):
+    """Declare the most statements a route may run per request"""
+    def decorate(endpoint):
+        endpoint.query_budget = max_queries
+        return endpoint
+    return decorate
+
+
+def check_query_budget(counter: QueryCounter, budget: Optional[int], route: str):
+    """Log or raise (per QUERY_BUDGET_MODE) when the counted statements exceed the budget"""
+    if budget is None or counter.count <= budget:
+        return
+    statement, repeats = counter.most_repeated()
+    message = f"{route} ran {counter.count} queries, its budget is {budget}"
+    if repeats > 1:
+        message += f"; repeated {repeats} times: {' '.join(statement.split())[:300]}"
+    if settings.QUERY_BUDGET_MODE == "raise":
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
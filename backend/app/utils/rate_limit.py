@@ -0,0 +1,240 @@
+"""
+Token-bucket rate limiting.
+
+Every request is charged against the caller's bucket - per user when it
+carries a valid access token, per client IP otherwise. Routes that run the
+AI models are charged against a separate, smaller inference bucket, and
+also against one global inference bucket sized to what the model workers
+can serve, so a single caller can only ever use its share of it. Routes that
+only sometimes run them are charged as reads, and call charge_inference()
+themselves once they know they will.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Pattern, Sequence, Tuple
+import json
+import math
+import re
+import threading
+import time
+
+from anyio.from_thread import run as run_async
+from fastapi import HTTPException, Request
+
+from app.config import settings
+from app.utils.security import decode_token
+
+
+@dataclass(frozen=True)
+class BucketCharge:
+    """Take `cost` tokens from the bucket `key`, which refills `rate` tokens/s up to `burst`"""
+    key: str
+    rate: float
+    burst: float
+    cost: float
+
+
+class MemoryRateLimitBackend:
+    """Buckets in process memory - limits apply per worker process"""
+
+    def __init__(self, max_keys: int = 100000):
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_keys = max_keys
+
+    async def take(self, charges: Sequence[BucketCharge]) -> float:
+        """Charge every bucket or none; returns 0 when allowed, else seconds until it would be"""
+        now = time.monotonic()
+        with self._lock:
+            levels, wait = [], 0.0
+            for charge in charges:
+                tokens, updated = self._buckets.get(charge.key, (charge.burst, now))
+                tokens = min(charge.burst, tokens + (now - updated) * charge.rate)
+                if tokens < charge.cost:
+                    wait = max(wait, (charge.cost - tokens) / charge.rate)
+                levels.append(tokens)
+            if wait:
+                return wait
+
+            for charge, tokens in zip(charges, levels):
+                self._buckets[charge.key] = (tokens - charge.cost, now)
+                self._buckets.move_to_end(charge.key)
+            # The least recently used buckets are the likeliest to have refilled anyway
+            while len(self._buckets) > self._max_keys:
+                self._buckets.popitem(last=False)
+            return 0.0
+
+
+# Checks and charges all buckets atomically, using the Redis clock so app servers needn't agree
+_TAKE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local levels, wait = {}, 0
+for i, key in ipairs(KEYS) do
+    local rate, burst, cost = tonumber(ARGV[i * 3 - 2]), tonumber(ARGV[i * 3 - 1]), tonumber(ARGV[i * 3])
+    local state = redis.call('HMGET', key, 'tokens', 'updated')
+    local tokens = tonumber(state[1]) or burst
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+    if tokens < cost then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+    levels[i] = tokens
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local rate, burst, cost = tonumber(ARGV[i * 3 - 2]), tonumber(ARGV[i * 3 - 1]), tonumber(ARGV[i * 3])
+    redis.call('HSET', key, 'tokens', levels[i] - cost, 'updated', now)
+    redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000) + 1000)
+end
+return '0'
+"""
+
+
+class RedisRateLimitBackend:
+    """Buckets in Redis - limits are shared by every worker and server"""
+
+    def __init__(self, url: str, prefix: str = "ratelimit:"):
+        import redis.asyncio as redis
+        self._redis = redis.from_url(url)
+        self._script = self._redis.register_script(_TAKE_SCRIPT)
+        self._prefix = prefix
+
+    async def take(self, charges: Sequence[BucketCharge]) -> float:
+        keys = [self._prefix + charge.key for charge in charges]
+        args = [value for charge in charges for value in (charge.rate, charge.burst, charge.cost)]
+        return float(await self._script(keys=keys, args=args))
+
+
+# Cost of one text through the models
+INFERENCE_COST = 4
+
+# (method, path pattern, bucket, cost) - first match wins, anything else
+# costs 1 token from the default bucket for reads and 2 for writes
+ROUTE_COSTS: List[Tuple[str, Pattern, str, float]] = [
+    ("POST", re.compile(r"^/api/v1/posts/analyze$"), "inference", INFERENCE_COST),
+    # Up to ANALYZE_MAX_BATCH_SIZE texts, batching makes each one cheaper
+    ("POST", re.compile(r"^/api/v1/posts/analyze/batch$"), "inference", 16),
+    # Creating or editing content queues a background analysis
+    ("POST", re.compile(r"^/api/v1/posts/?$"), "inference", 1),
+    ("PUT", re.compile(r"^/api/v1/posts/\d+$"), "inference", 1),
+    ("POST", re.compile(r"^/api/v1/posts/\d+/comments$"), "inference", 1),
+    ("PUT", re.compile(r"^/api/v1/posts/\d+/comments/\d+$"), "inference", 1),
+    # bcrypt
+    ("POST", re.compile(r"^/api/v1/auth/(login|register)$"), "default", 5),
+]
+
+RATE_LIMITED = "Rate limit exceeded, please retry later"
+
+EXEMPT_PATHS = {"/", "/health", "/docs", "/redoc", "/openapi.json"}
+
+
+def route_cost(method: str, path: str) -> Tuple[str, float]:
+    """The bucket and token cost a request is charged before it reaches its route"""
+    for route_method, pattern, bucket, cost in ROUTE_COSTS:
+        if method == route_method and pattern.match(path):
+            return bucket, cost
+    return "default", 1 if method in ("GET", "HEAD", "OPTIONS") else 2
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def client_identity(scope) -> str:
+    """user:<id> for requests with a valid access token, ip:<address> otherwise"""
+    authorization = _header(scope, b"authorization")
+    if authorization and authorization[:7].lower() == "bearer ":
+        claims = decode_token(authorization[7:])
+        if claims and claims.get("uid") is not None:
+            return f"user:{claims['uid']}"
+
+    if settings.RATE_LIMIT_TRUST_FORWARDED:
+        forwarded = _header(scope, b"x-forwarded-for")
+        if forwarded:
+            return f"ip:{forwarded.split(',')[0].strip()}"
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+
+def request_charges(method: str, path: str, identity: str) -> List[BucketCharge]:
+    bucket, cost = route_cost(method, path)
+    if bucket == "inference":
+        return inference_charges(identity, cost)
+    return [BucketCharge(f"default:{identity}", settings.RATE_LIMIT_RATE, settings.RATE_LIMIT_BURST, min(cost, settings.RATE_LIMIT_BURST))]
+
+
+def inference_charges(identity: str, cost: float) -> List[BucketCharge]:
+    return [
+        BucketCharge(
+            f"inference:{identity}",
+            settings.RATE_LIMIT_INFERENCE_RATE,
+            settings.RATE_LIMIT_INFERENCE_BURST,
+            min(cost, settings.RATE_LIMIT_INFERENCE_BURST)
+        ),
+        BucketCharge(
+            "inference:global",
+            settings.RATE_LIMIT_INFERENCE_GLOBAL_RATE,
+            settings.RATE_LIMIT_INFERENCE_GLOBAL_BURST,
+            min(cost, settings.RATE_LIMIT_INFERENCE_GLOBAL_BURST)
+        ),
+    ]
+
+
+def charge_inference(request: Request, cost: float = INFERENCE_COST):
+    """
+    Charge the caller's inference buckets from a sync route that is about to
+    run the models, raising a 429 when they're empty. Does nothing when rate
+    limiting is off.
+    """
+    limiter = getattr(request.state, "rate_limit", None)
+    if limiter is None:
+        return
+    backend, identity = limiter
+    wait = run_async(backend.take, inference_charges(identity, cost))
+    if wait:
+        raise HTTPException(status_code=429, detail=RATE_LIMITED, headers={"Retry-After": str(math.ceil(wait))})
+
+
+def create_rate_limit_backend():
+    if settings.RATE_LIMIT_BACKEND == "redis":
+        return RedisRateLimitBackend(settings.RATE_LIMIT_REDIS_URL)
+    return MemoryRateLimitBackend(settings.RATE_LIMIT_MAX_KEYS)
+
+
+class RateLimitMiddleware:
+    """ASGI middleware answering 429 with Retry-After once a caller's bucket is empty"""
+
+    def __init__(self, app, backend=None):
+        self.app = app
+        self.backend = backend or create_rate_limit_backend()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        identity = client_identity(scope)
+        wait = await self.backend.take(request_charges(scope["method"], scope["path"], identity))
+        if not wait:
+            # For charge_inference(), through request.state
+            scope.setdefault("state", {})["rate_limit"] = (self.backend, identity)
+            await self.app(scope, receive, send)
+            return
+
+        body = json.dumps({"detail": RATE_LIMITED}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"retry-after", str(math.ceil(wait)).encode("latin-1")),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,176 @@
+"""
+Moderation rules.
+
+A rule is a list of conditions over an analysis, all of which must hold;
+content needs review when any enabled rule matches. The same rules are
+evaluated three ways: on one analysis dict, vectorized over NumPy column
+arrays for bulk re-evaluation, and as a SQL predicate for queries.
+"""
+from typing import Dict, List, Optional, Sequence
+import operator
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import and_, false, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.moderation_rule import ModerationRule
+
+# Analysis fields rules can test, and the type of value they compare against
+RULE_FIELDS = {
+    "sentiment_label": str,
+    "sentiment_confidence": float,
+    "is_sarcastic": bool,
+    "sarcasm_confidence": float,
+}
+
+RULE_OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+
+# The policy before rules were configurable, seeded into an empty rules table
+DEFAULT_RULES = [
+    {
+        "name": "highly negative",
+        "conditions": [
+            {"field": "sentiment_label", "op": "==", "value": "negative"},
+            {"field": "sentiment_confidence", "op": ">", "value": 0.8},
+        ],
+    },
+    {
+        "name": "negative and sarcastic",
+        "conditions": [
+            {"field": "sentiment_label", "op": "==", "value": "negative"},
+            {"field": "is_sarcastic", "op": "==", "value": True},
+            {"field": "sarcasm_confidence", "op": ">", "value": 0.6},
+        ],
+    },
+]
+
+
+def validate_conditions(conditions: Sequence[dict]) -> List[dict]:
+    """Check fields, operators and value types, raising ValueError; returns normalized conditions"""
+    if not conditions:
+        raise ValueError("A rule needs at least one condition")
+
+    normalized = []
+    for condition in conditions:
+        field, op, value = condition.get("field"), condition.get("op"), condition.get("value")
+        if field not in RULE_FIELDS:
+            raise ValueError(f"Unknown field {field!r}, expected one of: {', '.join(RULE_FIELDS)}")
+        if op not in RULE_OPERATORS:
+            raise ValueError(f"Unknown operator {op!r}, expected one of: {', '.join(RULE_OPERATORS)}")
+
+        kind = RULE_FIELDS[field]
+        if kind is float:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"{field} must be compared with a number")
+            value = float(value)
+        elif not isinstance(value, kind):
+            raise ValueError(f"{field} must be compared with a {kind.__name__}")
+        if kind is not float and op not in ("==", "!="):
+            raise ValueError(f"{field} only supports == and !=")
+        normalized.append({"field": field, "op": op, "value": value})
+    return normalized
+
+
+def analysis_fields(analysis: dict) -> dict:
+    """Flatten an analyze_text_complete() result to the fields rules test"""
+    return {
+        "sentiment_label": analysis["sentiment"]["sentiment_label"],
+        "sentiment_confidence": analysis["sentiment"]["confidence"],
+        "is_sarcastic": analysis["sarcasm"]["is_sarcastic"],
+        "sarcasm_confidence": analysis["sarcasm"]["confidence"],
+    }
+
+
+class RuleSet:
+    """The enabled rules, compiled for each way they are evaluated"""
+
+    def __init__(self, rules: Sequence[Sequence[dict]]):
+        self.rules = [validate_conditions(conditions) for conditions in rules]
+
+    def matches(self, analysis: dict) -> bool:
+        """Whether one analyze_text_complete() result needs review"""
+        fields = analysis_fields(analysis)
+        return any(
+            all(
+                fields[c["field"]] is not None and RULE_OPERATORS[c["op"]](fields[c["field"]], c["value"])
+                for c in conditions
+            )
+            for conditions in self.rules
+        )
+
+    def evaluate(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Vectorized matches() over whole columns: sentiment_label as an object
+        array, confidences as floats with NaN for missing, is_sarcastic as bools.
+        """
+        size = len(next(iter(columns.values())))
+        # Missing values never match, like NULL in SQL
+        present = {
+            field: ~np.isnan(column) if column.dtype.kind == "f" else column != None  # noqa: E711
+            for field, column in columns.items()
+        }
+        result = np.zeros(size, dtype=bool)
+        for conditions in self.rules:
+            matched = np.ones(size, dtype=bool)
+            for c in conditions:
+                matched &= RULE_OPERATORS[c["op"]](columns[c["field"]], c["value"]) & present[c["field"]]
+            result |= matched
+        return result
+
+    def sql_predicate(self, model):
+        """matches() as a SQL expression over a Post or Comment's analysis columns"""
+        if not self.rules:
+            return false()
+        return or_(*(
+            and_(*(RULE_OPERATORS[c["op"]](getattr(model, c["field"]), c["value"]) for c in conditions))
+            for conditions in self.rules
+        ))
+
+
+DEFAULT_RULESET = RuleSet([rule["conditions"] for rule in DEFAULT_RULES])
+
+_cached_ruleset: Optional[RuleSet] = None
+_cached_at = 0.0
+_cache_lock = threading.Lock()
+
+
+def seed_default_rules(db: Session):
+    """Store DEFAULT_RULES if no rules exist yet"""
+    if db.query(ModerationRule.rule_id).first() is None:
+        for rule in DEFAULT_RULES:
+            db.add(ModerationRule(name=rule["name"], conditions=rule["conditions"], enabled=True))
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()  # Another worker seeded them first
+
+
+def get_active_ruleset(db: Session) -> RuleSet:
+    """The enabled rules from the database, cached for MODERATION_RULES_CACHE_SECONDS"""
+    global _cached_ruleset, _cached_at
+    with _cache_lock:
+        if _cached_ruleset is not None and time.monotonic() - _cached_at < settings.MODERATION_RULES_CACHE_SECONDS:
+            return _cached_ruleset
+
+    rules = db.query(ModerationRule.conditions).filter(ModerationRule.enabled == True).order_by(ModerationRule.rule_id).all()
+    ruleset = RuleSet([conditions for (conditions,) in rules])
+    with _cache_lock:
+        _cached_ruleset, _cached_at = ruleset, time.monotonic()
+    return ruleset
+
+
+def invalidate_ruleset_cache():
+    global _cached_ruleset
+    with _cache_lock:
+        _cached_ruleset = None
@@ -1,10 +1,32 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
 from app.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
+
+# Dedicated process pool for bcrypt, so hashing never holds request threads or the GIL
+_hash_executor: Optional[ProcessPoolExecutor] = None
+_hash_executor_lock = threading.Lock()
+_hash_pending = 0
+_hash_pending_lock = threading.Lock()
+
+
+# Recently verified tokens -> decoded claims, so repeat requests skip jwt.decode
+_claims_cache: "OrderedDict[str, dict]" = OrderedDict()
+_claims_cache_lock = threading.Lock()
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many password hashing jobs are already queued"""
 
 def verify_password(plain_password, hashed_password):
     """Verify a password against a hash"""
@@ -18,6 +40,79 @@ def get_password_hash(password):
     password_bytes = password.encode('utf-8')[:72]
     return pwd_context.hash(password_bytes)
 
+def password_needs_rehash(hashed_password: str) -> bool:
+    """True when a stored hash was made with a different work factor than BCRYPT_ROUNDS"""
+    if pwd_context.needs_update(hashed_password):
+        return True
+    try:
+        # bcrypt hashes look like $2b$12$<salt+checksum>
+        return int(hashed_password.split("$")[2]) != settings.BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+def _verify_and_rehash(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password and, if the hash is outdated, return a fresh one (runs in the hashing pool)"""
+    if not verify_password(plain_password, hashed_password):
+        return False, None
+    if password_needs_rehash(hashed_password):
+        return True, get_password_hash(plain_password)
+    return True, None
+
+def _get_hash_executor() -> ProcessPoolExecutor:
+    global _hash_executor
+    with _hash_executor_lock:
+        if _hash_executor is None:
+            # Not forked: the first login happens in a worker already running request, inference and
+            # flusher threads, whose held locks a forked child would inherit, along with the models.
+            # Hashing needs only passlib and the config, so a clean child is cheap
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _hash_executor = ProcessPoolExecutor(
+                max_workers=settings.PASSWORD_HASH_WORKERS,
+                mp_context=multiprocessing.get_context(method)
+            )
+        return _hash_executor
+
+async def _run_in_hash_pool(func, *args):
+    """Run a hashing job in the process pool, rejecting it if the queue is full"""
+    global _hash_pending
+    with _hash_pending_lock:
+        if _hash_pending >= settings.PASSWORD_HASH_MAX_PENDING:
+            raise PasswordHasherBusy()
+        _hash_pending += 1
+
+    try:
+        if settings.PASSWORD_HASH_WORKERS <= 0:
+            # Pool disabled, hash on the request threadpool as before
+            return await run_in_threadpool(func, *args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_hash_executor(), func, *args)
+    finally:
+        with _hash_pending_lock:
+            _hash_pending -= 1
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify in the hashing pool; returns (valid, new_hash) where new_hash is set when a rehash is due"""
+    return await _run_in_hash_pool(_verify_and_rehash, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """Hash a password in the hashing pool"""
+    return await _run_in_hash_pool(get_password_hash, password)
+
+def password_hasher_stats() -> dict:
+    return {
+        "workers": settings.PASSWORD_HASH_WORKERS,
+        "pending": _hash_pending,
+        "max_pending": settings.PASSWORD_HASH_MAX_PENDING,
+        "bcrypt_rounds": settings.BCRYPT_ROUNDS,
+    }
+
+def shutdown_password_hasher():
+    global _hash_executor
+    with _hash_executor_lock:
+        if _hash_executor is not None:
+            _hash_executor.shutdown(wait=False, cancel_futures=True)
+            _hash_executor = None
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create a JWT access token"""
     to_encode = data.copy()
@@ -29,13 +124,34 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-def verify_token(token: str):
-    """Verify and decode a JWT token"""
+def decode_token(token: str) -> Optional[dict]:
+    """Verify a JWT and return its claims, served from a bounded LRU until the token expires"""
+    now = time.time()
+    with _claims_cache_lock:
+        claims = _claims_cache.get(token)
+        if claims is not None:
+            if claims["exp"] > now:
+                _claims_cache.move_to_end(token)
+                return claims
+            del _claims_cache[token]
+
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            return None
-        return username
     except JWTError:
         return None
+    if payload.get("sub") is None:
+        return None
+
+    if settings.TOKEN_CACHE_SIZE > 0 and "exp" in payload:
+        with _claims_cache_lock:
+            _claims_cache[token] = payload
+            while len(_claims_cache) > settings.TOKEN_CACHE_SIZE:
+                _claims_cache.popitem(last=False)
+    return payload
+
+def verify_token(token: str):
+    """Verify and decode a JWT token"""
+    claims = decode_token(token)
+    if claims is None:
+        return None
+    return claims["sub"]
@@ -0,0 +1,80 @@
+from typing import List, Optional, Sequence
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import func
+from app.config import settings
+from app.utils.profiling import timed
+
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse
+except ImportError:  # orjson is optional, fall back to the standard encoder
+    orjson = None
+    ORJSONResponse = None
+
+
+def rows_to_dicts(rows) -> List[dict]:
+    """Build response dicts straight from column-projected query rows"""
+    return [row._asdict() for row in rows]
+
+
+def project_columns(fields: Optional[str], columns: Sequence, required: Sequence[str] = ()) -> list:
+    """
+    Select the columns named in a comma-separated fields= parameter, keeping
+    the declared order. Required columns (ids) are always selected.
+    """
+    if not fields:
+        return list(columns)
+
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    by_name = {column.key: column for column in columns}
+    unknown = requested - set(by_name)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown field(s): {', '.join(sorted(unknown))}"
+        )
+
+    return [column for name, column in by_name.items() if name in requested or name in required]
+
+
+def preview_column(columns: list, name: str, length: Optional[int]) -> list:
+    """Replace a text column with its first length + 1 characters (one extra to detect truncation)"""
+    if not length:
+        return columns
+    return [
+        func.substr(column, 1, length + 1).label(name) if column.key == name else column
+        for column in columns
+    ]
+
+
+def truncate_previews(rows: List[dict], name: str, length: Optional[int]) -> List[dict]:
+    """Cut preview text to length and mark rows whose text continues"""
+    if not length:
+        return rows
+    for row in rows:
+        text = row.get(name)
+        if text is not None and len(text) > length:
+            row[name] = text[:length]
+            row[f"{name}_truncated"] = True
+        elif name in row:
+            row[f"{name}_truncated"] = False
+    return rows
+
+
+def fast_json_response(content, validate: bool = True):
+    """
+    Encode already-shaped response data with orjson, skipping FastAPI's
+    response_model validation. Returns the data unchanged (so it goes through
+    the normal validated path) when fast responses are disabled or orjson is
+    not installed. Partial (projected) rows pass validate=False since they
+    would not satisfy the response model.
+    """
+    if ORJSONResponse is not None and (settings.FAST_JSON_RESPONSES or not validate):
+        with timed("serialize"):
+            return ORJSONResponse(content=content)
+    if not validate:
+        with timed("serialize"):
+            return JSONResponse(content=jsonable_encoder(content))
+    return content
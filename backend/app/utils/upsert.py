@@ -0,0 +1,44 @@
+from typing import List, Optional, Sequence
+from sqlalchemy import Table
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+
+def _ignoring_duplicates(db: Session, table: Table, build):
+    """Dialect-specific INSERT that skips rows violating a unique constraint"""
+    dialect = db.get_bind().dialect.name
+
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        stmt = build(insert(table))
+        # No-op update: ON DUPLICATE KEY only swallows unique violations, unlike INSERT IGNORE
+        primary_key = table.primary_key.columns[0]
+        return stmt.on_duplicate_key_update({primary_key.name: primary_key})
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        return build(insert(table)).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+        return build(insert(table)).on_conflict_do_nothing()
+    raise NotImplementedError(f"Idempotent insert is not supported on {dialect}")
+
+
+def insert_from_select_ignore_duplicates(db: Session, table: Table, columns: Sequence[str], select_stmt: Select) -> Optional[int]:
+    """
+    INSERT ... SELECT that silently skips rows violating a unique constraint,
+    as one statement. The SELECT doubles as the existence check for the
+    referenced row: if it matches nothing, nothing is inserted.
+
+    Returns the number of rows inserted, or None on MySQL, which counts a
+    skipped duplicate as a (found) row too.
+    """
+    result = db.execute(_ignoring_duplicates(db, table, lambda insert: insert.from_select(columns, select_stmt)))
+    if db.get_bind().dialect.name == "mysql":
+        return None
+    return result.rowcount
+
+
+def insert_ignore_duplicates(db: Session, table: Table, rows: List[dict]):
+    """Multi-row INSERT that silently skips rows violating a unique constraint"""
+    if rows:
+        db.execute(_ignoring_duplicates(db, table, lambda insert: insert.values(rows)))
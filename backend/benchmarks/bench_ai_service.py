@@ -0,0 +1,269 @@
+"""
+Microbenchmark: where AIAnalysisService spends its time, stage by stage.
+
+For each model (sentiment, sarcasm), backend, torch thread count, batch size
+and sequence length, times encoding (preprocess_for_* and the tokenizer, as
+encode_for_* does it), the forward pass and postprocessing (*_results)
+separately, on texts built from a corpus to the sequence length. The
+preprocess_for_* functions are also timed on their own, per text.
+
+Backends: eager (as served), int8 (dynamic quantization of the Linear
+layers) and compile (torch.compile).
+
+--save-baseline stores the results; a later run with --baseline compares
+against them and exits with status 1 if a configuration lost more than
+--tolerance of its texts/s, or a preprocessing function got that much slower.
+Only compare runs from the same machine.
+
+Usage (from backend/, with the app's .env in place):
+    python -m benchmarks.bench_ai_service
+    python -m benchmarks.bench_ai_service --batch-sizes 1,8,32,64 --threads 1,4,16 --backends eager,int8
+    python -m benchmarks.bench_ai_service --corpus posts.ndjson --save-baseline baseline.json
+    python -m benchmarks.bench_ai_service --baseline baseline.json --tolerance 0.1
+"""
+import argparse
+import copy
+import json
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import torch
+
+from app.services.ai_service import ai_service, SARCASM_MAX_TOKENS, SENTIMENT_MAX_TOKENS
+from app.utils.inference import available_cores, configure_interop_threads
+
+SAMPLE_TEXTS = [
+    "lol",
+    "Oh great, another Monday. Exactly what I needed.",
+    "@amy did you see this?? https://t.co/xyz 😂😂",
+    "The new update broke everything and support won't answer. Third time this month, "
+    "I'm seriously thinking about switching to something else.",
+    "Anyone know a good place for brunch downtown?",
+    "Finally finished my thesis after three years. Time to sleep for a week. Thanks to everyone "
+    "who read drafts, brought coffee and put up with me complaining about reviewers at 2am.",
+    "Wow, the train is late again, what a surprise",
+    "Can't believe they cancelled the show after one season, worst decision ever. The writing was "
+    "sharp, the cast was great and the last episode ended on a cliffhanger that will now never be resolved.",
+]
+
+BACKENDS = ("eager", "int8", "compile")
+
+
+def load_corpus(path: Optional[str]) -> List[str]:
+    """Texts, one per line; lines of an export_data.py NDJSON export contribute their content"""
+    if path is None:
+        return SAMPLE_TEXTS
+    texts = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                line = json.loads(line).get("content") or ""
+            if line:
+                texts.append(line)
+    return texts
+
+
+def texts_of_length(corpus: Sequence[str], tokenizer, tokens: int, count: int) -> List[str]:
+    """count texts of at least `tokens` tokens (the encoder truncates them to it), each joined from corpus texts"""
+    texts = []
+    for i in range(count):
+        parts, length, j = [], 0, i
+        while length < tokens:
+            text = corpus[j % len(corpus)]
+            parts.append(text)
+            length += len(tokenizer.tokenize(text)) + 1
+            j += 1
+        texts.append(" ".join(parts))
+    return texts
+
+
+def with_backend(service, backend: str):
+    """A shallow copy of the model set whose models run on the given backend"""
+    if backend == "eager":
+        return service
+    variant = copy.copy(service)
+    for name in ("sentiment_model", "sarcasm_model"):
+        model = getattr(service, name)
+        if backend == "int8":
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif backend == "compile":
+            model = torch.compile(model)
+        else:
+            raise ValueError(f"Unknown backend {backend}")
+        setattr(variant, name, model)
+    return variant
+
+
+def median_time(fn: Callable, repeats: int) -> float:
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def bench_stages(service, model_name: str, texts: List[str], seq_len: int, repeats: int) -> Dict:
+    """Median encode / forward / postprocess time of one batch"""
+    if model_name == "sentiment":
+        encode, model, results = service.encode_for_sentiment, service.sentiment_model, service.sentiment_results
+    else:
+        encode, model, results = service.encode_for_sarcasm, service.sarcasm_model, service.sarcasm_results
+
+    def forward():
+        with torch.inference_mode():
+            return model(**encoded).logits
+
+    encoded = encode(texts, max_length=seq_len)
+    for _ in range(2):
+        logits = forward()  # Warm up, and the input of the postprocessing timing
+    encode_s = median_time(lambda: encode(texts, max_length=seq_len), repeats)
+    forward_s = median_time(forward, repeats)
+    postprocess_s = median_time(lambda: results(logits), repeats)
+    total = encode_s + forward_s + postprocess_s
+    return {
+        "encode_ms": round(encode_s * 1000, 3),
+        "forward_ms": round(forward_s * 1000, 3),
+        "postprocess_ms": round(postprocess_s * 1000, 3),
+        "texts_per_s": round(len(texts) / total, 1)
+    }
+
+
+def bench_preprocess(service, corpus: Sequence[str], rounds: int = 200) -> List[Dict]:
+    results = []
+    for name in ("preprocess_for_sentiment", "preprocess_for_sarcasm"):
+        fn = getattr(service, name)
+        elapsed = median_time(lambda: [fn(text) for text in corpus], rounds)
+        results.append({"function": name, "us_per_text": round(elapsed / len(corpus) * 1e6, 3)})
+    return results
+
+
+def parse_ints(value: str) -> List[int]:
+    return [int(item) for item in value.split(",")]
+
+
+def result_key(result: Dict) -> tuple:
+    return result["model"], result["backend"], result["threads"], result["batch_size"], result["seq_len"]
+
+
+def regressions(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Configurations that got slower than the baseline by more than tolerance"""
+    found = []
+    old_results = {result_key(r): r for r in baseline.get("results", [])}
+    for result in report["results"]:
+        old = old_results.get(result_key(result))
+        if old and result["texts_per_s"] < old["texts_per_s"] * (1 - tolerance):
+            found.append(
+                f"{'/'.join(map(str, result_key(result)))}: {old['texts_per_s']} -> {result['texts_per_s']} texts/s "
+                f"(encode {old['encode_ms']} -> {result['encode_ms']} ms, forward {old['forward_ms']} -> "
+                f"{result['forward_ms']} ms, postprocess {old['postprocess_ms']} -> {result['postprocess_ms']} ms)"
+            )
+    old_preprocess = {r["function"]: r for r in baseline.get("preprocess", [])}
+    for result in report["preprocess"]:
+        old = old_preprocess.get(result["function"])
+        if old and result["us_per_text"] > old["us_per_text"] * (1 + tolerance):
+            found.append(f"{result['function']}: {old['us_per_text']} -> {result['us_per_text']} us/text")
+    return found
+
+
+def print_report(report: Dict):
+    machine = report["machine"]
+    print(f"{machine['model_revision']}, torch {machine['torch']}, {machine['cores']} cores")
+    for r in report["preprocess"]:
+        print(f"{r['function']}: {r['us_per_text']} us/text")
+    print(f"{'model':<10} {'backend':<8} {'threads':>7} {'batch':>6} {'seq':>5} "
+          f"{'encode ms':>10} {'forward ms':>11} {'post ms':>8} {'texts/s':>9}")
+    for r in report["results"]:
+        print(f"{r['model']:<10} {r['backend']:<8} {r['threads']:>7} {r['batch_size']:>6} {r['seq_len']:>5} "
+              f"{r['encode_ms']:>10} {r['forward_ms']:>11} {r['postprocess_ms']:>8} {r['texts_per_s']:>9}")
+    for model, best in report["best"].items():
+        print(f"best {model}: {best['backend']}, {best['threads']} threads, batch {best['batch_size']} "
+              f"at {best['seq_len']} tokens -> {best['texts_per_s']} texts/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="text file (one text per line) or export_data.py NDJSON, default built-in samples")
+    parser.add_argument("--models", default="sentiment,sarcasm")
+    parser.add_argument("--backends", default="eager", help=f"comma-separated of {', '.join(BACKENDS)}")
+    parser.add_argument("--threads", help="comma-separated torch thread counts, default all cores")
+    parser.add_argument("--batch-sizes", default="1,8,32")
+    parser.add_argument("--seq-lens", default="32,128,512", help="tokens, capped at each model's limit")
+    parser.add_argument("--repeats", type=int, default=5, help="timed runs per stage, the median is kept")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    parser.add_argument("--save-baseline", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    configure_interop_threads(1)
+    service = ai_service.active
+    corpus = load_corpus(args.corpus)
+    models = args.models.split(",")
+    backends = args.backends.split(",")
+    threads = parse_ints(args.threads) if args.threads else [len(available_cores())]
+    limits = {"sentiment": SENTIMENT_MAX_TOKENS, "sarcasm": SARCASM_MAX_TOKENS}
+    tokenizers = {"sentiment": service.sentiment_tokenizer, "sarcasm": service.sarcasm_tokenizer}
+
+    results = []
+    for backend in backends:
+        variant = with_backend(service, backend)
+        for thread_count in threads:
+            torch.set_num_threads(thread_count)
+            for model in models:
+                seq_lens = sorted({min(seq_len, limits[model]) for seq_len in parse_ints(args.seq_lens)})
+                for seq_len in seq_lens:
+                    texts = texts_of_length(corpus, tokenizers[model], seq_len, max(parse_ints(args.batch_sizes)))
+                    for batch_size in parse_ints(args.batch_sizes):
+                        results.append({
+                            "model": model,
+                            "backend": backend,
+                            "threads": thread_count,
+                            "batch_size": batch_size,
+                            "seq_len": seq_len,
+                            **bench_stages(variant, model, texts[:batch_size], seq_len, args.repeats)
+                        })
+
+    report = {
+        "machine": {
+            "cores": len(available_cores()),
+            "torch": torch.__version__,
+            "model_revision": service.model_revision
+        },
+        "preprocess": bench_preprocess(service, corpus),
+        "results": results,
+        "best": {
+            model: max((r for r in results if r["model"] == model), key=lambda r: r["texts_per_s"])
+            for model in models
+        }
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("machine") != report["machine"]:
+            print(f"warning: baseline is from {baseline.get('machine')}, not {report['machine']}", file=sys.stderr)
+        found = regressions(report, baseline, args.tolerance)
+        if found:
+            print(f"{len(found)} regressions beyond {args.tolerance:.0%}:", file=sys.stderr)
+            for line in found:
+                print(f"  {line}", file=sys.stderr)
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
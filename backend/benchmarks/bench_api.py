@@ -0,0 +1,484 @@
+"""
+End-to-end load test: throughput and latency of the API under a mixed workload.
+
+Boots the app in a child process - against a fresh SQLite file by default, or
+any database with --database-url - seeds it with users, posts, comments,
+likes and follows, and serves it with stubbed models (--models stub, a fixed
+delay per forward pass) or the real ones. Or point --url at a server that is
+already running. Concurrent clients, each logged in as its own user, then
+send a weighted mix of requests for --duration seconds after a warm-up, and
+RPS plus p50/p95/p99 latency are reported per route.
+
+Save results with --output and compare runs, e.g. before and after a commit,
+with --compare.
+
+Usage (from backend/):
+    python -m benchmarks.bench_api --concurrency 16 --duration 30 --output before.json
+    python -m benchmarks.bench_api --mix read-heavy --compare before.json
+    python -m benchmarks.bench_api --mix feed=6,like=3,create_post=1 --workers 4
+    python -m benchmarks.bench_api --database-url "mysql+pymysql://user:pw@localhost/bench" --models real
+    python -m benchmarks.bench_api --url http://localhost:8000 --users 20
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+
+API = "/api/v1"
+USER_PREFIX = "bench_user_"
+PASSWORD = "bench-password"
+
+MIXES = {
+    "mixed": {"feed": 40, "post": 10, "comments": 20, "like": 15, "create_comment": 8, "create_post": 5, "analyze": 2},
+    "read-heavy": {"feed": 55, "post": 15, "comments": 25, "like": 5},
+    "write-heavy": {"feed": 20, "comments": 10, "like": 30, "create_comment": 20, "create_post": 20},
+}
+
+SAMPLE_TEXTS = [
+    "Just got back from the best concert of my life, still buzzing!",
+    "Oh great, another Monday. Exactly what I needed.",
+    "The new update broke everything and support won't answer.",
+    "Anyone know a good place for brunch downtown?",
+    "Can't believe they cancelled the show after one season, worst decision ever",
+    "Finally finished my thesis after three years. Time to sleep for a week.",
+    "Wow, the train is late again, what a surprise",
+    "Thanks everyone for the birthday wishes, you made my day",
+]
+
+
+# Server
+
+def seed(users: int, posts: int, comments_per_post: int, likes_per_post: int, follows_per_user: int):
+    """Fill the database with a social graph to read, unless a previous run already did"""
+    from app.database import SessionLocal
+    from app.models import Comment, Like, Post, User, UserRelation
+    from app.models.comment import comment_path
+    from app.utils.security import get_password_hash
+
+    db = SessionLocal()
+    try:
+        if db.query(User.user_id).filter(User.user_name == f"{USER_PREFIX}0").first():
+            return
+        rng = random.Random(1)
+        password_hash = get_password_hash(PASSWORD)
+        db.add_all([
+            User(user_name=f"{USER_PREFIX}{i}", user_email=f"{USER_PREFIX}{i}@bench.local", password_hash=password_hash)
+            for i in range(users)
+        ])
+        db.flush()
+        user_ids = [user_id for (user_id,) in db.query(User.user_id).filter(User.user_name.like(f"{USER_PREFIX}%"))]
+
+        for follower in user_ids:
+            for followed in rng.sample(user_ids, min(follows_per_user, len(user_ids))):
+                if followed != follower:
+                    db.add(UserRelation(follower_id=follower, followed_id=followed))
+
+        post_rows = []
+        for i in range(posts):
+            label = rng.choice(("negative", "neutral", "positive"))
+            post_rows.append(Post(
+                user_id=rng.choice(user_ids),
+                title=f"Bench post {i}",
+                content=rng.choice(SAMPLE_TEXTS),
+                sentiment_label=label,
+                sentiment_confidence=0.9,
+                is_sarcastic=False,
+                sarcasm_confidence=0.8,
+                like_count=0
+            ))
+        db.add_all(post_rows)
+        db.flush()
+
+        for post in post_rows:
+            likers = rng.sample(user_ids, min(rng.randint(0, likes_per_post), len(user_ids)))
+            db.add_all([Like(user_id=user_id, post_id=post.post_id) for user_id in likers])
+            post.like_count = len(likers)
+
+            parents: List[Comment] = []
+            for _ in range(rng.randint(0, comments_per_post)):
+                parent = rng.choice(parents) if parents and rng.random() < 0.4 else None
+                comment = Comment(
+                    post_id=post.post_id,
+                    user_id=rng.choice(user_ids),
+                    content=rng.choice(SAMPLE_TEXTS),
+                    parent_comment_id=parent.comment_id if parent else None,
+                    sentiment_label="neutral",
+                    sentiment_confidence=0.9
+                )
+                db.add(comment)
+                db.flush()
+                comment.path = comment_path(parent.path if parent else None, comment.comment_id)
+                comment.depth = parent.depth + 1 if parent else 0
+                parents.append(comment)
+        db.commit()
+    finally:
+        db.close()
+
+
+def serve(args):
+    """The child process: seed the database and serve the app until terminated"""
+    if args.models == "stub":
+        from benchmarks.stub_models import install_stub_models
+        install_stub_models(args.model_latency_ms / 1000, args.model_text_latency_ms / 1000)
+
+    from app.config import settings
+    from app.database import Base, engine
+    from app.utils.rules import seed_default_rules
+    from app.database import SessionLocal
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        seed_default_rules(db)
+    finally:
+        db.close()
+    seed(args.users, args.posts, args.comments_per_post, args.likes_per_post, args.follows_per_user)
+    print(f"Seeded {settings.database_url}", flush=True)
+
+    if args.workers > 1:
+        from app.utils.prefork import serve as prefork_serve
+        prefork_serve("app.main:app", "127.0.0.1", args.port, args.workers, log_level="warning")
+    else:
+        import uvicorn
+        uvicorn.run("app.main:app", host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, workdir: str) -> Tuple[subprocess.Popen, str, str]:
+    port = free_port()
+    env = dict(os.environ)
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    env.update(
+        DATABASE_URL=database_url,
+        ENVIRONMENT="benchmark",  # Not development, which echoes every query
+        RATE_LIMIT_ENABLED="false",  # Every client comes from the same address
+        MODEL_REGISTRY_POLL_SECONDS="3600"
+    )
+    for key, value in (("DB_USER", "bench"), ("DB_PASSWORD", "bench"), ("DB_NAME", "bench"), ("SECRET_KEY", "bench")):
+        env.setdefault(key, value)
+
+    command = [
+        sys.executable, "-m", "benchmarks.bench_api", "--serve",
+        "--port", str(port), "--workers", str(args.workers), "--models", args.models,
+        "--model-latency-ms", str(args.model_latency_ms), "--model-text-latency-ms", str(args.model_text_latency_ms),
+        "--users", str(args.users), "--posts", str(args.posts), "--comments-per-post", str(args.comments_per_post),
+        "--likes-per-post", str(args.likes_per_post), "--follows-per-user", str(args.follows_per_user)
+    ]
+    log_path = os.path.join(workdir, "server.log")
+    log = open(log_path, "w")
+    process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return process, f"http://127.0.0.1:{port}", log_path
+
+
+def stop_server(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=40)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+# Client
+
+class Client:
+    """One keep-alive connection, logged in as one user"""
+
+    def __init__(self, base_url: str):
+        url = urlsplit(base_url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        self.token: Optional[str] = None
+
+    def request(self, method: str, path: str, body: Optional[dict] = None) -> Tuple[int, bytes]:
+        headers = {"Host": "localhost", "Accept-Encoding": "identity"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        try:
+            self.connection.request(method, path, payload, headers)
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            # Reconnect once, e.g. after the server closed an idle keep-alive connection
+            self.connection.close()
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            self.connection.request(method, path, payload, headers)
+            response = self.connection.getresponse()
+            return response.status, response.read()
+
+    def login(self, user_name: str):
+        status, body = self.request("POST", f"{API}/auth/login", {"username": user_name, "password": PASSWORD})
+        if status != 200:
+            raise RuntimeError(f"Login as {user_name} failed with {status}: {body[:200]!r}")
+        self.token = json.loads(body)["access_token"]
+
+
+def wait_until_ready(base_url: str, timeout: float, process: Optional[subprocess.Popen] = None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError("The server exited during startup")
+        try:
+            status, _ = Client(base_url).request("GET", "/health")
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"The server was not ready within {timeout:.0f}s")
+
+
+def post_ids(client: Client, limit: int = 1000) -> List[int]:
+    status, body = client.request("GET", f"{API}/posts/?limit={limit}&fields=title")
+    if status != 200:
+        raise RuntimeError(f"Listing posts failed with {status}")
+    return [post["post_id"] for post in json.loads(body)]
+
+
+class Workload:
+    """The requests of the mix, each choosing its target like real traffic: mostly the hot posts"""
+
+    def __init__(self, mix: Dict[str, float], posts: List[int], rng: random.Random):
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.posts = posts
+        self.hot = posts[:max(1, len(posts) // 5)]
+        self.rng = rng
+        self.liked = set()
+
+    def post_id(self) -> int:
+        return self.rng.choice(self.hot if self.rng.random() < 0.8 else self.posts)
+
+    def next(self) -> Tuple[str, str, str, Optional[dict]]:
+        """(route, method, path, body) of the next request"""
+        name = self.rng.choices(self.names, self.weights)[0]
+        text = self.rng.choice(SAMPLE_TEXTS)
+        if name == "feed":
+            return name, "GET", f"{API}/posts/?limit=20&include=like_count,comment_count,user_has_liked", None
+        if name == "post":
+            return name, "GET", f"{API}/posts/{self.post_id()}?include=like_count,comment_count,user_has_liked", None
+        if name == "comments":
+            return name, "GET", f"{API}/posts/{self.post_id()}/comments/tree", None
+        if name == "like":
+            post_id = self.post_id()
+            liked = post_id in self.liked
+            self.liked.symmetric_difference_update({post_id})
+            return name, "DELETE" if liked else "POST", f"{API}/posts/{post_id}/like", None
+        if name == "create_comment":
+            return name, "POST", f"{API}/posts/{self.post_id()}/comments", {"content": text}
+        if name == "create_post":
+            return name, "POST", f"{API}/posts/", {"title": "Bench", "content": text}
+        if name == "analyze":
+            return name, "POST", f"{API}/posts/analyze", {"text": text}
+        raise ValueError(f"Unknown route {name}")
+
+
+def drive(clients: List[Client], mix: Dict[str, float], posts: List[int], warmup: float, duration: float) -> Dict:
+    """Run every client in its own thread; latencies of requests started after the warm-up are kept"""
+    start = time.perf_counter()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+    results: Dict[str, Dict[str, list]] = {}
+    lock = threading.Lock()
+
+    def run(index: int, client: Client):
+        workload = Workload(mix, posts, random.Random(index))
+        mine: Dict[str, Dict[str, list]] = {}
+        while True:
+            now = time.perf_counter()
+            if now >= stop_at:
+                break
+            route, method, path, body = workload.next()
+            try:
+                status, _ = client.request(method, path, body)
+            except (http.client.HTTPException, OSError):
+                status = 0
+            elapsed = time.perf_counter() - now
+            if now >= measure_from:
+                entry = mine.setdefault(route, {"latencies": [], "errors": []})
+                entry["latencies"].append(elapsed)
+                if status >= 400 or status == 0:
+                    entry["errors"].append(status)
+        with lock:
+            for route, entry in mine.items():
+                merged = results.setdefault(route, {"latencies": [], "errors": []})
+                merged["latencies"].extend(entry["latencies"])
+                merged["errors"].extend(entry["errors"])
+
+    threads = [threading.Thread(target=run, args=(i, client)) for i, client in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def summarize(latencies: List[float], errors: List[int], duration: float) -> Dict:
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000 if latencies else (0, 0, 0)
+    statuses: Dict[str, int] = {}
+    for status in errors:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / duration, 1),
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "mean_ms": round(float(np.mean(latencies)) * 1000, 2) if latencies else 0,
+        "errors": len(errors),
+        "error_statuses": statuses
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    if value in MIXES:
+        return MIXES[value]
+    mix = {}
+    for item in value.split(","):
+        name, weight = item.split("=")
+        if name not in MIXES["mixed"]:
+            raise argparse.ArgumentTypeError(f"unknown route {name}, choose from {', '.join(MIXES['mixed'])}")
+        mix[name] = float(weight)
+    return mix
+
+
+def print_results(report: Dict, baseline: Optional[Dict]):
+    print(f"{report['concurrency']} clients, {report['duration_s']}s, mix {report['mix']}, commit {report['commit']}")
+    header = f"{'route':<15} {'requests':>9} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}"
+    if baseline:
+        header += f" {'rps vs base':>12} {'p95 vs base':>12}"
+    print(header)
+
+    def change(new, old) -> str:
+        return f"{(new - old) / old:+.1%}" if old else "-"
+
+    for route, r in list(report["routes"].items()) + [("total", report["total"])]:
+        line = (f"{route:<15} {r['requests']:>9} {r['rps']:>8} {r['p50_ms']:>8} "
+                f"{r['p95_ms']:>8} {r['p99_ms']:>8} {r['errors']:>7}")
+        if baseline:
+            old = baseline["total"] if route == "total" else baseline["routes"].get(route)
+            if old:
+                line += f" {change(r['rps'], old['rps']):>12} {change(r['p95_ms'], old['p95_ms']):>12}"
+        print(line)
+
+
+def run(args):
+    mix = parse_mix(args.mix)
+    workdir = tempfile.mkdtemp(prefix="bench_api_")
+    process, log_path = None, None
+    base_url = args.url
+    try:
+        if base_url is None:
+            process, base_url, log_path = start_server(args, workdir)
+        wait_until_ready(base_url, args.startup_timeout, process)
+
+        clients = [Client(base_url) for _ in range(args.concurrency)]
+        for i, client in enumerate(clients):
+            client.login(f"{USER_PREFIX}{i % args.users}")
+        posts = post_ids(clients[0])
+        if not posts:
+            raise RuntimeError("No posts to read, seed the database (bench users and posts) first")
+
+        results = drive(clients, mix, posts, args.warmup, args.duration)
+    except RuntimeError as e:
+        if log_path:
+            print(f"Server log: {log_path}", file=sys.stderr)
+        raise SystemExit(str(e))
+    finally:
+        if process is not None:
+            stop_server(process)
+    shutil.rmtree(workdir, ignore_errors=True)  # Kept, with the server log, when the run failed
+
+    report = {
+        "commit": git_commit(),
+        "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "target": args.url or ("sqlite" if not args.database_url else urlsplit(args.database_url).scheme),
+        "models": None if args.url else args.models,
+        "workers": None if args.url else args.workers,
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "mix": args.mix,
+        "routes": {route: summarize(r["latencies"], r["errors"], args.duration) for route, r in sorted(results.items())},
+        "total": summarize(
+            [x for r in results.values() for x in r["latencies"]],
+            [x for r in results.values() for x in r["errors"]],
+            args.duration
+        )
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_results(report, baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="load an already running server instead of starting one (seeded by an earlier run)")
+    parser.add_argument("--database-url", help="SQLAlchemy URL of the database to seed and serve, default a fresh SQLite file")
+    parser.add_argument("--models", choices=("stub", "real"), default="stub")
+    parser.add_argument("--model-latency-ms", type=float, default=20, help="stub forward pass time")
+    parser.add_argument("--model-text-latency-ms", type=float, default=5, help="stub forward pass time per text")
+    parser.add_argument("--workers", type=int, default=1, help="server processes, more than one uses the pre-fork launcher")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of load before measuring")
+    parser.add_argument("--mix", default="mixed", help=f"{', '.join(MIXES)} or ROUTE=WEIGHT,... of {', '.join(MIXES['mixed'])}")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument("--comments-per-post", type=int, default=10, help="at most, random per post")
+    parser.add_argument("--likes-per-post", type=int, default=20, help="at most, random per post")
+    parser.add_argument("--follows-per-user", type=int, default=10)
+    parser.add_argument("--startup-timeout", type=float, default=300, help="seconds, loading real models takes a while")
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
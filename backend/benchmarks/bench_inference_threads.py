@@ -0,0 +1,169 @@
+"""
+Load benchmark: inference throughput for different splits of the cores
+between inference threads and torch intra-op threads.
+
+Many client threads (like the request threadpool under load) submit one text
+each to an InferenceExecutor configured as threads x intra-op threads, for
+every split of the available cores, optionally pinned. The baseline lets the
+clients call the model directly with torch's default thread count, which is
+what happened before the executor: every forward pass tries to use every core.
+
+The model is the configured sentiment model (downloaded on first use), or a
+roberta-base sized synthetic encoder with --model synthetic.
+
+Usage (from backend/, with the app's .env in place):
+    python -m benchmarks.bench_inference_threads --clients 16 --requests 400
+    python -m benchmarks.bench_inference_threads --configs 1x8,2x4,4x2 --pin
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from app.config import settings
+from app.utils.inference import InferenceExecutor, available_cores, configure_interop_threads
+
+SAMPLE_TEXTS = [
+    "Just got back from the best concert of my life, still buzzing!",
+    "Oh great, another Monday. Exactly what I needed.",
+    "The new update broke everything and support won't answer.",
+    "Anyone know a good place for brunch downtown?",
+    "Can't believe they cancelled the show after one season, worst decision ever",
+    "Finally finished my thesis after three years. Time to sleep for a week.",
+    "Wow, the train is late again, what a surprise",
+    "Thanks everyone for the birthday wishes, you made my day",
+]
+
+
+def sentiment_model() -> Callable[[str], None]:
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(settings.SENTIMENT_MODEL)
+    model = AutoModelForSequenceClassification.from_pretrained(settings.SENTIMENT_MODEL).eval()
+
+    def run(text: str):
+        encoded = tokenizer(text, truncation=True, max_length=512, return_tensors="pt")
+        with torch.no_grad():
+            model(**encoded)
+    return run
+
+
+def synthetic_model() -> Callable[[str], None]:
+    layer = torch.nn.TransformerEncoderLayer(768, 12, 3072, batch_first=True)
+    model = torch.nn.TransformerEncoder(layer, 12).eval()
+
+    def run(text: str):
+        with torch.no_grad():
+            model(torch.randn(1, 8 + 2 * len(text.split()), 768))
+    return run
+
+
+def splits(cores: int) -> List[Tuple[int, int]]:
+    """Every threads x intra-op threads split that uses all cores"""
+    return [(threads, cores // threads) for threads in range(1, cores + 1) if cores % threads == 0]
+
+
+def parse_configs(value: str) -> List[Tuple[int, int]]:
+    configs = []
+    for item in value.split(","):
+        threads, intra = item.lower().split("x")
+        configs.append((int(threads), int(intra)))
+    return configs
+
+
+def drive(call: Callable[[str], None], clients: int, requests: int) -> dict:
+    """Send `requests` texts from `clients` threads through call() and time each one"""
+    texts = [random.Random(i).choice(SAMPLE_TEXTS) for i in range(requests)]
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def client(shard: List[str]):
+        mine = []
+        for text in shard:
+            start = time.perf_counter()
+            call(text)
+            mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+
+    workers = [threading.Thread(target=client, args=(texts[i::clients],)) for i in range(clients)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        "texts_per_s": round(requests / elapsed, 1),
+        "p50_ms": round(float(p50), 1),
+        "p95_ms": round(float(p95), 1),
+        "p99_ms": round(float(p99), 1),
+    }
+
+
+def bench_unmanaged(model, clients: int, requests: int, cores: int) -> dict:
+    # Clients call the model themselves, each forward pass sized for every core
+    def call(text):
+        torch.set_num_threads(cores)
+        model(text)
+    drive(call, clients, min(requests, clients * 2))  # Warm up
+    return drive(call, clients, requests)
+
+
+def bench_executor(model, clients: int, requests: int, threads: int, intra: int, pin: bool) -> dict:
+    executor = InferenceExecutor(threads, intra, pin_cores=pin)
+    try:
+        call = lambda text: executor.run(model, text)  # noqa: E731
+        drive(call, clients, min(requests, threads * 2))  # Warm up, starts every inference thread
+        return drive(call, clients, requests)
+    finally:
+        executor.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=16, help="concurrent callers, like request threads")
+    parser.add_argument("--requests", type=int, default=400, help="texts analyzed per configuration")
+    parser.add_argument("--configs", help="comma-separated THREADSxINTRA, defaults to every split of the cores")
+    parser.add_argument("--cores", type=int, help="cores to split, defaults to those this process may use")
+    parser.add_argument("--pin", action="store_true", help="also run each split pinned to core sets")
+    parser.add_argument("--model", choices=("sentiment", "synthetic"), default="sentiment")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    cores = args.cores or len(available_cores())
+    configs = parse_configs(args.configs) if args.configs else splits(cores)
+    configure_interop_threads(1)
+    model = sentiment_model() if args.model == "sentiment" else synthetic_model()
+
+    results = []
+    results.append({"config": "unmanaged", **bench_unmanaged(model, args.clients, args.requests, cores)})
+    for threads, intra in configs:
+        for pin in ((False, True) if args.pin else (False,)):
+            label = f"{threads}x{intra}" + (" pinned" if pin else "")
+            results.append({"config": label, **bench_executor(model, args.clients, args.requests, threads, intra, pin)})
+
+    best: Optional[dict] = max(results[1:], key=lambda r: r["texts_per_s"], default=None)
+    if args.json:
+        print(json.dumps({"cores": cores, "clients": args.clients, "results": results, "best": best and best["config"]}, indent=2))
+        return
+
+    print(f"{args.model} model, {cores} cores, {args.clients} clients, {args.requests} texts per configuration")
+    print(f"{'threads x intra':<16} {'texts/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for r in results:
+        print(f"{r['config']:<16} {r['texts_per_s']:>8} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8}")
+    if best:
+        threads, intra = best["config"].split()[0].split("x")
+        print(f"best: {best['config']} -> INFERENCE_THREADS={threads} INFERENCE_INTRA_OP_THREADS={intra}"
+              + (" INFERENCE_PIN_CORES=true" if "pinned" in best["config"] else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Load benchmark: many users liking one hot post, per-request transactions vs
+the write-behind like aggregator.
+
+The direct path is what the like route does without write-behind: one
+idempotent insert, a counter recount and a commit per like. The aggregator
+path buffers each like and flushes merged batches in the background. Both
+run against a fresh database (a temporary SQLite file unless --database-url
+is given) and the final posts.like_count is checked against the likes table.
+
+Usage (from backend/, with the app's .env in place):
+    python -m benchmarks.bench_like_aggregator --likes 5000 --threads 8
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, func, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import User, Post, Like
+from app.utils.like_aggregator import LikeAggregator, apply_post_like
+
+
+def make_database(url: str, users: int):
+    connect_args = {"check_same_thread": False, "timeout": 30} if url.startswith("sqlite") else {}
+    engine = create_engine(url, connect_args=connect_args, pool_size=32, max_overflow=32)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"user_id": i, "user_name": f"bench_{i}", "user_email": f"bench_{i}@example.com", "password_hash": "x"}
+            for i in range(1, users + 1)
+        ])
+        conn.execute(insert(Post), [{"post_id": 1, "user_id": 1, "title": "Hot post", "content": "Going viral"}])
+    return engine
+
+
+def make_intents(likes: int, users: int, unlike_ratio: float, seed: int = 42):
+    """(user_id, liked) pairs and the liked state each user should end up in"""
+    rng = random.Random(seed)
+    intents, final = [], {}
+    for _ in range(likes):
+        user_id = rng.randint(1, users)
+        liked = rng.random() >= unlike_ratio
+        intents.append((user_id, liked))
+        final[user_id] = liked
+    return intents, sum(final.values())
+
+
+def run_threads(intents, threads: int, handle):
+    """Split the intents across worker threads by user and return the elapsed seconds"""
+    # Each user's intents stay on one thread, in order, so the final state is deterministic
+    shards = [[intent for intent in intents if intent[0] % threads == i] for i in range(threads)]
+    workers = [threading.Thread(target=handle, args=(shard,)) for shard in shards]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def bench_direct(session_factory, intents, threads: int) -> float:
+    def handle(shard):
+        db = session_factory()
+        try:
+            for user_id, liked in shard:
+                apply_post_like(db, user_id, 1, liked)
+                db.commit()
+        finally:
+            db.close()
+
+    return run_threads(intents, threads, handle)
+
+
+def bench_aggregator(session_factory, intents, threads: int, flush_interval_ms: int, log_dir) -> float:
+    aggregator = LikeAggregator(session_factory, flush_interval_ms=flush_interval_ms, log_dir=log_dir)
+    aggregator.start()
+
+    def handle(shard):
+        db = session_factory()
+        try:
+            for user_id, liked in shard:
+                aggregator.submit(db, user_id, 1, liked)
+        finally:
+            db.close()
+
+    start = time.perf_counter()
+    run_threads(intents, threads, handle)
+    aggregator.stop()  # Includes draining the last batch
+    return time.perf_counter() - start
+
+
+def check_counts(session_factory, expected: int) -> dict:
+    db = session_factory()
+    try:
+        counter = db.query(Post.like_count).filter(Post.post_id == 1).scalar()
+        rows = db.query(func.count(Like.like_id)).filter(Like.post_id == 1).scalar()
+    finally:
+        db.close()
+    return {"like_count": counter, "like_rows": rows, "expected": expected, "ok": counter == rows == expected}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--likes", type=int, default=5000, help="like/unlike requests to send")
+    parser.add_argument("--users", type=int, default=2000, help="distinct users liking the post")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--unlike-ratio", type=float, default=0.1)
+    parser.add_argument("--flush-interval-ms", type=int, default=200)
+    parser.add_argument("--log", action="store_true", help="append intents to a durable log")
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    intents, expected = make_intents(args.likes, args.users, args.unlike_ratio)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'likes.db')}"
+        log_dir = os.path.join(tmp, "like-log") if args.log else None
+
+        results = {}
+        for name in ("direct", "aggregator"):
+            engine = make_database(url, args.users)
+            session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+            if name == "direct":
+                elapsed = bench_direct(session_factory, intents, args.threads)
+            else:
+                elapsed = bench_aggregator(session_factory, intents, args.threads, args.flush_interval_ms, log_dir)
+            results[name] = {
+                "seconds": round(elapsed, 3),
+                "likes_per_s": round(len(intents) / elapsed),
+                **check_counts(session_factory, expected),
+            }
+            engine.dispose()
+
+    results["speedup"] = round(results["aggregator"]["likes_per_s"] / results["direct"]["likes_per_s"], 1)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{len(intents)} likes from {args.users} users on one post, {args.threads} threads")
+    print(f"{'path':<11} {'seconds':>8} {'likes/s':>9} {'count':>7} {'rows':>7} {'ok':>4}")
+    for name in ("direct", "aggregator"):
+        r = results[name]
+        print(f"{name:<11} {r['seconds']:>8} {r['likes_per_s']:>9} {r['like_count']:>7} {r['like_rows']:>7} {str(r['ok']):>4}")
+    print(f"speedup     {results['speedup']:>7}x")
+
+
+if __name__ == "__main__":
+    main()
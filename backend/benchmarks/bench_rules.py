@@ -0,0 +1,82 @@
+"""
+Microbenchmark: moderation rules evaluated per row vs vectorized over NumPy columns.
+
+Builds a synthetic corpus of analysis columns and evaluates the default
+rules both ways, checking that they agree. The vectorized path is what
+/admin/moderation/rules/reevaluate runs on each chunk it reads.
+
+Usage (from backend/, with the app's .env in place):
+    python -m benchmarks.bench_rules --rows 2000000
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.utils.rules import DEFAULT_RULESET
+
+
+def make_columns(rows: int, seed: int = 42) -> dict:
+    rng = np.random.default_rng(seed)
+    return {
+        "sentiment_label": rng.choice(np.array(["negative", "neutral", "positive"], dtype=object), rows),
+        "sentiment_confidence": rng.random(rows),
+        "is_sarcastic": rng.random(rows) < 0.2,
+        "sarcasm_confidence": rng.random(rows),
+    }
+
+
+def per_row(columns: dict) -> np.ndarray:
+    return np.array([
+        DEFAULT_RULESET.matches({
+            "sentiment": {"sentiment_label": label, "confidence": sentiment_confidence},
+            "sarcasm": {"is_sarcastic": is_sarcastic, "confidence": sarcasm_confidence},
+        })
+        for label, sentiment_confidence, is_sarcastic, sarcasm_confidence in zip(
+            columns["sentiment_label"],
+            columns["sentiment_confidence"].tolist(),
+            columns["is_sarcastic"].tolist(),
+            columns["sarcasm_confidence"].tolist()
+        )
+    ])
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    columns = make_columns(args.rows)
+    expected, row_seconds = timed(per_row, columns)
+    vectorized, vector_seconds = timed(DEFAULT_RULESET.evaluate, columns)
+
+    results = {
+        "rows": args.rows,
+        "flagged": int(vectorized.sum()),
+        "agree": bool(np.array_equal(expected, vectorized)),
+        "per_row": {"seconds": round(row_seconds, 3), "rows_per_s": round(args.rows / row_seconds)},
+        "numpy": {"seconds": round(vector_seconds, 3), "rows_per_s": round(args.rows / vector_seconds)},
+        "speedup": round(row_seconds / vector_seconds, 1),
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{args.rows} rows, {results['flagged']} flagged, paths agree: {results['agree']}")
+    print(f"{'path':<8} {'seconds':>8} {'rows/s':>12}")
+    for path in ("per_row", "numpy"):
+        print(f"{path:<8} {results[path]['seconds']:>8} {results[path]['rows_per_s']:>12}")
+    print(f"speedup  {results['speedup']:>7}x")
+
+
+if __name__ == "__main__":
+    main()
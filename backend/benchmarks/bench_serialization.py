@@ -0,0 +1,128 @@
+"""
+Microbenchmark: standard list-response path vs the orjson fast path.
+
+The standard path mirrors what FastAPI does for a response_model route:
+validate every dict into the Pydantic schema, dump it in JSON mode and
+encode with json.dumps. The fast path encodes the row dicts directly.
+
+Usage (from backend/):
+    python -m benchmarks.bench_serialization --rows 50 --iterations 2000
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from pydantic import TypeAdapter
+
+from app.schemas.post import PostResponse
+from app.schemas.comment import CommentResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def make_post_rows(count: int) -> List[dict]:
+    now = datetime(2024, 1, 1, 12, 0, 0)
+    return [{
+        "post_id": i,
+        "title": f"Post title number {i}",
+        "content": "Just had the best coffee of my life, highly recommend the place downtown! " * 3,
+        "user_id": i % 97,
+        "user_name": f"user_{i % 97}",
+        "created_at": now - timedelta(minutes=i),
+        "sentiment_label": "positive",
+        "sentiment_confidence": 0.9731,
+        "is_sarcastic": False,
+        "sarcasm_confidence": 0.8812,
+        "analyzed_at": now - timedelta(minutes=i, seconds=-5),
+    } for i in range(count)]
+
+
+def make_comment_rows(count: int) -> List[dict]:
+    now = datetime(2024, 1, 1, 12, 0, 0)
+    return [{
+        "comment_id": i,
+        "post_id": 1,
+        "user_id": i % 97,
+        "user_name": f"user_{i % 97}",
+        "content": "lol this is so true",
+        "created_at": now - timedelta(minutes=i),
+        "updated_at": now - timedelta(minutes=i),
+        "parent_comment_id": None,
+        "sentiment_label": "neutral",
+        "sentiment_confidence": 0.6123,
+        "is_sarcastic": True,
+        "sarcasm_confidence": 0.7345,
+        "like_count": i % 13,
+        "user_has_liked": bool(i % 2),
+    } for i in range(count)]
+
+
+def standard_encode(adapter: TypeAdapter, rows: List[dict]) -> bytes:
+    validated = adapter.validate_python(rows)
+    content = adapter.dump_python(validated, mode="json", exclude_unset=True)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def fast_encode(adapter: TypeAdapter, rows: List[dict]) -> bytes:
+    return orjson.dumps(rows, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+def measure(encode, adapter: TypeAdapter, rows: List[dict], iterations: int) -> dict:
+    encode(adapter, rows)  # warm up
+    total_bytes = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        total_bytes += len(encode(adapter, rows))
+    elapsed = time.perf_counter() - start
+    return {
+        "us_per_page": round(elapsed / iterations * 1e6, 1),
+        "mb_per_s": round(total_bytes / elapsed / 1e6, 1),
+        "bytes_per_page": total_bytes // iterations,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50, help="items per page")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    if orjson is None:
+        raise SystemExit("orjson is not installed")
+
+    cases = [
+        ("posts", TypeAdapter(List[PostResponse]), make_post_rows(args.rows)),
+        ("comments", TypeAdapter(List[CommentResponse]), make_comment_rows(args.rows)),
+    ]
+
+    results = {}
+    for name, adapter, rows in cases:
+        standard = measure(standard_encode, adapter, rows, args.iterations)
+        fast = measure(fast_encode, adapter, rows, args.iterations)
+        results[name] = {
+            "standard": standard,
+            "orjson": fast,
+            "speedup": round(standard["us_per_page"] / fast["us_per_page"], 1),
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{args.rows} rows/page, {args.iterations} iterations")
+    print(f"{'endpoint':<10} {'path':<9} {'us/page':>10} {'MB/s':>8} {'bytes':>8}")
+    for name, result in results.items():
+        for path in ("standard", "orjson"):
+            r = result[path]
+            print(f"{name:<10} {path:<9} {r['us_per_page']:>10} {r['mb_per_s']:>8} {r['bytes_per_page']:>8}")
+        print(f"{name:<10} speedup   {result['speedup']:>9}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark: how much model traffic the analysis cache absorbs, exact-only
+against near-duplicate matching at a few similarity thresholds.
+
+The corpus is synthetic but shaped like the feed: a pool of base texts with a
+skewed popularity, each request either a verbatim repeat or a variant of one
+(case, punctuation, stretched letters, a different @mention or link, a
+character changed). Reports the share of lookups the cache answered - and so
+the share of forward passes saved - and what a lookup costs.
+
+Usage (from backend/):
+    python -m benchmarks.bench_text_cache --requests 20000 --cache-size 5000
+    python -m benchmarks.bench_text_cache --thresholds 1,0.9,0.85,0.8 --json
+"""
+import argparse
+import json
+import random
+import string
+import time
+from typing import List
+
+from app.utils.fingerprint import NearDuplicateCache
+
+WORDS = (
+    "the a this that my your new old best worst day night game show movie song team food coffee train "
+    "weather update phone city weekend people friends family work school love hate can't believe really "
+    "so just finally again never always today tomorrow great terrible amazing boring happy sad late early"
+).split()
+
+
+def base_texts(count: int, rng: random.Random) -> List[str]:
+    texts = []
+    for _ in range(count):
+        length = rng.choice((2, 3, 5, 8, 12, 20))
+        texts.append(" ".join(rng.choice(WORDS) for _ in range(length)))
+    return texts
+
+
+def variant(text: str, rng: random.Random) -> str:
+    """text as someone else (or a spammer) would post it"""
+    kind = rng.randrange(6)
+    if kind == 0:
+        return text.upper() if rng.random() < 0.5 else text.capitalize()
+    if kind == 1:
+        return text + rng.choice(("!", "!!!", "...", " ?", " :)", " 😂😂😂"))
+    if kind == 2:
+        words = text.split()
+        i = rng.randrange(len(words))
+        words[i] = words[i] + words[i][-1] * rng.randint(2, 5)
+        return " ".join(words)
+    if kind == 3:
+        return f"@user{rng.randrange(10000)} {text}"
+    if kind == 4:
+        return f"{text} https://t.co/{rng.randrange(10 ** 8):x}"
+    i = rng.randrange(len(text))
+    return text[:i] + rng.choice(string.ascii_lowercase) + text[i + 1:]
+
+
+def corpus(requests: int, bases: int, repeat_rate: float, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    pool = base_texts(bases, rng)
+    # Zipf-like popularity, a few texts make up most of the repeats
+    weights = [1 / (rank + 1) for rank in range(bases)]
+    texts = []
+    for base in rng.choices(pool, weights, k=requests):
+        texts.append(base if rng.random() < repeat_rate else variant(base, rng))
+    return texts
+
+
+def run(texts: List[str], cache_size: int, threshold: float) -> dict:
+    cache = NearDuplicateCache(cache_size, threshold)
+    start = time.perf_counter()
+    for text in texts:
+        value, fingerprint = cache.lookup(text)
+        if value is None:
+            cache.store(fingerprint, {"text": text})
+    elapsed = time.perf_counter() - start
+    stats = cache.stats()
+    return {
+        "threshold": threshold,
+        "hit_ratio": stats["hit_ratio"],
+        "exact_hits": stats["exact_hits"],
+        "near_hits": stats["near_hits"],
+        "model_calls": stats["misses"],
+        "us_per_lookup": round(elapsed / len(texts) * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000, help="texts looked up")
+    parser.add_argument("--bases", type=int, default=3000, help="distinct underlying texts")
+    parser.add_argument("--repeat-rate", type=float, default=0.4, help="share of verbatim repeats")
+    parser.add_argument("--cache-size", type=int, default=10000)
+    parser.add_argument("--thresholds", default="1,0.9,0.85,0.8", help="comma-separated, 1 is exact matching only")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    texts = corpus(args.requests, args.bases, args.repeat_rate, args.seed)
+    results = [run(texts, args.cache_size, float(t)) for t in args.thresholds.split(",")]
+
+    if args.json:
+        print(json.dumps({"requests": args.requests, "cache_size": args.cache_size, "results": results}, indent=2))
+        return
+
+    print(f"{args.requests} texts over {args.bases} bases, {args.repeat_rate:.0%} verbatim, cache of {args.cache_size}")
+    print(f"{'threshold':<10} {'hit ratio':>9} {'exact':>7} {'near':>7} {'model calls':>12} {'us/lookup':>10}")
+    for r in results:
+        print(f"{r['threshold']:<10} {r['hit_ratio']:>9} {r['exact_hits']:>7} {r['near_hits']:>7} "
+              f"{r['model_calls']:>12} {r['us_per_lookup']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Query budget check: fails when a list route's SQL statement count grows with
+the size of the page it returns (an N+1), or exceeds the route's @query_budget.
+
+Boots the app like bench_api.py does (fresh SQLite file, stubbed models,
+seeded data) with QUERY_BUDGET_MODE=log, so every response reports its
+X-Query-Count and X-Query-Budget. Each list route is then requested for a
+small and a large page - or, for routes without a page size, for a small and
+a large resource - and the counts compared. Exits with status 1 on any
+failure, to run before deploying.
+
+Usage (from backend/):
+    python -m benchmarks.check_query_budgets
+    python -m benchmarks.check_query_budgets --small 2 --large 25 --json
+    python -m benchmarks.check_query_budgets --database-url "mysql+pymysql://user:pw@localhost/budgets"
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+from collections import Counter
+from typing import Dict, List
+
+from sqlalchemy import create_engine, text
+
+from benchmarks.bench_api import (
+    API, USER_PREFIX, Client, start_server, stop_server, wait_until_ready
+)
+
+STATS = "include=like_count,comment_count,user_has_liked"
+
+# (name, path, sized by) - {n} is the page size; {post} and {user} are filled in with
+# a small and a large resource instead when the route has no page size
+LIST_ROUTES = [
+    ("posts", f"{API}/posts/?limit={{n}}&{STATS}", "page"),
+    ("user_posts", f"{API}/posts/user/{{user}}?limit={{n}}&{STATS}", "page"),
+    ("comments", f"{API}/posts/{{post}}/comments", "post"),
+    ("comment_tree", f"{API}/posts/{{post}}/comments/tree?limit={{n}}&depth=2&replies_limit=3", "page"),
+    ("followers", f"{API}/users/{{user}}/followers?limit={{n}}", "page"),
+    ("following", f"{API}/users/{{user}}/following?limit={{n}}", "page"),
+    ("admin_users", f"{API}/admin/users?limit={{n}}", "page"),
+    ("admin_recent_users", f"{API}/admin/recent-users?limit={{n}}", "page"),
+    ("admin_flagged_posts", f"{API}/admin/flagged-posts?limit={{n}}", "page"),
+    ("admin_moderation", f"{API}/admin/moderation?limit={{n}}", "page"),
+]
+
+
+def count_rows(body) -> int:
+    """Rows in a list response, comment trees counted with their replies"""
+    if isinstance(body, dict):
+        body = body.get("items", body.get("users", []))
+    return sum(1 + count_rows(row.get("replies") or []) for row in body)
+
+
+def measure(client: Client, path: str) -> Dict:
+    client.connection.request("GET", path, headers={"Host": "localhost", "Authorization": f"Bearer {client.token}"})
+    response = client.connection.getresponse()
+    body = response.read()
+    budget = response.getheader("X-Query-Budget")
+    return {
+        "path": path,
+        "status": response.status,
+        "queries": int(response.getheader("X-Query-Count", -1)),
+        "budget": int(budget) if budget is not None else None,
+        "rows": count_rows(json.loads(body)) if response.status == 200 else 0
+    }
+
+
+def prepare(client: Client, database_url: str, flagged: int) -> Dict:
+    """Make the client's user an admin, flag some posts, and pick small and large resources"""
+    engine = create_engine(database_url)
+    with engine.begin() as connection:
+        connection.execute(text("UPDATE users SET is_admin = 1 WHERE user_name = :name"), {"name": f"{USER_PREFIX}0"})
+    engine.dispose()
+
+    client.connection.request("GET", f"{API}/posts/?limit=1000&include=comment_count", headers={"Host": "localhost"})
+    posts = json.loads(client.connection.getresponse().read())
+    for post in posts[:flagged]:
+        client.request("POST", f"{API}/posts/{post['post_id']}/flag")
+
+    commented = sorted((p for p in posts if p["comment_count"]), key=lambda p: p["comment_count"])
+    if not commented:
+        raise SystemExit("No commented posts to check, seed more comments")
+    authors = Counter(p["user_id"] for p in posts).most_common()
+    return {
+        "small": {"post": commented[0]["post_id"], "user": authors[-1][0]},
+        "large": {"post": commented[-1]["post_id"], "user": authors[0][0]},
+    }
+
+
+def check(client: Client, resources: Dict, small: int, large: int) -> List[Dict]:
+    results = []
+    for name, template, sized_by in LIST_ROUTES:
+        a = measure(client, template.format(n=small, **resources["large" if sized_by == "page" else "small"]))
+        b = measure(client, template.format(n=large, **resources["large"]))
+        problems = []
+        for run in (a, b):
+            if run["status"] != 200:
+                problems.append(f"{run['path']} returned {run['status']}")
+            elif run["budget"] is not None and run["queries"] > run["budget"]:
+                problems.append(f"{run['queries']} queries over its budget of {run['budget']}")
+        if a["budget"] is None:
+            problems.append("no @query_budget declared")
+        inconclusive = not problems and b["rows"] <= a["rows"]
+        if not problems and not inconclusive and b["queries"] > a["queries"]:
+            problems.append(f"{a['queries']} queries for {a['rows']} rows but {b['queries']} for {b['rows']}")
+        results.append({
+            "route": name,
+            "small": a,
+            "large": b,
+            "inconclusive": inconclusive,
+            "problems": problems
+        })
+    return results
+
+
+def print_results(results: List[Dict]):
+    print(f"{'route':<22} {'rows':>11} {'queries':>9} {'budget':>7}  result")
+    for r in results:
+        a, b = r["small"], r["large"]
+        outcome = "; ".join(r["problems"]) or ("inconclusive, the large page has no more rows" if r["inconclusive"] else "ok")
+        print(f"{r['route']:<22} {a['rows']:>5} {b['rows']:>5} {a['queries']:>4} {b['queries']:>4} "
+              f"{str(a['budget']):>7}  {outcome}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="SQLAlchemy URL of the database to seed and serve, default a fresh SQLite file")
+    parser.add_argument("--small", type=int, default=2, help="rows in the small page")
+    parser.add_argument("--large", type=int, default=10, help="rows in the large page")
+    parser.add_argument("--users", type=int, default=30)
+    parser.add_argument("--posts", type=int, default=60)
+    parser.add_argument("--comments-per-post", type=int, default=20, help="at most, random per post")
+    parser.add_argument("--likes-per-post", type=int, default=10, help="at most, random per post")
+    parser.add_argument("--follows-per-user", type=int, default=15)
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="check_query_budgets_")
+    args.database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'budgets.db')}"
+    args.models, args.workers, args.model_latency_ms, args.model_text_latency_ms = "stub", 1, 0, 0
+    os.environ["QUERY_BUDGET_MODE"] = "log"
+
+    process, base_url, log_path = start_server(args, workdir)
+    try:
+        wait_until_ready(base_url, args.startup_timeout, process)
+        client = Client(base_url)
+        client.login(f"{USER_PREFIX}0")
+        resources = prepare(client, args.database_url, flagged=args.large + 2)
+        results = check(client, resources, args.small, args.large)
+    except RuntimeError as e:
+        print(f"Server log: {log_path}", file=sys.stderr)
+        raise SystemExit(str(e))
+    finally:
+        stop_server(process)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+    failed = [r["route"] for r in results if r["problems"]]
+    if failed:
+        print(f"{len(failed)} routes failed their query budget check: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Streaming check: fails when a streamed response reaches a client that
+accepts compression in one burst at the end instead of line by line.
+
+Boots the app like bench_api.py does (fresh SQLite file, stubbed models with
+a delay per forward pass, seeded data), then reads a streamed batch analysis
+(POST /posts/analyze/batch with stream=true) and an admin export with
+Accept-Encoding: gzip, br, timing each NDJSON line as it arrives. The batch
+runs one forward pass per ANALYZE_MICRO_BATCH_SIZE texts, so its first line
+should arrive well before the last. Exits with status 1 on any failure.
+
+Usage (from backend/):
+    python -m benchmarks.check_streaming
+    python -m benchmarks.check_streaming --texts 32 --model-latency-ms 200 --json
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+from typing import Dict, List, Optional
+
+from sqlalchemy import create_engine, text
+
+from benchmarks.bench_api import (
+    API, SAMPLE_TEXTS, USER_PREFIX, Client, start_server, stop_server, wait_until_ready
+)
+
+ACCEPT_ENCODING = "gzip, br"
+
+
+def read_lines(client: Client, method: str, path: str, body: Optional[dict] = None) -> Dict:
+    """Send a request and record when each line of the response body arrived, in seconds"""
+    headers = {"Host": "localhost", "Accept-Encoding": ACCEPT_ENCODING}
+    if client.token:
+        headers["Authorization"] = f"Bearer {client.token}"
+    payload = None
+    if body is not None:
+        payload = json.dumps(body)
+        headers["Content-Type"] = "application/json"
+
+    started = time.perf_counter()
+    client.connection.request(method, path, payload, headers)
+    response = client.connection.getresponse()
+    encoding = response.getheader("Content-Encoding")
+    # Compressed lines can only be timed if the server flushed them, decode as they come
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS) if encoding == "gzip" else None
+
+    arrivals, buffered = [], b""
+    while True:
+        chunk = response.read1(65536)
+        if not chunk:
+            break
+        if encoding == "br":
+            buffered += chunk  # Can't decode br without brotli, count the lines at the end
+            continue
+        buffered += decoder.decompress(chunk) if decoder else chunk
+        now = time.perf_counter() - started
+        arrivals += [now] * buffered.count(b"\n")
+        buffered = buffered[buffered.rfind(b"\n") + 1:]
+    if encoding == "br":
+        import brotli
+        arrivals = [time.perf_counter() - started] * brotli.decompress(buffered).count(b"\n")
+
+    return {
+        "path": path,
+        "status": response.status,
+        "content_encoding": encoding,
+        "lines": len(arrivals),
+        "first_line_s": round(arrivals[0], 3) if arrivals else None,
+        "last_line_s": round(arrivals[-1], 3) if arrivals else None,
+    }
+
+
+def check_batch(client: Client, texts: int, micro_batch_size: int) -> Dict:
+    body = {"texts": [SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)] for i in range(texts)], "stream": True}
+    run = read_lines(client, "POST", f"{API}/posts/analyze/batch", body)
+    problems = []
+    if run["status"] != 200:
+        problems.append(f"returned {run['status']}")
+    elif run["lines"] != texts:
+        problems.append(f"{run['lines']} lines for {texts} texts")
+    elif texts > micro_batch_size and run["first_line_s"] >= run["last_line_s"] * 0.75:
+        problems.append(f"first line after {run['first_line_s']}s, last after {run['last_line_s']}s: not streamed")
+    if run["content_encoding"]:
+        problems.append(f"compressed with {run['content_encoding']}")
+    return {"route": "analyze_batch", **run, "problems": problems}
+
+
+def check_export(client: Client) -> Dict:
+    run = read_lines(client, "GET", f"{API}/admin/export?kind=posts&format=ndjson")
+    problems = []
+    if run["status"] != 200:
+        problems.append(f"returned {run['status']}")
+    elif not run["lines"]:
+        problems.append("no lines")
+    if run["content_encoding"]:
+        problems.append(f"compressed with {run['content_encoding']}")
+    return {"route": "admin_export", **run, "problems": problems}
+
+
+def print_results(results: List[Dict]):
+    print(f"{'route':<15} {'lines':>6} {'first':>7} {'last':>7} {'encoding':>9}  result")
+    for r in results:
+        print(f"{r['route']:<15} {r['lines']:>6} {str(r['first_line_s']):>7} {str(r['last_line_s']):>7} "
+              f"{str(r['content_encoding']):>9}  {'; '.join(r['problems']) or 'ok'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="SQLAlchemy URL of the database to seed and serve, default a fresh SQLite file")
+    parser.add_argument("--texts", type=int, default=32, help="texts in the streamed batch, at most ANALYZE_MAX_BATCH_SIZE")
+    parser.add_argument("--micro-batch-size", type=int, default=8, help="the server's ANALYZE_MICRO_BATCH_SIZE")
+    parser.add_argument("--model-latency-ms", type=float, default=150, help="stub forward pass time")
+    parser.add_argument("--model-text-latency-ms", type=float, default=5, help="stub forward pass time per text")
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="check_streaming_")
+    args.database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'streaming.db')}"
+    args.models, args.workers = "stub", 1
+    args.users, args.posts, args.comments_per_post, args.likes_per_post, args.follows_per_user = 2, 20, 0, 0, 0
+    # Compression on, with every line of the stream above the size it starts at
+    os.environ.update(
+        COMPRESSION_ENABLED="true",
+        COMPRESSION_MIN_SIZE="1",
+        ANALYZE_MICRO_BATCH_SIZE=str(args.micro_batch_size)
+    )
+
+    process, base_url, log_path = start_server(args, workdir)
+    try:
+        wait_until_ready(base_url, args.startup_timeout, process)
+        engine = create_engine(args.database_url)
+        with engine.begin() as connection:
+            connection.execute(text("UPDATE users SET is_admin = 1 WHERE user_name = :name"), {"name": f"{USER_PREFIX}0"})
+        engine.dispose()
+        client = Client(base_url)
+        client.login(f"{USER_PREFIX}0")
+        results = [check_batch(client, args.texts, args.micro_batch_size), check_export(client)]
+    except (RuntimeError, OSError, http.client.HTTPException) as e:
+        print(f"Server log: {log_path}", file=sys.stderr)
+        raise SystemExit(str(e))
+    finally:
+        stop_server(process)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+    failed = [r["route"] for r in results if r["problems"]]
+    if failed:
+        print(f"{len(failed)} streamed routes failed: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Stand-ins for the transformer models, for benchmarks that measure the API
+rather than inference.
+
+StubAnalysisService has the interface of AIAnalysisService and returns
+deterministic analyses after a configurable delay per forward pass, so
+requests still queue for the inference threads like they would for the real
+models. install_stub_models() must run before anything imports app.services.
+"""
+from typing import Dict, List
+import sys
+import time
+import types
+import zlib
+
+SENTIMENTS = ("negative", "neutral", "positive")
+
+
+def stub_analysis(text: str, model_revision: str) -> Dict:
+    """A deterministic analysis of text, about a third of each sentiment and a few sarcastic"""
+    digest = zlib.crc32(text.encode("utf-8"))
+    label = SENTIMENTS[digest % 3]
+    sarcastic = digest % 17 == 0
+    sentiment = {
+        "sentiment_label": label,
+        "confidence": round(0.5 + (digest % 50) / 100, 4),
+        "is_positive": label == "positive",
+        "is_negative": label == "negative",
+        "is_neutral": label == "neutral"
+    }
+    sarcasm = {"is_sarcastic": sarcastic, "confidence": 0.8}
+    return {
+        "text": text,
+        "sentiment": sentiment,
+        "sarcasm": sarcasm,
+        "needs_review": label == "negative" and sentiment["confidence"] > 0.9,
+        "model_revision": model_revision
+    }
+
+
+class StubAnalysisService:
+    """AIAnalysisService without the models: each forward pass takes base + per-text seconds"""
+
+    base_latency = 0.0
+    per_text_latency = 0.0
+
+    def __init__(self, spec=None):
+        self.spec = spec
+        self.model_revision = f"stub;{spec.sentiment_model};{spec.sarcasm_model}" if spec else "stub"
+        self.analysis_cache = None
+        self.cascade = None
+
+    def share_memory(self) -> bool:
+        return False
+
+    def _forward(self, texts: int):
+        time.sleep(self.base_latency + self.per_text_latency * texts)
+
+    def analyze_text_complete(self, text: str) -> Dict:
+        # Two models, two forward passes
+        self._forward(1)
+        self._forward(1)
+        return stub_analysis(text, self.model_revision)
+
+    def analyze_texts_complete(self, texts: List[str]) -> List[Dict]:
+        self._forward(len(texts))
+        self._forward(len(texts))
+        return [stub_analysis(text, self.model_revision) for text in texts]
+
+
+def install_stub_models(base_latency: float = 0.02, per_text_latency: float = 0.005):
+    """Serve StubAnalysisService through the real ModelRegistry in place of the transformer models"""
+    if "app.services.ai_service" in sys.modules:
+        raise RuntimeError("install_stub_models() must run before app.services is imported")
+
+    StubAnalysisService.base_latency = base_latency
+    StubAnalysisService.per_text_latency = per_text_latency
+    module = types.ModuleType("app.services.ai_service")
+    module.AIAnalysisService = StubAnalysisService
+    module.ai_service = None  # Filled in below, app.services imports the name while ModelRegistry is imported
+    sys.modules["app.services.ai_service"] = module
+
+    from app.services.model_registry import ModelRegistry, ModelSpec
+
+    module.ModelSpec = ModelSpec
+    module.ai_service = ModelRegistry(StubAnalysisService)
+    sys.modules["app.services"].ai_service = module.ai_service
+    return module.ai_service
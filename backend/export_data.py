@@ -0,0 +1,32 @@
+import argparse
+import sys
+from datetime import datetime
+from app.database import SessionLocal
+from app.utils.export import EXPORT_KINDS, EXPORT_FORMATS, iter_export_rows, iter_export_chunks
+
+def export_data(kind, fmt, output, since=None, until=None, sentiment=None, batch_size=1000):
+    """Stream posts or comments with analysis fields to output in constant memory"""
+    db = SessionLocal()
+    try:
+        rows = iter_export_rows(db, kind, batch_size=batch_size, since=since, until=until, sentiment=sentiment)
+        for chunk in iter_export_chunks(rows, fmt, kind):
+            output.write(chunk)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export posts or comments with their sentiment/sarcasm analysis")
+    parser.add_argument("kind", choices=EXPORT_KINDS)
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="created at or after (ISO date)")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="created before (ISO date)")
+    parser.add_argument("--sentiment", choices=["positive", "neutral", "negative"])
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows fetched per cursor round trip")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    args = parser.parse_args()
+
+    if args.output:
+        with open(args.output, "wb") as output:
+            export_data(args.kind, args.format, output, args.since, args.until, args.sentiment, args.batch_size)
+    else:
+        export_data(args.kind, args.format, sys.stdout.buffer, args.since, args.until, args.sentiment, args.batch_size)
@@ -1,11 +1,27 @@
+import argparse
 import uvicorn
-from app.main import app
+from app.config import settings
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "app.main:app",
-        host="0.0.0.0",
-        port=8001,
-        reload=True,
-        log_level="info"
+    parser = argparse.ArgumentParser(description="Run the API server")
+    parser.add_argument(
+        "--production",
+        action="store_true",
+        help="load the AI models once and fork workers that share them, instead of the auto-reloading dev server"
     )
+    parser.add_argument("--workers", type=int, default=settings.SERVER_WORKERS)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+
+    if args.production:
+        from app.utils.prefork import serve
+        serve("app.main:app", args.host, args.port, args.workers)
+    else:
+        uvicorn.run(
+            "app.main:app",
+            host=args.host,
+            port=args.port,
+            reload=True,
+            log_level="info"
+        )
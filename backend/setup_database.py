@@ -1,13 +1,26 @@
-from app.database import engine, Base
+from sqlalchemy import Index, func, inspect
+from app.database import engine, Base, SessionLocal
 from app.models.user import User
 from app.models.post import Post
-from app.models.comment import Comment
+from app.models.comment import Comment, comment_path
 from app.models.user_relation import UserRelation
+from app.models.session import UserSession
+from app.models.moderation import ModerationItem, MODERATION_REASON_FLAGGED, MODERATION_REASON_AI
+from app.models.moderation_rule import ModerationRule
+from app.models.model_version import ModelVersion
+from app.utils.moderation import enqueue_moderation, reevaluate_needs_review, FLAGGED_PRIORITY
+from app.utils.rules import seed_default_rules, get_active_ruleset
+from app.utils.like_aggregator import refresh_post_like_counts
 
 def create_tables():
     """Create all database tables"""
     print("Creating database tables...")
     Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        seed_default_rules(db)
+    finally:
+        db.close()
     print("Database tables created successfully!")
 
 def drop_tables():
@@ -16,10 +29,134 @@ def drop_tables():
     Base.metadata.drop_all(bind=engine)
     print("Database tables dropped successfully!")
 
+def backfill_comment_paths():
+    """Fill path/depth for comments created before threaded loading existed"""
+    print("Backfilling comment paths...")
+    db = SessionLocal()
+    try:
+        paths = dict(db.query(Comment.comment_id, Comment.path).filter(Comment.path.isnot(None)).all())
+        depths = dict(db.query(Comment.comment_id, Comment.depth).filter(Comment.path.isnot(None)).all())
+
+        # A reply always has a larger id than its parent, so parents are filled first
+        updated = 0
+        for comment in db.query(Comment).filter(Comment.path.is_(None)).order_by(Comment.comment_id).yield_per(1000):
+            parent_id = comment.parent_comment_id
+            comment.path = comment_path(paths.get(parent_id) if parent_id else None, comment.comment_id)
+            comment.depth = depths.get(parent_id, -1) + 1 if parent_id else 0
+            paths[comment.comment_id] = comment.path
+            depths[comment.comment_id] = comment.depth
+            updated += 1
+
+        db.commit()
+        print(f"Backfilled {updated} comments")
+    finally:
+        db.close()
+
+def backfill_like_counts():
+    """Fill posts.like_count for databases created before the counter existed"""
+    print("Backfilling post like counts...")
+    db = SessionLocal()
+    try:
+        post_ids = [post_id for (post_id,) in db.query(Post.post_id).all()]
+        for start in range(0, len(post_ids), 1000):
+            refresh_post_like_counts(db, post_ids[start:start + 1000])
+        db.commit()
+        print(f"Backfilled {len(post_ids)} posts")
+    finally:
+        db.close()
+
+def backfill_moderation_queue():
+    """Queue content that was flagged or needs review before the moderation queue existed"""
+    print("Backfilling moderation queue...")
+    db = SessionLocal()
+    try:
+        queued = 0
+        flagged = db.query(Post.post_id).filter(Post.is_deleted == False, Post.is_flagged == True)
+        for (post_id,) in flagged.all():
+            enqueue_moderation(db, "post", post_id, post_id, MODERATION_REASON_FLAGGED, FLAGGED_PRIORITY)
+            queued += 1
+
+        # Rows analyzed before needs_review was stored are checked against the moderation rules
+        seed_default_rules(db)
+        ruleset = get_active_ruleset(db)
+
+        def needs_review(model):
+            return (model.needs_review == True) | (model.needs_review.is_(None) & ruleset.sql_predicate(model))
+
+        posts = db.query(Post.post_id, Post.sentiment_confidence).filter(Post.is_deleted == False, needs_review(Post))
+        for post_id, confidence in posts.all():
+            enqueue_moderation(db, "post", post_id, post_id, MODERATION_REASON_AI, round((confidence or 0) * 100))
+            queued += 1
+        comments = db.query(Comment.comment_id, Comment.post_id, Comment.sentiment_confidence).filter(needs_review(Comment))
+        for comment_id, post_id, confidence in comments.all():
+            enqueue_moderation(db, "comment", comment_id, post_id, MODERATION_REASON_AI, round((confidence or 0) * 100))
+            queued += 1
+
+        db.commit()
+        print(f"Queued {queued} items")
+    finally:
+        db.close()
+
+def dedupe_follows():
+    """Drop repeated follows and add the unique constraint that create_all skips on existing tables"""
+    print("Deduplicating follows...")
+    db = SessionLocal()
+    try:
+        # The first follow of each pair is kept
+        pairs = db.query(
+            UserRelation.follower_id,
+            UserRelation.followed_id,
+            func.min(UserRelation.relation_id)
+        ).group_by(UserRelation.follower_id, UserRelation.followed_id).having(func.count() > 1).all()
+        removed = 0
+        for follower_id, followed_id, kept_id in pairs:
+            removed += db.query(UserRelation).filter(
+                UserRelation.follower_id == follower_id,
+                UserRelation.followed_id == followed_id,
+                UserRelation.relation_id != kept_id
+            ).delete(synchronize_session=False)
+        db.commit()
+        print(f"Removed {removed} repeated follows")
+    finally:
+        db.close()
+
+    inspector = inspect(engine)
+    existing = {c["name"] for c in inspector.get_unique_constraints("user_relations")}
+    existing |= {i["name"] for i in inspector.get_indexes("user_relations") if i["unique"]}
+    if "unique_follower_followed" in existing:
+        print("unique_follower_followed already exists")
+        return
+    # A unique index is how MySQL stores the constraint; SQLite can't add constraints to a table
+    Index("unique_follower_followed", UserRelation.follower_id, UserRelation.followed_id, unique=True).create(bind=engine)
+    print("Added unique_follower_followed")
+
+def reevaluate_moderation():
+    """Re-apply the moderation rules to every stored analysis"""
+    print("Re-evaluating moderation rules...")
+    db = SessionLocal()
+    try:
+        seed_default_rules(db)
+        ruleset = get_active_ruleset(db)
+        for content_type in ("post", "comment"):
+            result = reevaluate_needs_review(db, ruleset, content_type)
+            print(f"{content_type}s: scanned {result['scanned']}, flagged {result['flagged']}, cleared {result['cleared']}")
+    finally:
+        db.close()
+
 if __name__ == "__main__":
     import sys
 
     if len(sys.argv) > 1 and sys.argv[1] == "drop":
         drop_tables()
+    elif len(sys.argv) > 1 and sys.argv[1] == "backfill-comment-paths":
+        backfill_comment_paths()
+    elif len(sys.argv) > 1 and sys.argv[1] == "backfill-like-counts":
+        backfill_like_counts()
+    elif len(sys.argv) > 1 and sys.argv[1] == "backfill-moderation-queue":
+        backfill_moderation_queue()
+    elif len(sys.argv) > 1 and sys.argv[1] == "dedupe-follows":
+        dedupe_follows()
+    elif len(sys.argv) > 1 and sys.argv[1] == "reevaluate-moderation":
+        reevaluate_moderation()
     else:
         create_tables()
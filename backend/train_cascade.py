@@ -0,0 +1,78 @@
+import argparse
+import random
+from app.config import settings
+from app.database import SessionLocal
+from app.models.post import Post
+from app.models.comment import Comment
+from app.models.model_version import ModelVersion, MODEL_ACTIVE
+from app.utils.cascade import CascadeModel, evaluate
+
+# (sentiment, sarcasm) confidence gates the holdout evaluation reports
+EVALUATION_GATES = [(sentiment, sarcasm) for sentiment in (0.7, 0.8, 0.9, 0.95) for sarcasm in (0.9, 0.95, 0.98)]
+
+def load_training_data(db, revision, batch_size=1000):
+    """Texts and the stored analyses the given models produced for them, posts and comments alike"""
+    texts, sentiments, sarcastic = [], [], []
+    for model in (Post, Comment):
+        rows = (
+            db.query(model.content, model.sentiment_label, model.is_sarcastic)
+            .filter(model.analysis_revision == revision, model.sentiment_label.isnot(None))
+            .yield_per(batch_size)
+        )
+        for content, label, is_sarcastic in rows:
+            if content and content.strip():
+                texts.append(content)
+                sentiments.append(label)
+                sarcastic.append(bool(is_sarcastic))
+    return texts, sentiments, sarcastic
+
+def train_cascade(output, revision=None, holdout=0.1, epochs=6, min_samples=1000, seed=1):
+    """Train the first-pass classifiers on stored analyses of the active models and report agreement per gate"""
+    db = SessionLocal()
+    try:
+        if revision is None:
+            active = db.query(ModelVersion).filter(ModelVersion.status == MODEL_ACTIVE).order_by(ModelVersion.version_id.desc()).first()
+            if active is None or active.model_revision is None:
+                raise SystemExit("No active model version with a known revision, start the API once or pass --revision")
+            revision = active.model_revision
+        # Only analyses by the models themselves: cascade answers carry a revision of their own
+        texts, sentiments, sarcastic = load_training_data(db, revision)
+    finally:
+        db.close()
+
+    print(f"{len(texts)} analyses by {revision}")
+    if len(texts) < min_samples:
+        raise SystemExit(f"Need at least {min_samples} analyses to train on")
+
+    order = list(range(len(texts)))
+    random.Random(seed).shuffle(order)
+    split = int(len(order) * (1 - holdout))
+    train, test = order[:split], order[split:]
+
+    model = CascadeModel.train(
+        [texts[i] for i in train], [sentiments[i] for i in train], [sarcastic[i] for i in train],
+        revision, epochs=epochs
+    )
+    results = evaluate(
+        model, [texts[i] for i in test], [sentiments[i] for i in test], [sarcastic[i] for i in test], EVALUATION_GATES
+    )
+    model.meta["evaluation"] = results
+    model.save(output)
+
+    print(f"Holdout of {len(test)} texts (answered = share the cascade would take off the models)")
+    print(f"{'sentiment':>9} {'sarcasm':>8} {'answered':>9} {'sentiment agrees':>17} {'sarcasm agrees':>15}")
+    for r in results:
+        print(f"{r['sentiment_confidence']:>9} {r['sarcasm_confidence']:>8} {r['answered']:>9} "
+              f"{str(r['sentiment_agreement']):>17} {str(r['sarcasm_agreement']):>15}")
+    print(f"Saved to {output}; set CASCADE_MODEL_PATH and pick the CASCADE_*_CONFIDENCE gates from the table")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the first-pass cascade classifiers on stored analyses")
+    parser.add_argument("-o", "--output", default=settings.CASCADE_MODEL_PATH or "cascade.npz")
+    parser.add_argument("--revision", help="model_revision to imitate (default: the active model version's)")
+    parser.add_argument("--holdout", type=float, default=0.1, help="share of analyses kept back for evaluation")
+    parser.add_argument("--epochs", type=int, default=6)
+    parser.add_argument("--min-samples", type=int, default=1000)
+    args = parser.parse_args()
+
+    train_cascade(args.output, args.revision, args.holdout, args.epochs, args.min_samples)
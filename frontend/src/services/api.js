@@ -155,7 +155,9 @@ class ApiService {
     }
 
     async analyzeText(text) {
-        return this.request(`/posts/analyze?text=${encodeURIComponent(text)}`, {
+        return this.request("/posts/analyze", {
+            method: "POST",
+            body: JSON.stringify({ text }),
             skipAuth: true,
         });
     }